@@ -0,0 +1,252 @@
+"""
+End-to-end benchmarks of the wrapper against a local `StandInServer`, so the results do not depend on the network.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline baseline.json --threshold 0.25 --threshold send.top1000.p50_ms=0.5
+
+Every result is {'value': ..., 'unit': ..., 'better': 'lower' or 'higher'}. With `--baseline`, results worse than
+the baseline by more than the threshold (a fraction, 0.2 - 20 % by default) are reported as regressions and the
+exit code is 1. Save the output of a release as the baseline of the next one.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+from datetime import datetime
+
+from copernicus_odata_wrapper.query import Query
+from copernicus_odata_wrapper.client import Client
+from copernicus_odata_wrapper.filter import Filter
+from copernicus_odata_wrapper.standin import SyntheticCatalogue, StandInServer
+import copernicus_odata_wrapper.attributes as Atr
+
+PAGE_SIZES = [10, 100, 1000]
+CHUNK_SIZES = [1, 10, 100]
+DEFAULT_THRESHOLD = 0.2
+
+
+def _result(value: float, unit: str, better: str = 'lower') -> dict:
+    return {'value': value, 'unit': unit, 'better': better}
+
+
+def _timings(function, repeat: int) -> [float]:
+    """
+    :return: Seconds of every call of `function()`, after a warm-up call.
+    """
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _latency(name: str, timings: [float], items: int, item_unit: str) -> dict:
+    timings = sorted(timings)
+    total = sum(timings)
+    return {f'{name}.p50_ms': _result(statistics.median(timings) * 1000, 'ms'),
+            f'{name}.p95_ms': _result(timings[int(0.95 * (len(timings) - 1))] * 1000, 'ms'),
+            f'{name}.{item_unit}_per_s': _result(items * len(timings) / total, f'{item_unit}/s', 'higher')}
+
+
+def bench_send(query: Query, repeat: int) -> dict:
+    results = {}
+    for top in PAGE_SIZES:
+        query.clear()
+        query.set_top(top)
+        results.update(_latency(f'send.top{top}', _timings(query.send, repeat), top, 'products'))
+    return results
+
+
+def bench_pages(query: Query, size: int, repeat: int) -> dict:
+    results = {}
+    for top in PAGE_SIZES:
+        query.clear()
+        query.set_top(top)
+        query.set_orderby('ContentDate/Start', ascending=True)
+        max_pages = max(min(size, top * 50) // top, 1)  # long enough to measure, short enough for the small pages
+        counts = []
+        timings = _timings(lambda: counts.append(sum(1 for _ in query.products(max_pages=max_pages))),
+                           max(repeat // 10, 1))
+        results[f'pages.top{top}.products_per_s'] = _result(counts[-1] * len(timings) / sum(timings), 'products/s',
+                                                            'higher')
+    return results
+
+
+def bench_by_names(query: Query, names: [str], repeat: int) -> dict:
+    results = {}
+    for chunk in CHUNK_SIZES:
+        results.update(_latency(f'by_names.chunk{chunk}', _timings(lambda: query.by_names(names[:chunk]), repeat),
+                                chunk, 'names'))
+    return results
+
+
+def bench_memory(query: Query) -> dict:
+    results = {}
+    query.clear()
+    query.set_top(1000)
+    query.set_expand(attributes=True)
+    query.send()
+
+    tracemalloc.start()
+    try:
+        response = query.send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results['memory.expanded_page.top1000.peak_mb'] = _result(peak / 2 ** 20, 'MB')
+    results['memory.expanded_page.top1000.kb_per_product'] = _result(peak / 1024 / len(response['value']), 'KB')
+    return results
+
+
+def _attribute_filter() -> Filter:
+    f = Filter()
+    f.by_sensing_date(datetime(2023, 7, 1), datetime(2023, 7, 2), full_day=True)
+    f.And()
+    f.by_geographic_criteria('POLYGON((69.0 61.0, 70.0 61.0, 70.0 60.0, 69.0 60.0, 69.0 61.0))')
+    f.And()
+    f.collection('SENTINEL-2')
+    f.And()
+    f.by_attribute([Atr.CloudCover() < 10.0,
+                    Atr.ProductType() == 'S2MSI2A',
+                    Atr.OrbitDirection() == 'ASCENDING',
+                    Atr.RelativeOrbitNumber() == 20,
+                    Atr.BeginningDateTime() >= datetime(2023, 7, 1)])
+    return f
+
+
+def _names_filter(names: [str]) -> Filter:
+    f = Filter()
+    for i, name in enumerate(names):
+        if i:
+            f.Or()
+        f.by_name(name)
+    return f
+
+
+def bench_filters(names: [str], repeat: int) -> dict:
+    results = {}
+    number = repeat * 100
+    started = time.perf_counter()
+    for _ in range(number):
+        _attribute_filter()
+    results['filter.build.attributes_us'] = _result((time.perf_counter() - started) / number * 10 ** 6, 'us')
+
+    names = names[:100]
+    number = repeat * 10
+    started = time.perf_counter()
+    for _ in range(number):
+        _names_filter(names)
+    results['filter.build.names100_us'] = _result((time.perf_counter() - started) / number * 10 ** 6, 'us')
+    return results
+
+
+def run(size: int = 5000, repeat: int = 50, latency: float = 0.0) -> dict:
+    """
+    Runs all the benchmarks.
+    :param size: Number of products of the synthetic catalogue.
+    :param repeat: Number of measured calls per benchmark.
+    :param latency: Seconds every response of the server is delayed by.
+    :return: {'meta': {...}, 'results': {name: {'value': ..., 'unit': ..., 'better': ...}}}
+    """
+    catalogue = SyntheticCatalogue(size=size)
+    names = [product['Name'] for product in catalogue.products[:max(CHUNK_SIZES)]]
+
+    with StandInServer(catalogue, latency=latency) as server:
+        client = Client()
+        client.endpoint = server.endpoint
+        client.endpoint_zipper = server.endpoint
+        query = Query(client)
+
+        results = {}
+        results.update(bench_send(query, repeat))
+        results.update(bench_pages(query, size, repeat))
+        results.update(bench_by_names(query, names, repeat))
+        results.update(bench_memory(query))
+        client.close()
+    results.update(bench_filters(names, repeat))
+
+    return {'meta': {'created': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'size': size,
+                     'repeat': repeat,
+                     'latency': latency},
+            'results': results}
+
+
+def compare(results: dict, baseline: dict, thresholds: dict or None = None,
+            default_threshold: float = DEFAULT_THRESHOLD) -> [dict]:
+    """
+    :param results: Output of `run()`.
+    :param baseline: Output of `run()` saved earlier.
+    :param thresholds: {result name: allowed fraction of worsening} overriding `default_threshold`.
+    :param default_threshold: Allowed fraction of worsening, i.e. 0.2 - a 20 % slower result is a regression.
+    :return: Regressions: [{'name': ..., 'baseline': ..., 'value': ..., 'change': fraction of worsening}]
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or not base['value']:
+            continue
+        if result['better'] == 'lower':
+            change = (result['value'] - base['value']) / base['value']
+        else:
+            change = (base['value'] - result['value']) / base['value']
+        if change > thresholds.get(name, default_threshold):
+            regressions.append({'name': name, 'baseline': base['value'], 'value': result['value'], 'change': change})
+    return regressions
+
+
+def _thresholds(values: [str]) -> (float, dict):
+    default = DEFAULT_THRESHOLD
+    thresholds = {}
+    for value in values:
+        name, _, fraction = value.rpartition('=')
+        if name:
+            thresholds[name] = float(fraction)
+        else:
+            default = float(fraction)
+    return default, thresholds
+
+
+def main(argv: [str] or None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=5000, help='number of products of the synthetic catalogue')
+    parser.add_argument('--repeat', type=int, default=50, help='number of measured calls per benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every response is delayed by')
+    parser.add_argument('--output', help='path of the JSON file to save the results to')
+    parser.add_argument('--baseline', help='path of the results to compare with')
+    parser.add_argument('--threshold', action='append', default=[],
+                        help='allowed fraction of worsening: 0.2 (all results) or name=0.5 (one result)')
+    arguments = parser.parse_args(argv)
+
+    results = run(size=arguments.size, repeat=arguments.repeat, latency=arguments.latency)
+    for name, result in results['results'].items():
+        print(f'{name:50} {result["value"]:14.3f} {result["unit"]}')
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        default, thresholds = _thresholds(arguments.threshold)
+        regressions = compare(results, baseline, thresholds, default)
+        for regression in regressions:
+            print(f'REGRESSION {regression["name"]}: {regression["baseline"]:.3f} -> {regression["value"]:.3f} '
+                  f'({regression["change"]:+.0%})')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+from .errors import CircuitOpen
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single endpoint host. Outcomes of the requests are tracked over the last `window` seconds:
+        closed - requests are allowed. When at least `min_calls` were made and the share of failures reaches
+                 `error_rate`, the breaker opens.
+        open - requests fail immediately with `CircuitOpen`. After `open_for` seconds the breaker becomes half-open.
+        half_open - up to `half_open_calls` trial requests are allowed. A success closes the breaker, a failure
+                    opens it again.
+
+    A failure is a connection error, a timeout, a 5xx response or a request slower than `slow_call` seconds. Errors
+    reported by the API itself (i.e. `NotFound`) mean the endpoint is healthy.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window: float = 60.0, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call: float or None = None, open_for: float = 30.0, half_open_calls: int = 1):
+        """
+        :param window: Seconds over which the outcomes are tracked.
+        :param min_calls: Minimum number of requests in the window to open the breaker.
+        :param error_rate: Share of failures (0 - 1) to open the breaker.
+        :param slow_call: Latency in seconds from which a request counts as failed. None - latency is not checked.
+        :param open_for: Seconds the breaker stays open before trial requests are allowed.
+        :param half_open_calls: Number of concurrent trial requests in the half-open state.
+        """
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.open_for = open_for
+        self.half_open_calls = half_open_calls
+
+        self.__lock = threading.Lock()
+        self.__calls = deque()  # (time, failed, latency)
+        self.__state = self.CLOSED
+        self.__opened_at = None
+        self.__trials = 0
+
+    def __expire(self, now: float) -> None:
+        while self.__calls and self.__calls[0][0] < now - self.window:
+            self.__calls.popleft()
+
+    def __open(self, now: float) -> None:
+        self.__state = self.OPEN
+        self.__opened_at = now
+        self.__trials = 0
+
+    @property
+    def state(self) -> str:
+        with self.__lock:
+            if self.__state == self.OPEN and time.monotonic() - self.__opened_at >= self.open_for:
+                return self.HALF_OPEN
+            return self.__state
+
+    def acquire(self) -> None:
+        """
+        Checks that a request may be sent. Must be followed by `record()`.
+        :return: None - if the request is allowed, otherwise `CircuitOpen` is raised.
+        """
+        now = time.monotonic()
+        with self.__lock:
+            if self.__state == self.OPEN:
+                remaining = self.open_for - (now - self.__opened_at)
+                if remaining > 0:
+                    raise CircuitOpen(f'The circuit is open for another {remaining:.1f} s')
+                self.__state = self.HALF_OPEN
+
+            if self.__state == self.HALF_OPEN:
+                if self.__trials >= self.half_open_calls:
+                    raise CircuitOpen('The circuit is half-open and the trial requests are in flight')
+                self.__trials += 1
+
+    def record(self, failed: bool, latency: float) -> None:
+        """
+        :param failed: True - if the request failed.
+        :param latency: Latency of the request in seconds.
+        :return: None
+        """
+        if self.slow_call is not None and latency >= self.slow_call:
+            failed = True
+
+        now = time.monotonic()
+        with self.__lock:
+            if self.__state == self.HALF_OPEN:
+                self.__trials = max(self.__trials - 1, 0)
+                if failed:
+                    self.__open(now)
+                else:
+                    self.__state = self.CLOSED
+                    self.__calls.clear()
+                return
+
+            self.__calls.append((now, failed, latency))
+            self.__expire(now)
+            if self.__state == self.CLOSED and len(self.__calls) >= self.min_calls:
+                failures = sum(call[1] for call in self.__calls)
+                if failures / len(self.__calls) >= self.error_rate:
+                    self.__open(now)
+
+    def snapshot(self) -> dict:
+        """
+        :return: {'state': ..., 'calls': ..., 'error_rate': ..., 'mean_latency': ...} over the window.
+        """
+        state = self.state
+        with self.__lock:
+            self.__expire(time.monotonic())
+            calls = len(self.__calls)
+            failures = sum(call[1] for call in self.__calls)
+            latency = sum(call[2] for call in self.__calls)
+        return {'state': state,
+                'calls': calls,
+                'error_rate': failures / calls if calls else 0.0,
+                'mean_latency': latency / calls if calls else 0.0}
+
+
+class CircuitBreakers:
+    """
+    Circuit breakers per endpoint host, created on first use. Share one instance between clients and threads,
+    so they all see the same endpoint health.
+
+    Example usage:
+        breakers = CircuitBreakers(min_calls=5, open_for=60)
+
+        query = Query()
+        query.breakers = breakers
+        try:
+            response = query.send()
+        except CircuitOpen:
+            ...  # shed the load
+
+        print(breakers.snapshot())  # {'catalogue.dataspace.copernicus.eu': {'state': 'closed', ...}}
+    """
+
+    def __init__(self, **options):
+        """
+        :param options: Parameters of every `CircuitBreaker`.
+        """
+        self.options = options
+        self.__lock = threading.Lock()
+        self.__breakers = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        """
+        :param url: Any url of the endpoint (or just its host).
+        :return: The breaker of the url host.
+        """
+        host = urlsplit(url).netloc or url
+        with self.__lock:
+            breaker = self.__breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(**self.options)
+                self.__breakers[host] = breaker
+        return breaker
+
+    def state(self, url: str) -> str:
+        """
+        :param url: Any url of the endpoint (or just its host).
+        :return: 'closed', 'open' or 'half_open'.
+        """
+        return self.get(url).state
+
+    def snapshot(self) -> dict:
+        """
+        :return: {host: `CircuitBreaker.snapshot()`}
+        """
+        with self.__lock:
+            breakers = dict(self.__breakers)
+        return {host: breaker.snapshot() for host, breaker in breakers.items()}
@@ -0,0 +1,531 @@
+import time
+import threading
+import contextvars
+import dataclasses
+from contextlib import nullcontext
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .filter import Filter
+from .errors import check_dictionary_for_errors, DeadlineExceeded, CircuitOpen, ServerError
+from .config import config
+from .singleflight import SingleFlight
+from .nodes import walk_nodes, NodesCache
+from .fanout import fan_out
+from .deadline import Deadline
+from .hedging import Hedging
+from .breaker import CircuitBreakers
+from .mirrors import Mirrors
+from .metrics import MetricsSink
+from .tracing import span, scope
+from .slowlog import SlowQueryLog
+from .scheduler import RequestScheduler
+from .splitter import oversized, execute_split, pages_split
+
+
+@dataclasses.dataclass(frozen=True)
+class QuerySpec:
+    """
+    Immutable description of a search request: the formatted values of the OData options. Specs are hashable and
+    can be shared between threads freely. Use `Query` to build them with validation, or `replace()` to derive one
+    from another.
+
+    Example usage:
+        query = Query()
+        query.set_filter(f)
+        query.set_top(100)
+        spec = query.spec()
+
+        client = Client()
+        response = client.execute(spec)
+        response = client.execute(spec.replace(skip='100'))
+    """
+    filter: str or None = None
+    orderby: str or None = None
+    top: str or None = None
+    skip: str or None = None
+    count: str or None = None
+    expand: str or None = None
+    select: str or None = None
+
+    @classmethod
+    def from_options(cls, options: dict) -> 'QuerySpec':
+        """
+        Freezes the options of a `Query`. A `Filter` is replaced with a copy of its body.
+        :param options: Dictionary of options: {'filter': ..., 'orderby': ..., ...}
+        :return: QuerySpec
+        """
+        options = dict(options)
+        fltr = options.get('filter')
+        if isinstance(fltr, Filter):
+            options['filter'] = fltr.body
+        return cls(**options)
+
+    def replace(self, **changes) -> 'QuerySpec':
+        """
+        :param changes: Options to be changed, i.e. `skip='100'`.
+        :return: A new QuerySpec.
+        """
+        return dataclasses.replace(self, **changes)
+
+    def url(self, endpoint: str) -> str:
+        """Formats and merges options into a single line string with endpoint.
+        :param endpoint: Products endpoint.
+        :return: Request ready to be sent.
+        """
+        formatted_options = []
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if value is not None:
+                formatted_options.append(f'${field.name}={value}')
+
+        merged = f'{endpoint}?' + '&'.join(formatted_options)
+        return merged
+
+
+class Client:
+    """
+    Thread-safe transport shared by any number of threads and `QuerySpec`s. Unless `session` is given, every thread
+    gets its own pooled `requests.Session`, created on first use and reused afterwards.
+
+    Example usage:
+        with Client() as client:
+            with ThreadPoolExecutor(8) as executor:
+                responses = list(executor.map(client.execute, specs))
+
+    Class attributes:
+        timeout - a paramater of the `session.get()` or `session.post()`
+        single_flight - `SingleFlight` instance, so concurrent identical requests are sent only once
+                        (disabled if None)
+        nodes_cache - `NodesCache` instance to cache Nodes listings (disabled if None)
+        url_limit - maximum length of the encoded search url. Longer searches are split into several requests (see
+                    `splitter.execute_split()`). None - searches are never split
+        hedging - `Hedging` policy to send duplicates of slow requests (disabled if None)
+        breakers - `CircuitBreakers` to fail fast while an endpoint is unhealthy (disabled if None)
+        mirrors - `Mirrors` to route requests to the best of equivalent endpoints (disabled if None)
+        metrics - `MetricsSink` receiving timings and counters of every request (i.e. `MetricsRegistry`)
+        tracer - `Tracer` creating spans of the calls and their HTTP requests (disabled if None)
+        slow_log - `SlowQueryLog` of the slow requests (disabled if None)
+        scheduler - `RequestScheduler` admitting every HTTP request, including hedged and failover attempts
+                    (disabled if None). The priority class is passed by every call (None - the default class)
+    """
+
+    def __init__(self, session: requests.Session or None = None, timeout: tuple or float = (30, 30),
+                 single_flight: SingleFlight or None = None, pool_maxsize: int = 10,
+                 nodes_cache: NodesCache or None = None, hedging: Hedging or None = None,
+                 breakers: CircuitBreakers or None = None, mirrors: Mirrors or None = None,
+                 metrics: MetricsSink or None = None, tracer=None, slow_log: SlowQueryLog or None = None,
+                 scheduler: RequestScheduler or None = None):
+        """
+        :param session: A session to be used by all threads (i.e. to handle proxy). If None, every thread gets its
+        own session.
+        :param timeout: A paramater of the `session.get()` or `session.post()`.
+        :param single_flight: `SingleFlight` instance or None.
+        :param pool_maxsize: Maximum number of connections kept alive per host and thread.
+        :param nodes_cache: `NodesCache` instance or None.
+        :param hedging: `Hedging` instance or None.
+        :param breakers: `CircuitBreakers` instance or None.
+        :param mirrors: `Mirrors` instance or None.
+        :param metrics: `MetricsSink` instance or None (metrics are discarded).
+        :param tracer: `Tracer` instance, `OpenTelemetryTracer` instance or None.
+        :param slow_log: `SlowQueryLog` instance or None.
+        :param scheduler: `RequestScheduler` instance or None.
+        """
+        self.endpoint = config['endpoint']
+        self.endpoint_zipper = config['endpoint_zipper']
+
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self.pool_maxsize = pool_maxsize
+        self.nodes_cache = nodes_cache
+        self.url_limit = config['url_limit']
+        self.hedging = hedging
+        self.breakers = breakers
+        self.mirrors = mirrors
+        self.metrics = MetricsSink() if metrics is None else metrics
+        self.tracer = tracer
+        self.slow_log = slow_log
+        self.scheduler = scheduler
+
+        self.__session = session
+        self.__local = threading.local()
+        self.__sessions = []
+        self.__lock = threading.Lock()
+        self.__prefetch_executor = None
+        self.__hedging_executor = None
+
+    def session(self) -> requests.Session:
+        """
+        :return: The session of the current thread.
+        """
+        if self.__session is not None:
+            return self.__session
+
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self.__local.session = session
+            with self.__lock:
+                self.__sessions.append(session)
+        return session
+
+    def close(self) -> None:
+        """
+        Closes sessions created by the client and shuts down its thread pools (of hedged requests and prefetched
+        Nodes listings). A session passed to the constructor is left open.
+        :return: None
+        """
+        with self.__lock:
+            sessions, self.__sessions = self.__sessions, []
+            prefetch_executor, self.__prefetch_executor = self.__prefetch_executor, None
+            hedging_executor, self.__hedging_executor = self.__hedging_executor, None
+        if prefetch_executor is not None:
+            prefetch_executor.shutdown(wait=True, cancel_futures=True)
+        if hedging_executor is not None:
+            hedging_executor.shutdown(wait=False, cancel_futures=True)
+        for session in sessions:
+            session.close()
+        self.__local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def request(self, method: str, url: str, body: dict or None = None, deadline: Deadline or None = None,
+                priority: str or None = None) -> dict:
+        """
+        Sends a GET or POST request, checks the response for errors and decodes it. If `single_flight` is set,
+        concurrent identical requests share a single HTTP call. If the shared call fails because of the deadline of
+        another caller, the request is sent again within the deadline of this one.
+        :param method: 'GET' or 'POST'.
+        :param url: Request url.
+        :param body: POST body (JSON).
+        :param deadline: `Deadline` of the call this request is made for. `DeadlineExceeded` is raised if it passes.
+        :param priority: Name of the priority class the request is admitted by `scheduler` in (None - the default).
+        :return: Response as a dictionary.
+        """
+        if deadline is not None:
+            deadline.check()
+
+        if self.single_flight is None:
+            return self.__send(method, url, body, deadline, priority)
+
+        key = SingleFlight.key(method, url, body)
+        while True:
+            leader = []
+
+            def send():
+                leader.append(True)
+                return self.__send(method, url, body, deadline, priority)
+
+            timeout = None if deadline is None else deadline.remaining()
+            try:
+                result = self.single_flight.do(key, send, timeout=timeout)
+            except DeadlineExceeded:
+                if leader or (deadline is not None and deadline.expired()):
+                    raise
+                continue  # the deadline of the leader has passed, not the deadline of this call: try again
+            except TimeoutError as error:
+                if deadline is None or not deadline.expired():
+                    raise  # raised by the request, not by waiting for it
+                raise DeadlineExceeded(f'The deadline of {deadline.seconds} s is exceeded') from error
+            break
+
+        if not leader:
+            self.metrics.increment('copernicus_cache_hits_total', cache='single_flight')
+        return result
+
+    def __send(self, method: str, url: str, body: dict or None, deadline: Deadline or None,
+               priority: str or None) -> dict:
+        if self.hedging is None:
+            return self.__attempt(method, url, body, deadline, priority)
+
+        with self.__lock:
+            if self.__hedging_executor is None:
+                self.__hedging_executor = ThreadPoolExecutor(max_workers=self.hedging.max_workers)
+            executor = self.__hedging_executor
+
+        attempts = {executor.submit(contextvars.copy_context().run, self.__attempt, method, url, body, deadline,
+                                    priority)}
+        delay = self.hedging.delay()
+        if deadline is not None:
+            delay = min(delay, deadline.remaining())
+
+        done, _ = wait(attempts, timeout=delay)
+        if not done and (deadline is None or not deadline.expired()):
+            attempts.add(executor.submit(contextvars.copy_context().run, self.__attempt, method, url, body,
+                                         deadline, priority))
+            self.hedging.record_hedge()
+            self.metrics.increment('copernicus_retries_total', reason='hedge')
+
+        error = None
+        while attempts:
+            timeout = None if deadline is None else deadline.remaining()
+            done, attempts = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(f'The deadline of {deadline.seconds} s is exceeded')
+            for attempt in done:
+                if attempt.exception() is None:
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+
+    def __attempt(self, method: str, url: str, body: dict or None, deadline: Deadline or None,
+                  priority: str or None) -> dict:
+        """
+        Sends the request to the best endpoint of `mirrors`, and on failure to the next ones.
+        """
+        pool, path = (None, None) if self.mirrors is None else self.mirrors.route(url)
+        if pool is None:
+            return self.__call(method, url, body, deadline, priority)
+
+        error = None
+        for endpoint in pool.candidates():
+            if deadline is not None and deadline.expired():
+                break
+            if error is not None:
+                self.metrics.increment('copernicus_retries_total', reason='failover')
+
+            started = time.monotonic()
+            try:
+                result = self.__call(method, f'{endpoint}{path}', body, deadline, priority)
+            except CircuitOpen as circuit_open:
+                error = circuit_open
+                continue
+            except (requests.RequestException, ServerError) as failure:
+                pool.record(endpoint, True, time.monotonic() - started)
+                error = failure
+                continue
+
+            pool.record(endpoint, False, time.monotonic() - started)
+            return result
+
+        if error is None:
+            raise DeadlineExceeded(f'The deadline of {deadline.seconds} s is exceeded')
+        raise error
+
+    def __call(self, method: str, url: str, body: dict or None, deadline: Deadline or None,
+               priority: str or None) -> dict:
+        slot = nullcontext() if self.scheduler is None else self.scheduler.slot(priority, deadline)
+        with slot, span(self.tracer, 'http', **{'http.method': method, 'http.url': url}) as http_span:
+            return self.__http(method, url, body, deadline, http_span)
+
+    def __http(self, method: str, url: str, body: dict or None, deadline: Deadline or None, http_span) -> dict:
+        session = self.session()
+        timeout = self.timeout if deadline is None else deadline.clip(self.timeout)
+        host = urlsplit(url).netloc
+
+        breaker = None
+        if self.breakers is not None:
+            breaker = self.breakers.get(url)
+            breaker.acquire()
+
+        started = time.monotonic()
+        try:
+            if method == 'POST':
+                response = session.post(url, timeout=timeout, json=body, stream=True)
+            else:
+                response = session.get(url, timeout=timeout, stream=True)
+            received = time.monotonic()
+            content = response.content
+        except requests.RequestException:
+            if breaker is not None:
+                breaker.record(True, time.monotonic() - started)
+            self.metrics.increment('copernicus_requests_total', host=host, method=method, status='error')
+            raise
+        downloaded = time.monotonic()
+        http_span.set_attribute('http.status_code', response.status_code)
+        http_span.set_attribute('http.response_bytes', len(content))
+
+        if breaker is not None:
+            breaker.record(response.status_code >= 500, downloaded - started)
+        self.metrics.increment('copernicus_requests_total', host=host, method=method, status=response.status_code)
+        self.metrics.observe('copernicus_request_phase_seconds', received - started, phase='server')
+        self.metrics.observe('copernicus_request_phase_seconds', downloaded - received, phase='download')
+        self.metrics.observe('copernicus_response_bytes', len(content), host=host)
+
+        if response.status_code >= 500:
+            raise ServerError(f'{response.status_code} {response.reason}, while sending:\n{url}')
+
+        dictionary = response.json()
+        decoded = time.monotonic()
+        check_dictionary_for_errors(dictionary, url)
+        checked = time.monotonic()
+
+        self.metrics.observe('copernicus_request_phase_seconds', decoded - downloaded, phase='decode')
+        self.metrics.observe('copernicus_request_phase_seconds', checked - decoded, phase='check')
+        self.metrics.observe('copernicus_request_seconds', checked - started, host=host, method=method)
+        items = dictionary.get('value', dictionary.get('result'))
+        if isinstance(items, list):
+            self.metrics.increment('copernicus_products_total', len(items))
+        if self.slow_log is not None:
+            self.slow_log.record(method, url, checked - started, len(items) if isinstance(items, list) else None, body)
+
+        if self.hedging is not None:
+            self.hedging.record(checked - started)
+        return dictionary
+
+    def execute(self, spec: QuerySpec, deadline: Deadline or None = None, priority: str or None = None) -> dict:
+        """
+        Sends a search request.
+        :param spec: QuerySpec
+        :param deadline: `Deadline` or None.
+        :param priority: Name of the priority class of the requests or None. See `RequestScheduler`.
+        :return: Response as a dictionary.
+        """
+        if oversized(spec, self.endpoint, self.url_limit):
+            with span(self.tracer, 'split', spec.filter):
+                merged = execute_split(self, spec, deadline=deadline, priority=priority)
+            if merged is not None:
+                return merged
+
+        with span(self.tracer, 'send', spec.filter):
+            return self.request('GET', self.__url(spec), deadline=deadline, priority=priority)
+
+    def __url(self, spec: QuerySpec) -> str:
+        started = time.monotonic()
+        url = spec.url(self.endpoint)
+        self.metrics.observe('copernicus_request_phase_seconds', time.monotonic() - started, phase='build')
+        return url
+
+    def pages(self, spec: QuerySpec, max_pages: int or None = None, deadline: Deadline or None = None,
+              priority: str or None = None):
+        """
+        Sends a search request and follows '@odata.nextLink' of the responses. See `Query.pages()`.
+        :param spec: QuerySpec
+        :param max_pages: Maximum number of pages to be requested. None - no limit.
+        :param deadline: `Deadline` of all the pages or None.
+        :param priority: Name of the priority class of the requests or None. See `RequestScheduler`.
+        :return: Generator of responses (dictionaries).
+        """
+        if oversized(spec, self.endpoint, self.url_limit):
+            split = pages_split(self, spec, max_pages=max_pages, deadline=deadline, priority=priority)
+            if split is not None:
+                return split
+        return self.__pages(spec, max_pages, deadline, priority)
+
+    def __pages(self, spec: QuerySpec, max_pages: int or None, deadline: Deadline or None, priority: str or None):
+        pages_scope = scope(self.tracer, 'pages', spec.filter)
+        error = None
+        try:
+            url = self.__url(spec)
+            pages = 0
+            while url is not None and (max_pages is None or pages < max_pages):
+                page = pages_scope.run(self.__page, url, pages, deadline, priority)
+                pages += 1
+                yield page
+
+                url = page.get('@odata.nextLink')
+                if url is not None and spec.select is not None and '$select' not in parse_qs(urlsplit(url).query):
+                    url = f'{url}&$select={spec.select}'
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            pages_scope.close(error)
+
+    def __page(self, url: str, index: int, deadline: Deadline or None, priority: str or None) -> dict:
+        with span(self.tracer, 'page', **{'copernicus.page': index}):
+            return self.request('GET', url, deadline=deadline, priority=priority)
+
+    def fan_out(self, spec: QuerySpec, collections: [str], queue_size: int = 2, deadline: Deadline or None = None,
+                priority: str or None = None):
+        """
+        Runs the search in several collections concurrently and merges the results by the orderby option. See
+        `fanout.fan_out()`.
+        :return: Generator of products.
+        """
+        return fan_out(self, spec, collections, queue_size=queue_size, deadline=deadline, priority=priority)
+
+    def by_names(self, names: [str], deadline: Deadline or None = None, priority: str or None = None) -> dict:
+        """
+        Sends a POST request to search for multiple product names. See `Query.by_names()`.
+        :param names: The list of product names to be searched by.
+        :param deadline: `Deadline` or None.
+        :param priority: Name of the priority class of the requests or None. See `RequestScheduler`.
+        :return: Response as a dictionary.
+        """
+        url = f'{self.endpoint}/OData.CSC.FilterList'
+        search_list = [{'Name': name} for name in names]
+        with span(self.tracer, 'by_names', **{'copernicus.names': len(names)}):
+            return self.request('POST', url, {"FilterProducts": search_list}, deadline=deadline, priority=priority)
+
+    def nodes_url(self, uuid: str) -> str:
+        """
+        :param uuid: uuid or url pointing exact product or url pointing product nodes.
+        :return: Url of the product nodes listing.
+        """
+        if self.endpoint in uuid or self.endpoint_zipper in uuid:
+            if uuid.endswith(r'/Nodes'):
+                url = f'{uuid}'
+            else:
+                url = f'{uuid}/Nodes'
+        else:
+            url = f'{self.endpoint}({uuid})/Nodes'
+        return url
+
+    def product_nodes(self, uuid: str, prefetch: bool = True, deadline: Deadline or None = None,
+                      priority: str or None = None) -> dict:
+        """
+        Lists product content. See `Query.product_nodes()`. If `nodes_cache` is set, cached listings are returned
+        without sending a request, unless they are older than `nodes_cache.max_age` (see `NodesCache.validate()` to
+        drop the listings of modified products).
+        :param uuid: uuid or url pointing exact product or url pointing product nodes.
+        :param prefetch: If False, listings of the folders are not prefetched, even if `nodes_cache.prefetch` is set.
+        :param deadline: `Deadline` or None.
+        :param priority: Name of the priority class of the requests or None. See `RequestScheduler`.
+        :return: Response as a dictionary.
+        """
+        url = self.nodes_url(uuid)
+        with span(self.tracer, 'product_nodes') as nodes_span:
+            if self.nodes_cache is None:
+                return self.request('GET', url, deadline=deadline, priority=priority)
+
+            listing = self.nodes_cache.get(url)
+            if listing is not None:
+                nodes_span.set_attribute('copernicus.cache', 'hit')
+                self.metrics.increment('copernicus_cache_hits_total', cache='nodes')
+            else:
+                nodes_span.set_attribute('copernicus.cache', 'miss')
+                self.metrics.increment('copernicus_cache_misses_total', cache='nodes')
+                listing = self.request('GET', url, deadline=deadline, priority=priority)
+                self.nodes_cache.put(url, listing)
+
+                if prefetch and self.nodes_cache.prefetch:
+                    self.__prefetch_nodes(listing, priority)
+            return listing
+
+    def __prefetch_nodes(self, listing: dict, priority: str or None) -> None:
+        """
+        Downloads listings of the folders of a listing into `nodes_cache` in the background.
+        :param listing: Nodes listing.
+        :param priority: Name of the priority class of the requests or None.
+        :return: None
+        """
+        with self.__lock:
+            if self.__prefetch_executor is None:
+                self.__prefetch_executor = ThreadPoolExecutor(max_workers=4)
+            executor = self.__prefetch_executor
+
+        for node in listing.get('result', []):
+            if node.get('ChildrenNumber'):
+                url = node['Nodes']['uri']
+                if self.nodes_cache.get(url) is None:
+                    executor.submit(self.product_nodes, url, prefetch=False, priority=priority)
+
+    def walk_nodes(self, uuid: str, max_depth: int or None = None, include: str or [str] or None = None,
+                   prune: str or [str] or None = None, max_workers: int = 8, deadline: Deadline or None = None,
+                   priority: str or None = None):
+        """
+        Crawls the Nodes tree of a product concurrently. See `nodes.walk_nodes()`.
+        :return: Generator of (path, node) tuples.
+        """
+        return walk_nodes(self, uuid, max_depth=max_depth, include=include, prune=prune, max_workers=max_workers,
+                          deadline=deadline, priority=priority)
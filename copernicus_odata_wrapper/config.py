@@ -1,4 +1,9 @@
 config = {
     "endpoint": r"https://catalogue.dataspace.copernicus.eu/odata/v1/Products",
-    "endpoint_zipper": r"https://zipper.dataspace.copernicus.eu/odata/v1/Products"
+    "endpoint_zipper": r"https://zipper.dataspace.copernicus.eu/odata/v1/Products",
+    # equivalent endpoints (i.e. regional proxies), see `mirrors.Mirrors.from_config()`
+    "endpoint_mirrors": [],
+    "endpoint_zipper_mirrors": [],
+    # maximum length of the encoded search url, longer searches are split (a common limit of servers and proxies)
+    "url_limit": 8000,
 }
@@ -0,0 +1,54 @@
+import time
+
+from .errors import DeadlineExceeded
+
+
+class Deadline:
+    """
+    Time budget of a high-level call. The same deadline is passed to every request made on behalf of the call (pages,
+    hedged attempts, concurrent sub-queries), so together they never take longer than `seconds`.
+
+    Example usage:
+        deadline = Deadline(10)
+        for page in client.pages(spec, deadline=deadline):
+            ...
+    """
+
+    def __init__(self, seconds: float):
+        """
+        :param seconds: The budget in seconds, starting now.
+        """
+        if seconds <= 0:
+            raise ValueError('`seconds` must be positive')
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        :return: Seconds left (0 if the deadline has passed).
+        """
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def check(self) -> None:
+        """
+        Raises `DeadlineExceeded` if the deadline has passed.
+        :return: None
+        """
+        if self.expired():
+            raise DeadlineExceeded(f'The deadline of {self.seconds} s is exceeded')
+
+    def clip(self, timeout: tuple or float or None) -> tuple or float:
+        """
+        Limits a `requests` timeout to the remaining time.
+        :param timeout: A float or a (connect, read) tuple.
+        :return: The limited timeout of the same form.
+        """
+        remaining = self.remaining()
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+        return min(timeout, remaining)
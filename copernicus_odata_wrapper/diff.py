@@ -0,0 +1,139 @@
+import os
+import gzip
+import json
+import heapq
+import tempfile
+from collections import namedtuple
+
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+
+SnapshotDiff = namedtuple('SnapshotDiff', [ADDED, REMOVED, MODIFIED])
+SnapshotDiff.__doc__ = """
+Changes between two snapshots: lists of the added products (of the new snapshot), removed products (of the old
+snapshot) and modified products (of the new snapshot).
+"""
+
+
+def diff(old, new, key: str = 'Id') -> SnapshotDiff:
+    """
+    Compares two result sets in linear time: the old one is hashed by `key`, the new one is streamed through it. A
+    product present in both is modified if its `ModificationDate` has changed. Only the old snapshot is kept in memory;
+    for snapshots too large for that, see `diff_sorted()`.
+
+    Example usage:
+        yesterday = list(read_snapshot('2023-07-01.jsonl.gz'))
+        changes = diff(yesterday, query.products())
+        print(len(changes.added), len(changes.removed), len(changes.modified))
+
+    :param old: Iterable of products, i.e. a stored snapshot.
+    :param new: Iterable of products, i.e. `Query.products()`.
+    :param key: 'Id' or 'Name'. A reprocessed product has a new `Id` and `Name`, so it is added (and the old one
+    removed, if it is not in the catalogue anymore).
+    :return: `SnapshotDiff`.
+    """
+    remaining = {product[key]: product for product in old}
+    added = []
+    modified = []
+    for product in new:
+        previous = remaining.pop(product[key], None)
+        if previous is None:
+            added.append(product)
+        elif previous.get('ModificationDate') != product.get('ModificationDate'):
+            modified.append(product)
+    return SnapshotDiff(added, list(remaining.values()), modified)
+
+
+def diff_sorted(old, new, key: str = 'Id'):
+    """
+    Same as `diff()`, but merges two inputs sorted by `key` (ascending), so neither has to fit in memory.
+
+    Example usage:
+        old = read_snapshot('2023-07-01.sorted.jsonl.gz')
+        new = sort_products(query.products())
+        for change, product in diff_sorted(old, new):
+            print(change, product['Name'])
+
+    :param old: Iterable of products sorted by `key`.
+    :param new: Iterable of products sorted by `key`.
+    :param key: 'Id' or 'Name'.
+    :return: Generator of (change, product): (ADDED, new product), (REMOVED, old product) or (MODIFIED, new product).
+    :raise ValueError: If an input is not sorted by `key`.
+    """
+    old = iter(old)
+    new = iter(new)
+
+    def advance(iterator, last):
+        product = next(iterator, None)
+        if product is not None and last is not None and product[key] <= last:
+            raise ValueError(f'The input is not sorted by {key}: {product[key]!r} follows {last!r}')
+        return product
+
+    left = advance(old, None)
+    right = advance(new, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[key] < right[key]):
+            yield REMOVED, left
+            left = advance(old, left[key])
+        elif left is None or right[key] < left[key]:
+            yield ADDED, right
+            right = advance(new, right[key])
+        else:
+            if left.get('ModificationDate') != right.get('ModificationDate'):
+                yield MODIFIED, right
+            left, right = advance(old, left[key]), advance(new, right[key])
+
+
+def read_snapshot(path: str):
+    """
+    Reads a snapshot written as JSON lines (see `writers.JsonLinesWriter`), gzip compressed if the path ends with
+    '.gz'.
+    :return: Generator of products.
+    """
+    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _run(products: [dict], directory: str) -> str:
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.jsonl', delete=False) as file:
+        for product in products:
+            file.write(json.dumps(product) + '\n')
+    return file.name
+
+
+def sort_products(products, key: str = 'Id', chunk_size: int = 100000, directory: str or None = None):
+    """
+    Sorts products by `key` with bounded memory, for `diff_sorted()`: sorted chunks of `chunk_size` products are
+    written to temporary files and merged.
+    :param products: Iterable of products, i.e. `Query.products()`.
+    :param key: 'Id' or 'Name'.
+    :param chunk_size: Maximum number of products in memory.
+    :param directory: Directory of the temporary files. None - the default temporary directory.
+    :return: Generator of products sorted by `key`.
+    """
+    runs = []
+    readers = []
+    chunk = []
+    try:
+        for product in products:
+            chunk.append(product)
+            if len(chunk) >= chunk_size:
+                chunk.sort(key=lambda item: item[key])
+                runs.append(_run(chunk, directory))
+                chunk = []
+        chunk.sort(key=lambda item: item[key])
+        if not runs:
+            yield from chunk
+            return
+        runs.append(_run(chunk, directory))
+        chunk = []
+        readers = [read_snapshot(path) for path in runs]
+        yield from heapq.merge(*readers, key=lambda item: item[key])
+    finally:
+        for reader in readers:
+            reader.close()  # open files can not be removed on Windows
+        for path in runs:
+            os.remove(path)
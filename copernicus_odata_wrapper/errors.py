@@ -7,8 +7,16 @@ def check_response_for_errors(response: requests.Response) -> None:
     :param response: requests.Response
     :return: None - if there are no errors.
     """
-    dictionary = response.json()
+    check_dictionary_for_errors(response.json(), response.url)
 
+
+def check_dictionary_for_errors(dictionary: dict, url: str) -> None:
+    """
+    Same as `check_response_for_errors()`, but checks an already decoded response.
+    :param dictionary: Decoded response.
+    :param url: Url of the request.
+    :return: None - if there are no errors.
+    """
     # todo: Could there be an error with more than one key in the answer?
     # if only one exact 'detail' key in the response
     if len(dictionary) == 1:
@@ -32,7 +40,7 @@ def check_response_for_errors(response: requests.Response) -> None:
 
             else:
                 raise Unknown(f"An unknown error occurred, while sending:\n"
-                              f"{response.url}"
+                              f"{url}"
                               f"\nYou may want to add this error to `errors.py`: "
                               f"{dictionary['detail']}")
 
@@ -59,3 +67,19 @@ class ProductNotFoundInCatalogue(Exception):
 
 class Unknown(Exception):
     pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class ServerError(Exception):
+    pass
+
+
+class RequestNotRecorded(LookupError):
+    pass
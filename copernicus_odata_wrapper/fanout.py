@@ -0,0 +1,127 @@
+import heapq
+import queue
+import threading
+
+from .filter import Filter
+from .tracing import scope
+
+_DONE = object()
+
+
+def _sort_key(orderby: str) -> (str, bool):
+    """
+    :param orderby: Value of the orderby option, i.e. 'ContentDate/Start desc'.
+    :return: (path of the field, ascending)
+    """
+    path, _, direction = orderby.partition(' ')
+    return path, direction.strip() != 'desc'
+
+
+def _getter(path: str):
+    parts = path.split('/')
+
+    def get(product: dict):
+        value = product
+        for part in parts:
+            value = value[part]
+        return value
+
+    return get
+
+
+def _produce(pages, buffer: queue.Queue, stop: threading.Event) -> None:
+    """
+    Puts the pages into the buffer until they run out or `stop` is set. The buffer is bounded, so a slow consumer
+    pauses the requests.
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for page in pages:
+            if not put(page):
+                return
+        put(_DONE)
+    except BaseException as error:
+        put(error)
+    finally:
+        pages.close()
+
+
+def _consume(buffer: queue.Queue):
+    while True:
+        item = buffer.get()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield from item['value']
+
+
+def fan_out(client, spec, collections: [str], queue_size: int = 2, deadline=None, priority=None):
+    """
+    Runs the same search in several collections concurrently and merges the results into one stream, ordered by the
+    orderby option of `spec`. Each collection is paginated in its own thread, and at most `queue_size` pages per
+    collection are held in memory.
+
+    Example usage:
+        f = Filter()
+        f.by_sensing_date(datetime(2023, 7, 1), datetime(2023, 7, 2))
+        f.And()
+        f.by_geographic_criteria('POINT(69.0 61.0)')
+
+        query = Query()
+        query.set_filter(f)
+        query.set_orderby('ContentDate/Start', ascending=True)
+        query.set_top(1000)
+        for product in query.fan_out(['SENTINEL-1', 'SENTINEL-2', 'SENTINEL-3']):
+            print(product['ContentDate']['Start'], product['Name'])
+
+    :param client: `Client` to send requests with.
+    :param spec: `QuerySpec` of the base search. The orderby option is required.
+    :param collections: Collection names, i.e. ['SENTINEL-1', 'SENTINEL-2'].
+    :param queue_size: Maximum number of pages buffered per collection.
+    :param deadline: `Deadline` shared by all the collections or None.
+    :param priority: Name of the priority class of the requests or None.
+    :return: Generator of products.
+    """
+    if spec.orderby is None:
+        raise ValueError('The orderby option is required to merge the results, see `Query.set_orderby()`')
+
+    path, ascending = _sort_key(spec.orderby)
+    field = path.split('/')[0]
+    if spec.select is not None and field not in spec.select.split(','):
+        raise ValueError(f'The `{field}` field must be selected to merge the results by it')
+    return _merge(client, spec, collections, path, ascending, queue_size, deadline, priority)
+
+
+def _merge(client, spec, collections: [str], path: str, ascending: bool, queue_size: int, deadline, priority):
+    fan_out_scope = scope(client.tracer, 'fan_out', spec.filter, **{'copernicus.collections': list(collections)})
+    stop = threading.Event()
+    streams = []
+    for collection in collections:
+        fltr = Filter()
+        fltr.collection(collection)
+        if spec.filter is not None:
+            fltr.body = f'({spec.filter}) and {fltr.body}'
+
+        buffer = queue.Queue(maxsize=queue_size)
+        pages = client.pages(spec.replace(filter=fltr.body), deadline=deadline, priority=priority)
+        threading.Thread(target=fan_out_scope.run, args=(_produce, pages, buffer, stop), daemon=True).start()
+        streams.append(_consume(buffer))
+
+    error = None
+    try:
+        yield from heapq.merge(*streams, key=_getter(path), reverse=not ascending)
+    except Exception as exception:
+        error = exception
+        raise
+    finally:
+        stop.set()
+        fan_out_scope.close(error)
@@ -1,6 +1,14 @@
 from datetime import datetime
 from .attributes import Attribute as Atr
 from .config import config
+from .slowlog import explain
+
+
+def format_date(date: datetime) -> str:
+    """
+    :return: OData literal of a date, i.e. '2023-01-01T00:00:00.000Z' (microseconds are truncated to milliseconds).
+    """
+    return date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
 
 
 # noinspection PyMethodMayBeStatic
@@ -28,6 +36,14 @@ class Filter:
             else:
                 self.body += f'{SPACE}{filter_part}'
 
+    def explain(self) -> dict:
+        """
+        Reports the complexity of the filter (url length, number of attribute clauses, polygon vertices, etc.) without
+        sending it. See `slowlog.explain()`.
+        :return: Dictionary of the metrics.
+        """
+        return explain(self.body, self.endpoint)
+
     def clear(self) -> None:
         """
         Clears the filter body by setting it to None.
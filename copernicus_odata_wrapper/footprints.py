@@ -0,0 +1,316 @@
+import re
+import operator
+from array import array
+from itertools import accumulate
+
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+
+
+def _signed_area(xs, ys) -> float:
+    """
+    :param xs: Longitudes of a closed ring (the last vertex repeats the first one).
+    :param ys: Latitudes of the ring.
+    :return: Shoelace area, positive for a counter-clockwise ring.
+    """
+    return (sum(map(operator.mul, xs[:-1], ys[1:])) - sum(map(operator.mul, xs[1:], ys[:-1]))) / 2
+
+
+def _clip(points: [(float, float)], edges: [(float, float, float, float)]) -> [(float, float)]:
+    """
+    Sutherland-Hodgman clipping of a ring by a convex counter-clockwise polygon.
+    :param points: Vertices of the ring, not closed.
+    :param edges: Edges of the clipping polygon: (x0, y0, dx, dy).
+    :return: Vertices of the clipped ring, not closed.
+    """
+    for x0, y0, dx, dy in edges:
+        if not points:
+            break
+        clipped = []
+        px, py = points[-1]
+        p_inside = dx * (py - y0) - dy * (px - x0) >= 0
+        for cx, cy in points:
+            c_inside = dx * (cy - y0) - dy * (cx - x0) >= 0
+            if c_inside != p_inside:
+                ex, ey = cx - px, cy - py
+                denominator = dx * ey - dy * ex
+                t = (dy * (px - x0) - dx * (py - y0)) / denominator
+                clipped.append((px + t * ex, py + t * ey))
+            if c_inside:
+                clipped.append((cx, cy))
+            px, py, p_inside = cx, cy, c_inside
+        points = clipped
+    return points
+
+
+def _aoi_ring(aoi) -> [(float, float)]:
+    """
+    :param aoi: WKT polygon, GeoJSON polygon or [(lon, lat), ...].
+    :return: Vertices of the exterior ring, not closed.
+    """
+    if isinstance(aoi, str):
+        ring = aoi.split(')')[0]  # the exterior ring
+        numbers = [float(number) for number in _NUMBER.findall(ring.split(';')[-1])]
+        points = list(zip(numbers[0::2], numbers[1::2]))
+    elif isinstance(aoi, dict):
+        points = [tuple(point[:2]) for point in aoi['coordinates'][0]]
+    else:
+        points = [tuple(point[:2]) for point in aoi]
+    if len(points) > 1 and points[0] == points[-1]:
+        points = points[:-1]
+    return points
+
+
+class Footprints:
+    """
+    Footprints of a result set decoded from their `GeoFootprint` into flat float64 buffers: the longitudes and the
+    latitudes of all vertices, with offsets of the rings in them and of the rings of every product. Compared with the
+    nested lists of the products (and their duplicate WKT `Footprint`), this takes a fraction of the memory.
+
+    The layout is columnar but the computations are pure Python, not vectorized (numpy is not required): the edge
+    terms of `areas()` and `centroids()` are computed with `map()`/`accumulate()` over the whole buffers, and the
+    rings, the bounding boxes and the clipping of `coverage()` are processed one by one. Use `to_numpy()` for
+    vectorized work.
+
+    Coordinates are treated as planar: areas are in square degrees, which is adequate to compare footprints and to
+    compute the share of an AOI they cover, not to measure them.
+
+    Example usage:
+        products = list(query.products())
+        footprints = Footprints.from_products(products)  # the products lose their footprints
+
+        aoi = 'POLYGON((69.0 61.0, 70.0 61.0, 70.0 60.0, 69.0 60.0, 69.0 61.0))'
+        coverage = footprints.coverage(aoi)
+        best = footprints.rank(aoi)[:10]
+        print([products[i]['Name'] for i in best])
+
+    Class attributes:
+        ids - `Id` of the product of every footprint (None if it has no `Id`)
+        xs, ys - longitudes and latitudes of the vertices, array('d')
+        ring_offsets - start of every ring in `xs` and `ys`, and the end of the last one
+        geometry_offsets - start of the rings of every product in `ring_offsets`, and the end of the last ones
+        holes - 1 for the interior rings, 0 for the exterior ones, array('b')
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.xs = array('d')
+        self.ys = array('d')
+        self.ring_offsets = array('q', [0])
+        self.geometry_offsets = array('q', [0])
+        self.holes = array('b')
+
+    @classmethod
+    def from_products(cls, products, strip: bool = True) -> 'Footprints':
+        """
+        :param products: Iterable of products or pages, i.e. `Query.products()`.
+        :param strip: If True, `GeoFootprint` and `Footprint` are removed from the products.
+        :return: `Footprints` in the order of the products. A product without a footprint has no rings.
+        """
+        footprints = cls()
+        for item in products:
+            for product in (item['value'] if 'value' in item and 'Id' not in item else [item]):
+                footprints.append(product.get('GeoFootprint'), product.get('Id'))
+                if strip:
+                    product.pop('GeoFootprint', None)
+                    product.pop('Footprint', None)
+        return footprints
+
+    def append(self, geometry: dict or None, product_id: str or None = None) -> None:
+        """
+        Appends a GeoJSON Polygon or MultiPolygon.
+        """
+        polygons = []
+        if geometry is not None:
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                raise ValueError(f"Not supported geometry type: {geometry['type']}")
+
+        for polygon in polygons:
+            for index, ring in enumerate(polygon):
+                if ring[0] != ring[-1]:
+                    ring = ring + [ring[0]]
+                self.xs.extend(point[0] for point in ring)
+                self.ys.extend(point[1] for point in ring)
+                self.ring_offsets.append(len(self.xs))
+                self.holes.append(index > 0)
+        self.geometry_offsets.append(len(self.holes))
+        self.ids.append(product_id)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: Size of the buffers in bytes (without the ids).
+        """
+        return sum(buffer.itemsize * len(buffer) for buffer in (self.xs, self.ys, self.ring_offsets,
+                                                                 self.geometry_offsets, self.holes))
+
+    def __rings(self, index: int) -> range:
+        return range(self.geometry_offsets[index], self.geometry_offsets[index + 1])
+
+    def geometry(self, index: int) -> dict or None:
+        """
+        :return: GeoJSON MultiPolygon (or Polygon) of a footprint, None if the product has none.
+        """
+        polygons = []
+        for ring in self.__rings(index):
+            start, end = self.ring_offsets[ring], self.ring_offsets[ring + 1]
+            coordinates = [[x, y] for x, y in zip(self.xs[start:end], self.ys[start:end])]
+            if self.holes[ring]:
+                polygons[-1].append(coordinates)
+            else:
+                polygons.append([coordinates])
+        if not polygons:
+            return None
+        if len(polygons) == 1:
+            return {'type': 'Polygon', 'coordinates': polygons[0]}
+        return {'type': 'MultiPolygon', 'coordinates': polygons}
+
+    def bboxes(self) -> (array, array, array, array):
+        """
+        :return: (min_x, min_y, max_x, max_y) arrays, NaN for the products without a footprint.
+        """
+        boxes = [array('d'), array('d'), array('d'), array('d')]
+        nan = float('nan')
+        for index in range(len(self)):
+            rings = self.__rings(index)
+            if not rings:
+                for box in boxes:
+                    box.append(nan)
+                continue
+            start, end = self.ring_offsets[rings.start], self.ring_offsets[rings.stop]
+            xs, ys = self.xs[start:end], self.ys[start:end]
+            boxes[0].append(min(xs))
+            boxes[1].append(min(ys))
+            boxes[2].append(max(xs))
+            boxes[3].append(max(ys))
+        return tuple(boxes)
+
+    def __moments(self) -> (list, list, list):
+        """
+        Shoelace terms of all the edges at once, including the meaningless ones between the rings, summed into
+        prefix sums, so the terms of any ring are the difference of two of them.
+        :return: Prefix sums of (cross products, x moments, y moments) over the vertices.
+        """
+        xs, ys = self.xs, self.ys
+        cross = list(map(operator.sub, map(operator.mul, xs[:-1], ys[1:]), map(operator.mul, xs[1:], ys[:-1])))
+        x_moments = map(operator.mul, map(operator.add, xs[:-1], xs[1:]), cross)
+        y_moments = map(operator.mul, map(operator.add, ys[:-1], ys[1:]), cross)
+        return ([0.0, *accumulate(cross)], [0.0, *accumulate(x_moments)], [0.0, *accumulate(y_moments)])
+
+    def areas(self) -> array:
+        """
+        :return: Areas of the footprints in square degrees (holes excluded).
+        """
+        cross, _, _ = self.__moments()
+        offsets = self.ring_offsets
+        areas = array('d')
+        for index in range(len(self)):
+            area = 0.0
+            for ring in self.__rings(index):
+                ring_area = abs(cross[offsets[ring + 1] - 1] - cross[offsets[ring]]) / 2
+                area += -ring_area if self.holes[ring] else ring_area
+            areas.append(area)
+        return areas
+
+    def centroids(self) -> (array, array):
+        """
+        :return: (x, y) arrays of the area centroids, NaN for the products without a footprint.
+        """
+        cross, x_moments, y_moments = self.__moments()
+        offsets = self.ring_offsets
+        cxs, cys = array('d'), array('d')
+        for index in range(len(self)):
+            total = sx = sy = 0.0
+            for ring in self.__rings(index):
+                start, end = offsets[ring], offsets[ring + 1] - 1
+                area = (cross[end] - cross[start]) / 2
+                if not area:
+                    continue
+                weight = -abs(area) if self.holes[ring] else abs(area)
+                total += weight
+                sx += weight * (x_moments[end] - x_moments[start]) / (6 * area)
+                sy += weight * (y_moments[end] - y_moments[start]) / (6 * area)
+            if total:
+                cxs.append(sx / total)
+                cys.append(sy / total)
+            else:
+                rings = self.__rings(index)
+                start, end = offsets[rings.start], offsets[rings.stop]
+                count = end - start
+                cxs.append(sum(self.xs[start:end]) / count if count else float('nan'))
+                cys.append(sum(self.ys[start:end]) / count if count else float('nan'))
+        return cxs, cys
+
+    def coverage(self, aoi) -> array:
+        """
+        Computes the share of an area of interest covered by every footprint.
+        :param aoi: Convex polygon: WKT ('POLYGON((...))', optionally 'SRID=4326;' prefixed), GeoJSON Polygon or a list
+        of (lon, lat). Only its exterior ring is used.
+        :return: Fractions 0 - 1 of the AOI area.
+        :raise ValueError: If the AOI is not a convex polygon.
+        """
+        points = _aoi_ring(aoi)
+        if len(points) < 3:
+            raise ValueError('The AOI must be a polygon')
+        closed = points + points[:1]
+        aoi_area = _signed_area([x for x, _ in closed], [y for _, y in closed])
+        if aoi_area < 0:
+            points.reverse()
+            aoi_area = -aoi_area
+        if aoi_area == 0:
+            raise ValueError('The AOI has no area')
+
+        edges = []
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            edges.append((x0, y0, x1 - x0, y1 - y0))
+        for x0, y0, dx, dy in edges:
+            for x, y in points:
+                if dx * (y - y0) - dy * (x - x0) < -1e-12 * aoi_area:
+                    raise ValueError('The AOI must be convex')
+
+        aoi_min_x, aoi_max_x = min(x for x, _ in points), max(x for x, _ in points)
+        aoi_min_y, aoi_max_y = min(y for _, y in points), max(y for _, y in points)
+        min_xs, min_ys, max_xs, max_ys = self.bboxes()
+
+        fractions = array('d')
+        for index in range(len(self)):
+            if not (min_xs[index] <= aoi_max_x and max_xs[index] >= aoi_min_x and
+                    min_ys[index] <= aoi_max_y and max_ys[index] >= aoi_min_y):
+                fractions.append(0.0)  # also NaN - no footprint
+                continue
+            covered = 0.0
+            for ring in self.__rings(index):
+                start, end = self.ring_offsets[ring], self.ring_offsets[ring + 1]
+                clipped = _clip(list(zip(self.xs[start:end - 1], self.ys[start:end - 1])), edges)
+                if len(clipped) < 3:
+                    continue
+                clipped.append(clipped[0])
+                area = abs(_signed_area([x for x, _ in clipped], [y for _, y in clipped]))
+                covered += -area if self.holes[ring] else area
+            fractions.append(min(max(covered / aoi_area, 0.0), 1.0))
+        return fractions
+
+    def rank(self, aoi) -> [int]:
+        """
+        :return: Indices of the footprints, the one covering the largest share of the AOI first.
+        """
+        fractions = self.coverage(aoi)
+        return sorted(range(len(fractions)), key=fractions.__getitem__, reverse=True)
+
+    def to_numpy(self) -> dict:
+        """
+        Views the buffers as numpy arrays, without copying. numpy is an optional dependency.
+        :return: {'xs': ..., 'ys': ..., 'ring_offsets': ..., 'geometry_offsets': ..., 'holes': ...}
+        """
+        import numpy
+        return {'xs': numpy.frombuffer(self.xs, dtype=numpy.float64),
+                'ys': numpy.frombuffer(self.ys, dtype=numpy.float64),
+                'ring_offsets': numpy.frombuffer(self.ring_offsets, dtype=numpy.int64),
+                'geometry_offsets': numpy.frombuffer(self.geometry_offsets, dtype=numpy.int64),
+                'holes': numpy.frombuffer(self.holes, dtype=numpy.int8).astype(bool)}
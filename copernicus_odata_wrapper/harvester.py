@@ -0,0 +1,248 @@
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .client import Client, QuerySpec
+from .config import config
+from .filter import Filter, format_date
+
+MAX_SKIP = 10000  # the server does not skip more results, see `Query.set_skip()`
+
+_worker = None
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=FULL')
+    connection.execute('CREATE TABLE IF NOT EXISTS windows (collection TEXT, start TEXT, end TEXT, shard TEXT, '
+                       'offset_start INTEGER, offset_end INTEGER, products INTEGER, '
+                       'PRIMARY KEY (collection, start, end))')
+    return connection
+
+
+class _Worker:
+    """State of a worker process: its client, its shard and the checkpoint database."""
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.client = Client(timeout=settings['timeout'])
+        self.client.endpoint = settings['endpoint']
+        self.connection = _connect(settings['checkpoint'])
+        self.shard = f'shard-{os.getpid()}.jsonl'
+        self.file = open(os.path.join(settings['directory'], self.shard), 'ab')
+
+    def spec(self, collection: str, start: datetime, end: datetime) -> QuerySpec:
+        body = (f"Collection/Name eq '{collection}' and ContentDate/Start ge {format_date(start)} and "
+                f"ContentDate/Start lt {format_date(end)}")
+        if self.settings['filter']:
+            body = f"{body} and ({self.settings['filter']})"
+        return QuerySpec(filter=body, orderby='ContentDate/Start asc', top=str(self.settings['top']), count='True',
+                         expand=self.settings['expand'], select=self.settings['select'])
+
+    def write(self, collection: str, start: datetime, end: datetime) -> int:
+        """
+        Writes the products of a window to the shard. A window with more results than the server can skip through is
+        split in halves.
+        :return: The number of written products.
+        """
+        pages = self.client.pages(self.spec(collection, start, end))
+        page = next(pages)
+        if page.get('@odata.count', 0) > MAX_SKIP + self.settings['top'] and end - start > timedelta(seconds=1):
+            pages.close()
+            middle = start + (end - start) / 2
+            return self.write(collection, start, middle) + self.write(collection, middle, end)
+
+        written = 0
+        while page is not None:
+            lines = [json.dumps(product).encode() + b'\n' for product in page['value']]
+            self.file.writelines(lines)
+            written += len(lines)
+            page = next(pages, None)
+        return written
+
+    def harvest(self, collection: str, start: datetime, end: datetime) -> int:
+        self.file.seek(0, os.SEEK_END)
+        offset_start = self.file.tell()
+        try:
+            products = self.write(collection, start, end)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except BaseException:
+            self.file.truncate(offset_start)
+            raise
+        self.connection.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (collection, start.isoformat(), end.isoformat(), self.shard, offset_start,
+                                 self.file.tell(), products))
+        return products
+
+
+def _initialize(settings: dict) -> None:
+    global _worker
+    _worker = _Worker(settings)
+
+
+def _harvest(collection: str, start: datetime, end: datetime) -> int:
+    return _worker.harvest(collection, start, end)
+
+
+class Harvester:
+    """
+    Backfills the catalogue metadata of several collections over a long period with a pool of processes. The period
+    is partitioned into windows of `window` length per collection; every worker process paginates the windows it is
+    given and streams the products to its own shard (`shard-<pid>.jsonl`, a product per line).
+
+    A window is checkpointed in `checkpoint.sqlite` only after its products are synced to the shard, together with
+    their position in it. When the harvest is restarted, shards are truncated to their checkpointed contents and only
+    the windows not checkpointed are requested, so an interrupted window is requested again from its start, and
+    a finished one never.
+
+    Example usage:
+        f = Filter()
+        f.by_attribute([Atr.ProductType() == 'S2MSI2A'])
+
+        harvester = Harvester('backfill', ['SENTINEL-1', 'SENTINEL-2'], datetime(2017, 1, 1), datetime(2024, 1, 1),
+                              fltr=f)
+        print(harvester.run(processes=32))  # {'windows': 5114, 'skipped': 0, 'products': ..., 'failed': []}
+
+        for product in harvester.products():
+            ...
+
+    Windows of similar numbers of products can be planned from counts instead, see `CountHistogram.plan()`:
+        histogram = CountHistogram(Client(), 'counts.sqlite')
+        histogram.refresh(collections, start, end)
+        harvester = Harvester('backfill', collections, start, end,
+                              plan=histogram.plan(collections, start, end, max_count=10000))
+
+    Class attributes:
+        window - length of the windows. Windows with more results than the server can skip through are split
+        plan - windows to be harvested instead of the windows of `window` length: [(collection, start, end)]
+        top - number of products per page
+    """
+
+    def __init__(self, directory: str, collections: [str], start: datetime, end: datetime,
+                 window: timedelta = timedelta(days=1), fltr: Filter or str or None = None, top: int = 1000,
+                 expand_attributes: bool = False, select: [str] or None = None, endpoint: str or None = None,
+                 timeout: tuple or float = (30, 30), plan: [(str, datetime, datetime)] or None = None):
+        """
+        :param directory: Directory of the shards and the checkpoint database.
+        :param collections: Collection names, i.e. ['SENTINEL-1', 'SENTINEL-2'].
+        :param start: Start of the sensing period (`ContentDate/Start`), inclusive.
+        :param end: End of the sensing period, exclusive.
+        :param window: See the class attributes.
+        :param fltr: `Filter` (or its body) joined with every window with `and`, i.e. to limit the product types.
+        :param top: See the class attributes.
+        :param expand_attributes: If True, the products include their `Attributes`.
+        :param select: Product fields to be harvested, see `Query.set_select()`. `ContentDate` is required.
+        :param endpoint: Products endpoint. None - `config['endpoint']`.
+        :param timeout: A paramater of the `session.get()`.
+        :param plan: See the class attributes. The windows must not overlap and lie in the collections and the period.
+        """
+        if select is not None and 'ContentDate' not in select:
+            raise ValueError('The `ContentDate` field must be selected to paginate the windows')
+
+        self.directory = directory
+        self.collections = list(collections)
+        self.start = start
+        self.end = end
+        self.window = window
+        self.plan = None
+        if plan is not None:
+            self.plan = [(collection, window_start, window_end) for collection, window_start, window_end in plan]
+            for collection, window_start, window_end in self.plan:
+                if collection not in self.collections or not start <= window_start < window_end <= end:
+                    raise ValueError(f'The window is out of the harvest: {(collection, window_start, window_end)}')
+        self.top = top
+        self.checkpoint = os.path.join(directory, 'checkpoint.sqlite')
+        self.settings = {'directory': directory,
+                         'checkpoint': self.checkpoint,
+                         'endpoint': config['endpoint'] if endpoint is None else endpoint,
+                         'filter': getattr(fltr, 'body', fltr),
+                         'top': top,
+                         'expand': 'Attributes' if expand_attributes else None,
+                         'select': None if select is None else ','.join(select),
+                         'timeout': timeout}
+
+    def windows(self) -> [(str, datetime, datetime)]:
+        """
+        :return: All windows of the harvest: [(collection, start, end)].
+        """
+        if self.plan is not None:
+            return list(self.plan)
+        windows = []
+        for collection in self.collections:
+            start = self.start
+            while start < self.end:
+                end = min(start + self.window, self.end)
+                windows.append((collection, start, end))
+                start = end
+        return windows
+
+    def __recover(self, connection: sqlite3.Connection) -> set:
+        """
+        Truncates the shards to their checkpointed contents.
+        :return: Finished windows: {(collection, start, end)}.
+        """
+        done = set(connection.execute('SELECT collection, start, end FROM windows').fetchall())
+        ends = dict(connection.execute('SELECT shard, MAX(offset_end) FROM windows GROUP BY shard').fetchall())
+
+        for name in os.listdir(self.directory):
+            if name.startswith('shard-') and name.endswith('.jsonl'):
+                path = os.path.join(self.directory, name)
+                if os.path.getsize(path) > ends.get(name, 0):
+                    with open(path, 'r+b') as file:
+                        file.truncate(ends.get(name, 0))
+        return done
+
+    def run(self, processes: int or None = None) -> dict:
+        """
+        Harvests the windows not finished yet.
+        :param processes: Number of worker processes. None - the number of CPUs.
+        :return: {'windows': number of harvested windows, 'skipped': number of windows finished before,
+                  'products': number of harvested products, 'failed': [(collection, start, end, error message)]}
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        connection = _connect(self.checkpoint)
+        try:
+            done = self.__recover(connection)
+        finally:
+            connection.close()
+
+        windows = [window for window in self.windows()
+                   if (window[0], window[1].isoformat(), window[2].isoformat()) not in done]
+        summary = {'windows': 0, 'skipped': len(self.windows()) - len(windows), 'products': 0, 'failed': []}
+        if not windows:
+            return summary
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_initialize, initargs=(self.settings,)) as pool:
+            futures = {pool.submit(_harvest, *window): window for window in windows}
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None:
+                    summary['failed'].append((*futures[future], f'{type(error).__name__}: {error}'))
+                else:
+                    summary['windows'] += 1
+                    summary['products'] += future.result()
+        return summary
+
+    def products(self):
+        """
+        Reads the harvested products, window by window in the order of `windows()`.
+        :return: Generator of products (dictionaries).
+        """
+        connection = _connect(self.checkpoint)
+        try:
+            rows = connection.execute('SELECT collection, start, shard, offset_start, offset_end FROM windows '
+                                      'ORDER BY collection, start').fetchall()
+        finally:
+            connection.close()
+
+        order = {collection: index for index, collection in enumerate(self.collections)}
+        rows.sort(key=lambda row: (order.get(row[0], len(order)), row[1]))
+        for collection, start, shard, offset_start, offset_end in rows:
+            with open(os.path.join(self.directory, shard), 'rb') as file:
+                file.seek(offset_start)
+                for line in file.read(offset_end - offset_start).splitlines():
+                    yield json.loads(line)
@@ -0,0 +1,62 @@
+import threading
+from collections import deque
+
+
+class Hedging:
+    """
+    Hedged requests policy. If a request has not been answered within the observed `percentile` latency, a duplicate
+    is sent and whichever answers first wins. Latencies are tracked over the last `window` requests; until
+    `min_samples` of them are observed, `initial_delay` is used. Share one instance between clients to share the
+    statistics.
+
+    Example usage:
+        query = Query()
+        query.hedging = Hedging(percentile=95)
+        query.deadline = 10
+
+    Class attributes:
+        hedged - the number of duplicate requests sent
+    """
+
+    def __init__(self, percentile: float = 95, window: int = 1000, min_samples: int = 20, initial_delay: float = 2.0,
+                 max_workers: int = 32):
+        """
+        :param percentile: Percentile (0 - 100) of the latency after which a duplicate request is sent.
+        :param window: Number of the last latencies to be tracked.
+        :param min_samples: Minimum number of latencies to compute the percentile from.
+        :param initial_delay: Delay in seconds used until `min_samples` latencies are observed.
+        :param max_workers: Maximum number of concurrent attempts of a client.
+        """
+        if not 0 < percentile <= 100:
+            raise ValueError('`percentile` must be in the range: (0, 100]')
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.max_workers = max_workers
+        self.hedged = 0
+
+        self.__lock = threading.Lock()
+        self.__latencies = deque(maxlen=window)
+
+    def record(self, latency: float) -> None:
+        """
+        :param latency: Latency of a successful request in seconds.
+        :return: None
+        """
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    def record_hedge(self) -> None:
+        with self.__lock:
+            self.hedged += 1
+
+    def delay(self) -> float:
+        """
+        :return: Seconds to wait for an answer before a duplicate request is sent.
+        """
+        with self.__lock:
+            if len(self.__latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self.__latencies)
+        index = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return latencies[index]
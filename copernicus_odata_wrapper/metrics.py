@@ -0,0 +1,182 @@
+import bisect
+import threading
+
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+BYTES_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864]
+
+
+class MetricsSink:
+    """
+    Receiver of the metrics reported by `Client`. This base class discards them; subclass it to forward the metrics
+    to another system, or use `MetricsRegistry`.
+
+    Reported metrics:
+        copernicus_requests_total{host, method, status} - counter of HTTP requests ('error' status - no response)
+        copernicus_request_phase_seconds{phase} - histogram of the request phases: 'build' (url), 'server' (connect
+            and time to the response headers), 'download' (response body), 'decode' (JSON), 'check' (errors)
+        copernicus_request_seconds{host, method} - histogram of the whole request
+        copernicus_response_bytes{host} - histogram of the response body sizes
+        copernicus_products_total - counter of the received products and nodes
+        copernicus_retries_total{reason} - counter of the repeated requests ('hedge', 'failover')
+        copernicus_cache_hits_total{cache}, copernicus_cache_misses_total{cache} - counters of the cache lookups
+            ('nodes', 'single_flight', 'resolver', 'histogram')
+        copernicus_scheduler_queue_seconds{priority} - histogram of the time requests waited for a `RequestScheduler`
+            slot
+        copernicus_scheduler_requests_total{priority} - counter of the requests admitted by a `RequestScheduler`
+    """
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        :param name: Counter name.
+        :param value: Value to be added.
+        :param labels: Label names and values.
+        :return: None
+        """
+        pass
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        :param name: Histogram name.
+        :param value: Observed value.
+        :param labels: Label names and values.
+        :return: None
+        """
+        pass
+
+
+class _Histogram:
+
+    def __init__(self, buckets: [float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class MetricsRegistry(MetricsSink):
+    """
+    In-process registry of counters and histograms.
+
+    Example usage:
+        metrics = MetricsRegistry()
+
+        query = Query()
+        query.metrics = metrics
+        query.send()
+
+        print(metrics.counter('copernicus_requests_total', host='catalogue.dataspace.copernicus.eu', method='GET',
+                              status=200))
+        print(metrics.histogram('copernicus_request_phase_seconds', phase='server'))
+        print(metrics.to_prometheus())  # Prometheus text exposition format
+    """
+
+    def __init__(self, buckets: dict or None = None):
+        """
+        :param buckets: {histogram name: upper bounds of the buckets}. By default, `BYTES_BUCKETS` are used for the
+        names ending with '_bytes' and `SECONDS_BUCKETS` for the others.
+        """
+        self.buckets = buckets or {}
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__histograms = {}
+
+    def __buckets(self, name: str) -> [float]:
+        if name in self.buckets:
+            return sorted(self.buckets[name])
+        return BYTES_BUCKETS if name.endswith('_bytes') else SECONDS_BUCKETS
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = _Histogram(self.__buckets(name))
+            histogram.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        :param name: Counter name.
+        :param labels: Label names and values.
+        :return: Value of the counter (0 if it does not exist).
+        """
+        with self.__lock:
+            return self.__counters.get(_key(name, labels), 0)
+
+    def histogram(self, name: str, **labels) -> dict:
+        """
+        :param name: Histogram name.
+        :param labels: Label names and values.
+        :return: {'count': ..., 'sum': ..., 'buckets': {upper bound: cumulative count}}
+        """
+        with self.__lock:
+            histogram = self.__histograms.get(_key(name, labels))
+            if histogram is None:
+                return {'count': 0, 'sum': 0.0, 'buckets': {}}
+
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+                cumulative += count
+                buckets[bound] = cumulative
+            return {'count': histogram.count, 'sum': histogram.sum, 'buckets': buckets}
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        :return: All metrics in the Prometheus text exposition format.
+        """
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            histograms = sorted(self.__histograms.items(), key=lambda item: item[0])
+            lines = []
+
+            name = None
+            for (metric, labels), value in counters:
+                if metric != name:
+                    name = metric
+                    lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            name = None
+            for (metric, labels), histogram in histograms:
+                if metric != name:
+                    name = metric
+                    lines.append(f'# TYPE {name} histogram')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{name}_bucket{_format_labels(labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,127 @@
+import time
+import threading
+
+from .config import config
+
+
+class EndpointPool:
+    """
+    Equivalent endpoints of one role (i.e. the catalogue and its mirrors), scored by the exponentially weighted
+    moving averages of their latency and error rate. Endpoints without observations are tried first, so every
+    endpoint gets measured.
+    """
+
+    def __init__(self, endpoints: [str], alpha: float = 0.2, error_penalty: float = 10.0):
+        """
+        :param endpoints: Equivalent endpoint urls, i.e. ['https://catalogue.dataspace.copernicus.eu/odata/v1/Products',
+        'https://proxy.example.com/odata/v1/Products'].
+        :param alpha: Weight (0 - 1) of the newest observation in the moving averages.
+        :param error_penalty: How many times an endpoint that always fails scores worse than one that never does.
+        """
+        if not endpoints:
+            raise ValueError('At least one endpoint is required')
+        self.endpoints = [endpoint.rstrip('/') for endpoint in endpoints]
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+
+        self.__lock = threading.Lock()
+        self.__latency = {endpoint: None for endpoint in self.endpoints}
+        self.__errors = {endpoint: 0.0 for endpoint in self.endpoints}
+
+    def match(self, url: str) -> str or None:
+        """
+        :param url: Request url.
+        :return: The url without the endpoint part, or None if it does not start with any of the endpoints.
+        """
+        for endpoint in self.endpoints:
+            if url.startswith(endpoint):
+                return url[len(endpoint):]
+        return None
+
+    def score(self, endpoint: str) -> float:
+        """
+        :param endpoint: One of the endpoints.
+        :return: Expected cost of a request, the lower the better.
+        """
+        with self.__lock:
+            latency = self.__latency[endpoint]
+            errors = self.__errors[endpoint]
+        if latency is None:
+            return 0.0
+        return latency * (1 + self.error_penalty * errors)
+
+    def candidates(self) -> [str]:
+        """
+        :return: The endpoints, the best first.
+        """
+        return sorted(self.endpoints, key=self.score)
+
+    def record(self, endpoint: str, failed: bool, latency: float) -> None:
+        """
+        :param endpoint: One of the endpoints.
+        :param failed: True - if the request failed.
+        :param latency: Latency of the request in seconds.
+        :return: None
+        """
+        with self.__lock:
+            previous = self.__latency[endpoint]
+            self.__latency[endpoint] = latency if previous is None else (
+                    self.alpha * latency + (1 - self.alpha) * previous)
+            self.__errors[endpoint] = self.alpha * failed + (1 - self.alpha) * self.__errors[endpoint]
+
+    def snapshot(self) -> dict:
+        """
+        :return: {endpoint: {'latency': ..., 'error_rate': ..., 'score': ...}}, the best endpoint first.
+        """
+        with self.__lock:
+            latency = dict(self.__latency)
+            errors = dict(self.__errors)
+        return {endpoint: {'latency': latency[endpoint], 'error_rate': errors[endpoint],
+                           'score': self.score(endpoint)}
+                for endpoint in self.candidates()}
+
+
+class Mirrors:
+    """
+    Catalogue and zipper endpoint pools. Requests to any endpoint of a pool are sent to the best scored endpoint of
+    the pool, and repeated on the next one if it fails (connection error, timeout, 5xx or open circuit).
+
+    Example usage:
+        mirrors = Mirrors(catalogue=['https://catalogue.dataspace.copernicus.eu/odata/v1/Products',
+                                     'https://eu-proxy.example.com/odata/v1/Products'])
+        query = Query()
+        query.mirrors = mirrors
+        response = query.send()
+
+        print(mirrors.catalogue.snapshot())
+    """
+
+    def __init__(self, catalogue: [str] or None = None, zipper: [str] or None = None, **options):
+        """
+        :param catalogue: Catalogue endpoints. None - `config['endpoint']` only.
+        :param zipper: Zipper endpoints. None - `config['endpoint_zipper']` only.
+        :param options: Parameters of both `EndpointPool`s.
+        """
+        self.catalogue = EndpointPool(catalogue or [config['endpoint']], **options)
+        self.zipper = EndpointPool(zipper or [config['endpoint_zipper']], **options)
+
+    @classmethod
+    def from_config(cls, **options) -> 'Mirrors':
+        """
+        :param options: Parameters of both `EndpointPool`s.
+        :return: Mirrors of the `config` endpoints and their `endpoint_mirrors`/`endpoint_zipper_mirrors`.
+        """
+        return cls(catalogue=[config['endpoint']] + config['endpoint_mirrors'],
+                   zipper=[config['endpoint_zipper']] + config['endpoint_zipper_mirrors'],
+                   **options)
+
+    def route(self, url: str) -> (EndpointPool or None, str or None):
+        """
+        :param url: Request url.
+        :return: (pool, url without the endpoint part), or (None, None) if the url does not match any pool.
+        """
+        for pool in (self.catalogue, self.zipper):
+            path = pool.match(url)
+            if path is not None:
+                return pool, path
+        return None, None
@@ -0,0 +1,190 @@
+import re
+import functools
+from datetime import datetime
+from collections import namedtuple
+
+_DATE = r'\d{8}T\d{6}'
+
+_S1 = re.compile(rf'(?P<mission>S1[A-D])_(?P<mode>[A-Z0-9]{{2}})_(?P<type>[A-Z]{{3}}[A-Z_])_(?P<level>\d)'
+                 rf'(?P<class>[SA])(?P<polarisation>[A-Z]{{2}})_(?P<start>{_DATE})_(?P<stop>{_DATE})_'
+                 rf'(?P<orbit>\d{{6}})_(?P<datatake>[0-9A-F]{{6}})_(?P<unique>[0-9A-F]{{4}})')
+_S2 = re.compile(rf'(?P<mission>S2[A-D])_MSI(?P<level>L\d[A-C])_(?P<start>{_DATE})_N(?P<baseline>\d{{4}})_'
+                 rf'R(?P<relative_orbit>\d{{3}})_T(?P<tile>\d{{2}}[A-Z]{{3}})_(?P<generated>{_DATE})')
+_S3 = re.compile(rf'(?P<mission>S3[A-D_])_(?P<type>(?P<instrument>[A-Z]{{2}})_(?P<level>\d)_[A-Z0-9_]{{6}})_'
+                 rf'(?P<start>{_DATE})_(?P<stop>{_DATE})_(?P<generated>{_DATE})_(?P<instance>.{{17}})_'
+                 rf'(?P<centre>[A-Z0-9_]{{3}})_(?P<platform>[OFDR])_(?P<timeliness>[A-Z_]{{2}})_(?P<baseline>\d{{3}})')
+_S5P = re.compile(rf'(?P<mission>S5P)_(?P<class>[A-Z]{{4}})_(?P<type>(?P<level>L[0-2][A-Z_]{{2}})[A-Z0-9_]{{6}})_'
+                  rf'(?P<start>{_DATE})_(?P<stop>{_DATE})_(?P<orbit>\d{{5}})_(?P<collection>\d{{2}})_'
+                  rf'(?P<processor>\d{{6}})_(?P<generated>{_DATE})')
+
+# the absolute orbit of the first relative orbit, per Sentinel-1 unit (175 orbits per cycle)
+_S1_ORBIT_OFFSETS = {'S1A': 73, 'S1B': 27}
+
+FIELDS = ('mission', 'product_type', 'level', 'mode', 'start', 'stop', 'absolute_orbit', 'relative_orbit', 'tile',
+          'baseline', 'generated')
+
+ProductName = namedtuple('ProductName', FIELDS)
+ProductName.__doc__ = """
+Fields encoded in a product name. Fields not encoded in the names of a mission are None.
+    mission - 'S1A', 'S2B', 'S3A', 'S5P', ...
+    product_type - as the `productType` attribute: 'IW_GRDH_1S', 'S2MSI2A', 'OL_1_EFR___', 'L2__NO2___'
+    level - processing level: 'L1', 'L1C', 'L2A', 'L1B', 'L2'
+    mode - Sentinel-1 acquisition mode ('IW', 'EW', ...) or Sentinel-3 instrument ('OL', 'SL', 'SR', 'SY')
+    start, stop - sensing start and stop (datetime)
+    absolute_orbit, relative_orbit - orbit numbers (int)
+    tile - Sentinel-2 MGRS tile, i.e. '42VWN'
+    baseline - processing baseline (int): Sentinel-2 'N0509' - 509, Sentinel-3 '003' - 3, Sentinel-5P processor
+               version '020500' - 20500
+    generated - generation time of the product (datetime)
+"""
+
+_UNKNOWN = ProductName(*(None,) * len(FIELDS))
+
+
+def _date(text: str) -> datetime:
+    return datetime(int(text[0:4]), int(text[4:6]), int(text[6:8]), int(text[9:11]), int(text[11:13]),
+                    int(text[13:15]))
+
+
+def _s1(match) -> ProductName:
+    mission = match['mission']
+    orbit = int(match['orbit'])
+    offset = _S1_ORBIT_OFFSETS.get(mission)
+    return ProductName(mission, f"{match['mode']}_{match['type']}_{match['level']}{match['class']}",
+                       f"L{match['level']}", match['mode'], _date(match['start']), _date(match['stop']), orbit,
+                       None if offset is None else (orbit - offset) % 175 + 1, None, None, None)
+
+
+def _s2(match) -> ProductName:
+    level = match['level']
+    return ProductName(match['mission'], f'S2MSI{level[1:]}', level, None, _date(match['start']), None, None,
+                       int(match['relative_orbit']), match['tile'], int(match['baseline']),
+                       _date(match['generated']))
+
+
+def _s3(match) -> ProductName:
+    relative_orbit = match['instance'][9:12]
+    return ProductName(match['mission'], match['type'], f"L{match['level']}", match['instrument'],
+                       _date(match['start']), _date(match['stop']), None,
+                       int(relative_orbit) if relative_orbit.isdigit() else None, None, int(match['baseline']),
+                       _date(match['generated']))
+
+
+def _s5p(match) -> ProductName:
+    return ProductName(match['mission'], match['type'], match['level'].rstrip('_'), None, _date(match['start']),
+                       _date(match['stop']), int(match['orbit']), None, None, int(match['processor']),
+                       _date(match['generated']))
+
+
+_PARSERS = {'S1': (_S1, _s1), 'S2': (_S2, _s2), 'S3': (_S3, _s3), 'S5': (_S5P, _s5p)}
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_name(name: str) -> ProductName:
+    """
+    Parses a Sentinel-1, Sentinel-2, Sentinel-3 or Sentinel-5P product name. Results are cached, so names seen again
+    (i.e. in overlapping pages) are not parsed twice.
+
+    Example usage:
+        fields = parse_name('S2A_MSIL1C_20230702T064631_N0509_R020_T42VWN_20230702T083443.SAFE')
+        print(fields.tile, fields.baseline, fields.start)  # 42VWN 509 2023-07-02 06:46:31
+
+    :param name: Product name, with or without its extension.
+    :return: `ProductName`. All fields are None if the name does not follow the naming conventions.
+    """
+    parser = _PARSERS.get(name[:2])
+    if parser is None:
+        return _UNKNOWN
+    pattern, build = parser
+    match = pattern.match(name)
+    return _UNKNOWN if match is None else build(match)
+
+
+def _names(items):
+    """
+    :param items: Iterable of names, products or pages (responses with 'value').
+    :return: Generator of (item, name): names and products as they are, the products of the pages one by one.
+    """
+    for item in items:
+        if isinstance(item, str):
+            yield item, item
+        elif 'value' in item and 'Name' not in item:
+            for product in item['value']:
+                yield product, product['Name']
+        else:
+            yield item, item['Name']
+
+
+def parse_names(items) -> dict:
+    """
+    Parses the names into columns in one pass.
+
+    Example usage:
+        columns = parse_names(query.pages())
+        print(columns['name'][0], columns['tile'][0], columns['baseline'][0])
+
+    :param items: Iterable of names, products or pages (responses with 'value'), i.e. `Query.pages()`.
+    :return: {'name': [...], 'mission': [...], ...} - a list per field of `ProductName`, in the order of the names.
+    """
+    names = [name for _, name in _names(items)]
+    rows = [parse_name(name) for name in names]
+    columns = {'name': names}
+    for field, column in zip(FIELDS, zip(*rows) if rows else [()] * len(FIELDS)):
+        columns[field] = list(column)
+    return columns
+
+
+def group_by(items, *fields: str) -> dict:
+    """
+    Groups names or products by fields of their names.
+
+    Example usage:
+        groups = group_by(query.products(), 'tile', 'relative_orbit')
+        for (tile, relative_orbit), products in groups.items():
+            ...
+
+    :param items: Iterable of names, products or pages.
+    :param fields: Fields of `ProductName`.
+    :return: {(field values): [names or products]}, in the order of the items.
+    """
+    groups = {}
+    for item, name in _names(items):
+        parsed = parse_name(name)
+        groups.setdefault(tuple(getattr(parsed, field) for field in fields), []).append(item)
+    return groups
+
+
+def _acquisition(parsed: ProductName) -> tuple:
+    start = parsed.start
+    if parsed.tile is not None and start is not None:
+        start = start.date()
+    return parsed.mission, parsed.product_type, parsed.tile, start
+
+
+def latest_baseline(items) -> list:
+    """
+    Deduplicates reprocessed products: of the products of the same acquisition, only the one with the latest
+    processing baseline (then generation time) is kept. The acquisition is the mission, product type, tile and sensing
+    date for Sentinel-2, otherwise the mission, product type and sensing start. Unparsable names are all kept.
+
+    Example usage:
+        products = latest_baseline(query.products())
+
+    :param items: Iterable of names, products or pages.
+    :return: The kept names or products, each in the place of the first product of its acquisition.
+    """
+    kept = {}
+    order = []
+    for item, name in _names(items):
+        parsed = parse_name(name)
+        if parsed.mission is None:
+            order.append((None, item))
+            continue
+        key = _acquisition(parsed)
+        rank = (parsed.baseline or 0, parsed.generated or datetime.min)
+        current = kept.get(key)
+        if current is None:
+            order.append((key, None))
+        if current is None or rank > current[0]:
+            kept[key] = (rank, item)
+    return [item if key is None else kept[key][1] for key, item in order]
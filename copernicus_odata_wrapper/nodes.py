@@ -0,0 +1,261 @@
+import re
+import json
+import heapq
+import time
+import sqlite3
+import threading
+from collections import deque
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .tracing import scope
+
+
+_NODES_URL = re.compile(r'Products\(([^)]+)\)((?:/Nodes\([^)]*\))*)/Nodes$')
+
+
+def _matches(name: str, patterns: [str]) -> bool:
+    return any(fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def _patterns(patterns: str or [str] or None) -> [str] or None:
+    if isinstance(patterns, str):
+        return [patterns]
+    return patterns
+
+
+def walk_nodes(client, uuid: str, max_depth: int or None = None, include: str or [str] or None = None,
+               prune: str or [str] or None = None, max_workers: int = 8, deadline=None, priority=None):
+    """
+    Crawls the Nodes tree of a product breadth-first. Up to `max_workers` listings are requested concurrently, and
+    nodes are yielded as soon as their parent listing arrives and no shallower listing is pending, so the whole tree
+    is listed in about `depth` round trips instead of one round trip per folder.
+
+    Example usage:
+        query = Query()
+        for path, node in query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8', include='*.jp2',
+                                           prune=['HTML', 'rep_info']):
+            print(path, node['ContentLength'])
+
+    :param client: `Client` to send requests with.
+    :param uuid: uuid or url pointing exact product or url pointing product nodes.
+    :param max_depth: Maximum depth of yielded nodes (1 - only the nodes of the first listing). None - no limit.
+    :param include: Name pattern(s) (`fnmatch` style) of the nodes to be yielded. None - all nodes are yielded.
+    Folders that do not match are still crawled.
+    :param prune: Name pattern(s) (`fnmatch` style) of the nodes to be skipped together with their contents.
+    :param max_workers: Maximum number of concurrent requests.
+    :param deadline: `Deadline` of the whole crawl or None.
+    :param priority: Name of the priority class of the requests or None.
+    :return: Generator of (path, node) tuples, where `path` is a '/' separated path of the node names.
+    """
+    if max_depth is not None and max_depth < 1:
+        raise ValueError('`max_depth` minimum is 1')
+
+    include = _patterns(include)
+    prune = _patterns(prune)
+
+    walk_scope = scope(client.tracer, 'walk_nodes')
+    frontier = deque([(uuid, '', 1)])
+    running = {}
+    arrived = []  # heap of the listings held back until no shallower listing is pending
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    error = None
+
+    def shallowest() -> float:
+        depths = [depth for _, depth in running.values()]
+        if frontier:
+            depths.append(frontier[0][2])
+        return min(depths, default=float('inf'))
+
+    try:
+        while frontier or running or arrived:
+            while frontier and len(running) < max_workers:
+                url, path, depth = frontier.popleft()
+                future = executor.submit(walk_scope.run, client.product_nodes, url, prefetch=False, deadline=deadline,
+                                         priority=priority)
+                running[future] = (path, depth)
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, depth = running.pop(future)
+                    heapq.heappush(arrived, (depth, id(future), path, future.result()))
+
+            while arrived and arrived[0][0] <= shallowest():
+                depth, _, path, listing = heapq.heappop(arrived)
+                for node in listing['result']:
+                    name = node['Name']
+                    if prune is not None and _matches(name, prune):
+                        continue
+
+                    node_path = f'{path}/{name}' if path else name
+                    if include is None or _matches(name, include):
+                        yield node_path, node
+
+                    if node.get('ChildrenNumber') and (max_depth is None or depth < max_depth):
+                        frontier.append((node['Nodes']['uri'], node_path, depth + 1))
+    except Exception as exception:
+        error = exception
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        walk_scope.close(error)
+
+
+def parse_nodes_url(url: str) -> (str, str):
+    """
+    Splits the url of a Nodes listing into the product Id and the node path.
+
+    Example usage:
+        parse_nodes_url('https://zipper.dataspace.copernicus.eu/odata/v1/Products(db0c8ef3-8ec0-5185-a537-812dad3c58f8)'
+                        '/Nodes(S2A_MSIL1C_20180927T051221_N0206_R033_T42FXL_20180927T073143.SAFE)/Nodes(AUX_DATA)/Nodes')
+
+    Returns:
+        ('db0c8ef3-8ec0-5185-a537-812dad3c58f8', 'S2A_MSIL1C_20180927T051221_N0206_R033_T42FXL_20180927T073143.SAFE/AUX_DATA')
+
+    :param url: Url of a Nodes listing.
+    :return: (product Id, '/' separated node path). The path of the product root listing is ''.
+    """
+    match = _NODES_URL.search(url)
+    if match is None:
+        raise ValueError(f'Not a Nodes listing url: {url}')
+    product_id, nodes = match.groups()
+    return product_id, '/'.join(re.findall(r'/Nodes\(([^)]*)\)', nodes))
+
+
+class NodesCache:
+    """
+    Persistent cache of Nodes listings, keyed by product Id and node path. The contents of a published product do not
+    change, so listings are kept until the product's `ModificationDate` changes. The cache does not check it by
+    itself: call `validate()` (or `validate_products()` with the products of a search) before listing the nodes of
+    products that may have been modified, or set `max_age` to stop serving old listings. The cache is an SQLite
+    database, so it can be shared by several processes.
+
+    Example usage:
+        cache = NodesCache('nodes.sqlite')
+
+        query = Query()
+        query.nodes_cache = cache
+
+        response = query.send()
+        cache.validate_products(response['value'])  # drops listings of the modified products
+        for product in response['value']:
+            nodes = query.product_nodes(product['Id'])
+
+    Class attributes:
+        prefetch - if True, when a listing is downloaded, listings of its folders are downloaded in the background
+        max_age - seconds after which a cached listing is not served any more (and is downloaded again). None - the
+                  listings are served until `validate()` drops them
+    """
+
+    def __init__(self, path: str = ':memory:', prefetch: bool = True, max_age: float or None = None):
+        """
+        :param path: Path of the database file. ':memory:' - the cache is not persistent.
+        :param prefetch: See the class attributes.
+        :param max_age: See the class attributes.
+        """
+        self.path = path
+        self.prefetch = prefetch
+        self.max_age = max_age
+
+        self.__lock = threading.Lock()
+        self.__loaded = {}
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS products '
+                                  '(product_id TEXT PRIMARY KEY, modification_date TEXT)')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS listings (product_id TEXT, path TEXT, listing TEXT, '
+                                  'cached_at REAL, PRIMARY KEY (product_id, path))')
+
+    def __fresh(self, cached_at: float) -> bool:
+        return self.max_age is None or time.time() - cached_at <= self.max_age
+
+    def get(self, url: str) -> dict or None:
+        """
+        :param url: Url of a Nodes listing.
+        :return: The cached listing, or None if it is not cached or older than `max_age`.
+        """
+        product_id, path = parse_nodes_url(url)
+        with self.__lock:
+            loaded = self.__loaded.get(product_id)
+            if loaded is not None and path in loaded:
+                listing, cached_at = loaded[path]
+                return listing if self.__fresh(cached_at) else None
+
+            row = self.__connection.execute('SELECT listing, cached_at FROM listings WHERE product_id = ? AND '
+                                            'path = ?', (product_id, path)).fetchone()
+        if row is None or not self.__fresh(row[1]):
+            return None
+        return json.loads(row[0])
+
+    def put(self, url: str, listing: dict) -> None:
+        """
+        :param url: Url of a Nodes listing.
+        :param listing: The listing (response of the request).
+        :return: None
+        """
+        product_id, path = parse_nodes_url(url)
+        cached_at = time.time()
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO listings (product_id, path, listing, cached_at) '
+                                      'VALUES (?, ?, ?, ?)', (product_id, path, json.dumps(listing), cached_at))
+            loaded = self.__loaded.get(product_id)
+            if loaded is not None:
+                loaded[path] = listing, cached_at
+
+    def load(self, product_id: str) -> dict:
+        """
+        Bulk-loads all cached listings of a product into memory, so the following `get()` calls do not query the
+        database. Listings older than `max_age` are left out.
+        :param product_id: Product Id.
+        :return: Dictionary {node path: listing}.
+        """
+        with self.__lock:
+            rows = self.__connection.execute('SELECT path, listing, cached_at FROM listings WHERE product_id = ?',
+                                             (product_id,)).fetchall()
+            loaded = {path: (json.loads(listing), cached_at) for path, listing, cached_at in rows
+                      if self.__fresh(cached_at)}
+            self.__loaded[product_id] = loaded
+        return {path: listing for path, (listing, _) in loaded.items()}
+
+    def validate(self, product_id: str, modification_date: str) -> bool:
+        """
+        Compares the `ModificationDate` of a product with the one the listings were cached for. If it has changed,
+        the listings of the product are dropped. On the first validation of a product the date its listings were
+        cached for is unknown, so they are dropped as well.
+        :param product_id: Product Id.
+        :param modification_date: `ModificationDate` of the product, i.e. '2019-01-17T14:21:35.996Z'.
+        :return: True - if the cached listings (if any) are still valid.
+        """
+        with self.__lock:
+            row = self.__connection.execute('SELECT modification_date FROM products WHERE product_id = ?',
+                                            (product_id,)).fetchone()
+            if row is not None and row[0] == modification_date:
+                return True
+
+            self.__connection.execute('INSERT OR REPLACE INTO products VALUES (?, ?)', (product_id, modification_date))
+            dropped = self.__connection.execute('DELETE FROM listings WHERE product_id = ?', (product_id,)).rowcount
+            self.__loaded.pop(product_id, None)
+            return row is None and dropped == 0
+
+    def validate_products(self, products: [dict]) -> int:
+        """
+        Calls `validate()` for products from a search response.
+        :param products: Products, i.e. `response['value']`.
+        :return: The number of invalidated products.
+        """
+        return sum(not self.validate(product['Id'], product['ModificationDate']) for product in products)
+
+    def clear(self) -> None:
+        """
+        Removes all cached listings.
+        :return: None
+        """
+        with self.__lock:
+            self.__connection.execute('DELETE FROM listings')
+            self.__connection.execute('DELETE FROM products')
+            self.__loaded.clear()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
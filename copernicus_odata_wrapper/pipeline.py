@@ -0,0 +1,250 @@
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_DONE = object()
+_STOPPED = object()
+
+
+def page_products(page: dict) -> [dict]:
+    """
+    :return: Products of a page, for `Pipeline.flat_map()`.
+    """
+    return page['value']
+
+
+class _Stage:
+
+    def __init__(self, function, workers: int, processes: bool, flat: bool, name: str, queue_size: int):
+        if workers < 1:
+            raise ValueError('`workers` minimum is 1')
+        self.function = function
+        self.workers = workers
+        self.processes = processes
+        self.flat = flat
+        self.name = name
+        self.queue_size = queue_size
+        self.running = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+
+class Pipeline:
+    """
+    Chain of processing stages fed by an iterator, typically `Query.pages()`. Stages are connected by queues of at most
+    `queue_size` items, and each stage runs `workers` threads (or processes). When a stage falls behind, the queue
+    before it fills up and the stages before it wait, up to the source: the next page is not requested until there is
+    room for it. So the pipeline runs at the speed of its slowest stage and holds at most about
+    `sum(queue_size + workers)` items at once, however long the harvest is.
+
+    With more than one worker, a stage may reorder the items. A function returning None drops the item. Functions of
+    process stages must be picklable (defined at a module level), as are their items and results.
+
+    Example usage:
+        query = Query()
+        query.set_filter(f)
+        query.set_top(1000)
+
+        pipeline = Pipeline(query.pages(), queue_size=2)
+        pipeline.flat_map(page_products)
+        pipeline.map(parse, workers=4, processes=True)
+        pipeline.map(enrich, workers=8)
+
+        with GeoJsonWriter('products.geojson') as writer:
+            pipeline.run(writer.write)
+    """
+
+    def __init__(self, source, queue_size: int = 2):
+        """
+        :param source: Iterable of items, i.e. `Query.pages()`. It is iterated in its own thread.
+        :param queue_size: Default size of the queues between the stages.
+        """
+        self.source = source
+        self.queue_size = queue_size
+        self.__stages = []
+        self.__started = False
+        self.__stop = threading.Event()
+        self.__error = None
+        self.__lock = threading.Lock()
+        self.__source_blocked = 0.0
+
+    def __add(self, function, workers: int, processes: bool, flat: bool, name: str or None,
+              queue_size: int or None) -> 'Pipeline':
+        if self.__started:
+            raise RuntimeError('Stages can not be added to a running pipeline')
+        name = name or getattr(function, '__name__', None) or f'stage{len(self.__stages)}'
+        self.__stages.append(_Stage(function, workers, processes, flat, name,
+                                    self.queue_size if queue_size is None else queue_size))
+        return self
+
+    def map(self, function, workers: int = 1, processes: bool = False, name: str or None = None,
+            queue_size: int or None = None) -> 'Pipeline':
+        """
+        Adds a stage replacing every item with `function(item)`.
+        :param function: Function of an item. None results are dropped.
+        :param workers: Number of threads (or processes) running the function.
+        :param processes: If True, the function runs in a pool of `workers` processes.
+        :param name: Name of the stage in `stats()`. None - name of the function.
+        :param queue_size: Size of the queue of the results. None - the default of the pipeline.
+        :return: The pipeline, so the stages can be chained.
+        """
+        return self.__add(function, workers, processes, False, name, queue_size)
+
+    def flat_map(self, function, workers: int = 1, processes: bool = False, name: str or None = None,
+                 queue_size: int or None = None) -> 'Pipeline':
+        """
+        Same as `map()`, but `function(item)` returns an iterable of items, i.e. `page_products()`.
+        """
+        return self.__add(function, workers, processes, True, name, queue_size)
+
+    def __fail(self, error: BaseException) -> None:
+        with self.__lock:
+            if self.__error is None:
+                self.__error = error
+        self.__stop.set()
+
+    def __put(self, box: queue.Queue, item) -> float or None:
+        """
+        Waits for room in the queue unless the pipeline is stopped.
+        :return: Seconds blocked, or None if the pipeline is stopped.
+        """
+        started = time.monotonic()
+        while not self.__stop.is_set():
+            try:
+                box.put(item, timeout=0.1)
+                return time.monotonic() - started
+            except queue.Full:
+                pass
+        return None
+
+    def __get(self, box: queue.Queue):
+        while not self.__stop.is_set():
+            try:
+                return box.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _STOPPED
+
+    def __produce(self, outbox: queue.Queue) -> None:
+        iterator = iter(self.source)
+        try:
+            for item in iterator:
+                blocked = self.__put(outbox, item)
+                if blocked is None:
+                    return
+                self.__source_blocked += blocked
+            self.__put(outbox, _DONE)
+        except BaseException as error:
+            self.__fail(error)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def __work(self, stage: _Stage, inbox: queue.Queue, outbox: queue.Queue, executor) -> None:
+        try:
+            while True:
+                item = self.__get(inbox)
+                if item is _STOPPED:
+                    return
+                if item is _DONE:
+                    inbox.put(_DONE)  # for the other workers of the stage; the upstream is done, so there is room
+                    break
+
+                started = time.monotonic()
+                if executor is None:
+                    result = stage.function(item)
+                else:
+                    result = executor.submit(stage.function, item).result()
+                if stage.flat:
+                    result = list(result)
+                busy = time.monotonic() - started
+
+                blocked = 0.0
+                for output in (result if stage.flat else [result]):
+                    if output is None:
+                        continue
+                    waited = self.__put(outbox, output)
+                    if waited is None:
+                        return
+                    blocked += waited
+                with self.__lock:
+                    stage.items += 1
+                    stage.busy += busy
+                    stage.blocked += blocked
+        except BaseException as error:
+            self.__fail(error)
+            return
+
+        with self.__lock:
+            stage.running -= 1
+            last = stage.running == 0
+        if last:
+            self.__put(outbox, _DONE)
+
+    def __iter__(self):
+        """
+        Starts the pipeline.
+        :return: Generator of the items of the last stage. The pipeline is stopped when the generator is closed.
+        """
+        if self.__started:
+            raise RuntimeError('A pipeline can be run only once')
+        self.__started = True
+
+        boxes = [queue.Queue(maxsize=self.queue_size)]
+        threads = [threading.Thread(target=self.__produce, args=(boxes[0],), daemon=True)]
+        executors = []
+        for stage in self.__stages:
+            boxes.append(queue.Queue(maxsize=stage.queue_size))
+            executor = ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None
+            if executor is not None:
+                executors.append(executor)
+            threads += [threading.Thread(target=self.__work, args=(stage, boxes[-2], boxes[-1], executor),
+                                         daemon=True) for _ in range(stage.workers)]
+
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self.__get(boxes[-1])
+                if item is _DONE or item is _STOPPED:
+                    break
+                yield item
+        finally:
+            self.__stop.set()
+            for thread in threads:
+                thread.join()
+            for executor in executors:
+                executor.shutdown(cancel_futures=True)
+        if self.__error is not None:
+            raise self.__error
+
+    def run(self, sink=None) -> int:
+        """
+        Runs the pipeline to the end.
+        :param sink: Function receiving the items of the last stage, i.e. `JsonLinesWriter.write`. None - the items
+        are discarded.
+        :return: Number of items of the last stage.
+        """
+        count = 0
+        for item in self:
+            if sink is not None:
+                sink(item)
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        """
+        Statistics to find the slowest stage: the one busy most of the time while the stages before it are blocked.
+        :return: {'source': {'blocked_seconds': ...},
+                  stage name: {'items': processed items, 'busy_seconds': time in the function (summed over the
+                               workers), 'blocked_seconds': time waiting for room in the next queue}}
+        """
+        with self.__lock:
+            stats = {'source': {'blocked_seconds': self.__source_blocked}}
+            for stage in self.__stages:
+                stats[stage.name] = {'items': stage.items, 'busy_seconds': stage.busy,
+                                     'blocked_seconds': stage.blocked}
+            return stats
@@ -0,0 +1,258 @@
+import math
+import time
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import QuerySpec
+from .filter import format_date
+from .metrics import MetricsSink
+from .tracing import filter_hash
+
+_WORLD = ''  # cell of the daily totals
+
+
+def _days(start: date, end: date) -> [date]:
+    return [start + timedelta(days=i) for i in range((end - start).days)]
+
+
+def _as_date(value: date or datetime) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+class CountHistogram:
+    """
+    Local statistics for query planning: the number of products per collection and day (and optionally per cell of a
+    coarse longitude/latitude grid), counted with `$count=True&$top=0` requests and kept in an SQLite database. Only
+    the buckets not counted yet, or counted before their day settled (`settle` seconds after its end, while products
+    are still being published) and more than `ttl` seconds ago, are requested by `refresh()`.
+
+    Example usage:
+        client = Client()
+        histogram = CountHistogram(client, 'counts.sqlite')
+        histogram.refresh(['SENTINEL-1', 'SENTINEL-2'], date(2023, 1, 1), date(2024, 1, 1))
+
+        # windows of at most 10000 products, i.e. to be harvested by `Harvester(..., plan=windows)`
+        windows = histogram.plan(['SENTINEL-1', 'SENTINEL-2'], date(2023, 1, 1), date(2024, 1, 1), max_count=10000)
+
+    Every bucket is a request: a collection and day take one request for the total, plus one per cell of the grid,
+    (360 / cell_size) * (180 / cell_size) of them (64800 at 1 degree, 648 at 10). `refresh()` refuses to send more
+    than `max_requests` at once.
+
+    Class attributes:
+        fltr - filter body joined with every count with `and`, i.e. to count a product type only. The statistics of
+               different filters are kept apart in the same database
+        cell_size - size of the grid cells in degrees. None - daily totals only
+        max_requests - maximum number of requests of a `refresh()`, None - no limit
+        settle - seconds after the end of a day from which its counts are final
+        ttl - seconds for which the counts of an unsettled day are not requested again
+        max_workers - maximum number of concurrent requests
+        metrics - `MetricsSink` receiving the hits and misses of the buckets
+    """
+
+    def __init__(self, client, path: str = ':memory:', fltr=None, cell_size: float or None = None,
+                 settle: float = 3 * 24 * 60 * 60, ttl: float = 60 * 60, max_workers: int = 4,
+                 metrics: MetricsSink or None = None, max_requests: int or None = 10000):
+        """
+        :param client: `Client` instance, used to send the count requests.
+        :param path: Path of the database file. ':memory:' - the histogram is not persistent.
+        :param fltr: `Filter`, its body or None. See the class attributes.
+        :param cell_size: See the class attributes.
+        :param settle: See the class attributes.
+        :param ttl: See the class attributes.
+        :param max_workers: See the class attributes.
+        :param metrics: See the class attributes.
+        :param max_requests: See the class attributes.
+        """
+        if cell_size is not None and not (0 < cell_size <= 180 and 180 % cell_size == 0):
+            raise ValueError('`cell_size` must divide 180 degrees')
+
+        self.client = client
+        self.path = path
+        self.fltr = getattr(fltr, 'body', fltr) or None
+        self.cell_size = cell_size
+        self.settle = settle
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.metrics = MetricsSink() if metrics is None else metrics
+        self.max_requests = max_requests
+        self.__key = filter_hash(self.fltr)
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS counts (filter TEXT, collection TEXT, day TEXT, '
+                                  'cell TEXT, count INTEGER, counted_at REAL, '
+                                  'PRIMARY KEY (filter, collection, day, cell))')
+
+    def cells(self) -> [str]:
+        """
+        :return: Cells of the grid as 'column,row' (from -180 degrees of longitude and -90 of latitude), and the
+        daily total ''.
+        """
+        if self.cell_size is None:
+            return [_WORLD]
+        columns = int(360 / self.cell_size)
+        rows = int(180 / self.cell_size)
+        return [_WORLD] + [f'{column},{row}' for column in range(columns) for row in range(rows)]
+
+    def cell_polygon(self, cell: str) -> str:
+        """
+        :return: WKT polygon of a cell.
+        """
+        column, row = map(int, cell.split(','))
+        x0 = -180 + column * self.cell_size
+        y0 = -90 + row * self.cell_size
+        x1, y1 = x0 + self.cell_size, y0 + self.cell_size
+        return f'POLYGON(({x0} {y0}, {x1} {y0}, {x1} {y1}, {x0} {y1}, {x0} {y0}))'
+
+    def spec(self, collection: str, day: date, cell: str = _WORLD) -> QuerySpec:
+        """
+        :return: `QuerySpec` counting the products of a bucket.
+        """
+        start = datetime.combine(day, datetime.min.time())
+        body = (f"Collection/Name eq '{collection}' and ContentDate/Start ge {format_date(start)} and "
+                f"ContentDate/Start lt {format_date(start + timedelta(days=1))}")
+        if cell != _WORLD:
+            body = f"{body} and OData.CSC.Intersects(area=geography'SRID=4326;{self.cell_polygon(cell)}')"
+        if self.fltr is not None:
+            body = f'{body} and ({self.fltr})'
+        return QuerySpec(filter=body, top='0', count='True')
+
+    def __stale(self, collections: [str], days: [date]) -> [(str, date, str)]:
+        """
+        :return: Buckets to be requested: [(collection, day, cell)].
+        """
+        now = time.time()
+        counted = {}
+        with self.__lock:
+            rows = self.__connection.execute('SELECT collection, day, cell, counted_at FROM counts WHERE filter = ? '
+                                             'AND day >= ? AND day <= ?',
+                                             (self.__key, days[0].isoformat(), days[-1].isoformat()))
+            for collection, day, cell, counted_at in rows:
+                counted[(collection, day, cell)] = counted_at
+
+        stale = []
+        for collection in collections:
+            for day in days:
+                end = datetime.combine(day + timedelta(days=1), datetime.min.time(), timezone.utc)
+                settled = end.timestamp() + self.settle
+                for cell in self.cells():
+                    counted_at = counted.get((collection, day.isoformat(), cell))
+                    if counted_at is None or (counted_at < settled and now - counted_at > self.ttl):
+                        stale.append((collection, day, cell))
+        return stale
+
+    def __count(self, bucket: (str, date, str)) -> None:
+        collection, day, cell = bucket
+        response = self.client.execute(self.spec(collection, day, cell))
+        with self.__lock:
+            self.__connection.execute('INSERT OR REPLACE INTO counts VALUES (?, ?, ?, ?, ?, ?)',
+                                      (self.__key, collection, day.isoformat(), cell, response['@odata.count'],
+                                       time.time()))
+
+    def refresh(self, collections: [str], start: date, end: date) -> int:
+        """
+        Counts the buckets of the period that are missing or stale.
+        :param collections: Collection names.
+        :param start: First day.
+        :param end: Day after the last one.
+        :return: Number of sent requests.
+        :raise ValueError: If more than `max_requests` buckets are to be counted, before sending any request.
+        """
+        days = _days(_as_date(start), _as_date(end))
+        if not days:
+            return 0
+        stale = self.__stale(collections, days)
+        if self.max_requests is not None and len(stale) > self.max_requests:
+            raise ValueError(f'{len(stale)} count requests are needed, more than `max_requests` '
+                             f'({self.max_requests}). Refresh a shorter period or use larger cells')
+        total = len(collections) * len(days) * len(self.cells())
+        self.metrics.increment('copernicus_cache_hits_total', total - len(stale), cache='histogram')
+        self.metrics.increment('copernicus_cache_misses_total', len(stale), cache='histogram')
+
+        if len(stale) == 1:
+            self.__count(stale[0])
+        elif stale:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(self.__count, stale))
+        return len(stale)
+
+    def histogram(self, collection: str, start: date, end: date, cell: str = _WORLD) -> {date: int}:
+        """
+        :param collection: Collection name.
+        :param start: First day.
+        :param end: Day after the last one.
+        :param cell: Cell of the grid (see `cells()`). '' - the daily totals.
+        :return: {day: number of products} of the counted days.
+        """
+        with self.__lock:
+            rows = self.__connection.execute('SELECT day, count FROM counts WHERE filter = ? AND collection = ? '
+                                             'AND cell = ? AND day >= ? AND day < ? ORDER BY day',
+                                             (self.__key, collection, cell, _as_date(start).isoformat(),
+                                              _as_date(end).isoformat())).fetchall()
+        return {date.fromisoformat(day): count for day, count in rows}
+
+    def grid(self, collection: str, day: date) -> {str: int}:
+        """
+        :return: {cell: number of products} of a day, without the empty cells. A product intersecting several cells
+        is counted in each.
+        """
+        with self.__lock:
+            rows = self.__connection.execute('SELECT cell, count FROM counts WHERE filter = ? AND collection = ? '
+                                             "AND day = ? AND cell != '' AND count > 0",
+                                             (self.__key, collection, _as_date(day).isoformat())).fetchall()
+        return dict(rows)
+
+    def count(self, collection: str, start: date, end: date) -> int:
+        """
+        :return: Number of products of a collection in the period, from the counted days.
+        """
+        return sum(self.histogram(collection, start, end).values())
+
+    def plan(self, collections: [str], start: date, end: date, max_count: int) -> [(str, datetime, datetime)]:
+        """
+        Partitions the period into windows of at most `max_count` products (as counted), without any request:
+        consecutive days are merged while their products fit, and a day with more products is split into equal parts.
+        Days not counted yet are assumed empty, call `refresh()` first.
+        :param collections: Collection names.
+        :param start: First day.
+        :param end: Day after the last one.
+        :param max_count: Maximum number of products per window.
+        :return: Windows [(collection, start, end)], the end is exclusive.
+        """
+        windows = []
+        for collection in collections:
+            counts = self.histogram(collection, start, end)
+            window_start = None
+            window_count = 0
+            for day in _days(_as_date(start), _as_date(end)):
+                day_start = datetime.combine(day, datetime.min.time())
+                count = counts.get(day, 0)
+                if window_start is not None and window_count + count > max_count:
+                    windows.append((collection, window_start, day_start))
+                    window_start = None
+                if count > max_count:
+                    parts = math.ceil(count / max_count)
+                    windows += [(collection, day_start + timedelta(days=1) * i / parts,
+                                 day_start + timedelta(days=1) * (i + 1) / parts) for i in range(parts)]
+                    continue
+                if window_start is None:
+                    window_start, window_count = day_start, 0
+                window_count += count
+            if window_start is not None:
+                windows.append((collection, window_start,
+                                datetime.combine(_as_date(end), datetime.min.time())))
+        return windows
+
+    def forget(self) -> None:
+        """
+        Removes the counts of the filter.
+        """
+        with self.__lock:
+            self.__connection.execute('DELETE FROM counts WHERE filter = ?', (self.__key,))
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
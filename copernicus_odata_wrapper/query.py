@@ -1,10 +1,13 @@
 import inspect
-import requests
 
 
 from .filter import Filter
-from .errors import check_response_for_errors
 from .config import config
+from .client import Client, QuerySpec
+from .deadline import Deadline
+
+PRODUCT_FIELDS = ['Id', 'Name', 'ContentType', 'ContentLength', 'OriginDate', 'PublicationDate', 'ModificationDate',
+                  'Online', 'EvictionDate', 'S3Path', 'Checksum', 'ContentDate', 'Footprint', 'GeoFootprint']
 
 # noinspection PyMethodMayBeStatic
 class Query:
@@ -14,12 +17,38 @@ class Query:
 
     This class does not include `DeletedProducts` functionality.
 
+    A `Query` instance holds the options of a single request and should not be shared between threads. To search
+    from many threads, share one `Client` instead: either pass it to every `Query(client)`, or execute
+    `query.spec()` with it directly. Unless `client` is set, the query builds its own client and reuses it for all
+    its calls; `close()` it (or use the query as a context manager) to release its sessions and thread pools.
+
     Class attrubutes:
-        session - `requests.Session` i.e. to handle proxy
+        client - `Client` to send requests with. If it is set, the other attributes below are ignored
+        session - `requests.Session` i.e. to handle proxy, or another transport with the same `get()` and `post()`
+                  methods, i.e. to record and replay requests (see `transport.py`)
         timeout - a paramater of the `session.get()` or `session.post()`
+        single_flight - `SingleFlight` instance shared between queries, so concurrent identical requests are sent
+                        only once (disabled if None)
+        nodes_cache - `NodesCache` instance to cache Nodes listings (disabled if None)
+        deadline - time budget in seconds of each call (`send()`, `by_names()`, a whole `pages()` iteration, etc.),
+                   `DeadlineExceeded` is raised when it runs out (disabled if None)
+        hedging - `Hedging` policy, shared between queries, to send duplicates of slow requests (disabled if None)
+        breakers - `CircuitBreakers`, shared between queries, to fail fast with `CircuitOpen` while an endpoint is
+                   unhealthy (disabled if None)
+        mirrors - `Mirrors` to route requests to the fastest healthy of equivalent endpoints (disabled if None)
+        metrics - `MetricsSink` receiving timings and counters of every request, i.e. `MetricsRegistry`
+                  (disabled if None)
+        tracer - `Tracer` creating spans of the calls and their HTTP requests (disabled if None)
+        slow_log - `SlowQueryLog` of the requests slower than its threshold (disabled if None)
+        url_limit - maximum length of the encoded search url, longer searches are split into several requests and
+                    their results merged (never split if None)
+        scheduler - `RequestScheduler` shared between queries, admitting every request by its priority class
+                    (disabled if None)
+        priority - name of the priority class of the requests, i.e. 'interactive' or 'batch' (None - the default
+                   class of the scheduler)
     """
 
-    def __init__(self):
+    def __init__(self, client: Client or None = None):
         self.endpoint = config['endpoint']
         self.endpoint_zipper = config['endpoint_zipper']
 
@@ -30,34 +59,91 @@ class Query:
                           'skip': None,
                           'count': None,
                           'expand': None,
+                          'select': None,
                           }
         self.__options_defaults = self.__options.copy()
 
         # requests parameters
+        self.client = client
         self.session = None
         self.timeout = (30, 30)
         self.post_body = None
+        self.single_flight = None
+        self.nodes_cache = None
+        self.deadline = None
+        self.hedging = None
+        self.breakers = None
+        self.mirrors = None
+        self.metrics = None
+        self.tracer = None
+        self.slow_log = None
+        self.url_limit = config['url_limit']
+        self.scheduler = None
+        self.priority = None
+        self.__own_client = None
+        self.__own_settings = None
 
     def __merge_options(self) -> str:
         """Formats and merges options into a single line string with endpoint.
         :return: Request ready to be sent.
         """
-        formatted_options = []
-        for option, value in self.__options.items():
-            if value is not None:
+        return self.spec().url(self.endpoint)
 
-                if option == 'filter' and isinstance(value, Filter):
-                    if value.body is None:
-                        continue
-                    formatted_option = f'${option}={value.body}'
+    def __client(self) -> Client:
+        """
+        :return: The shared `client` if it is set, otherwise the client of this query. It is built on first use from
+        the attributes of this query and rebuilt (the previous one closed) only when one of them changes.
+        """
+        if self.client is not None:
+            return self.client
+
+        settings = (self.session, self.timeout, self.single_flight, self.nodes_cache, self.hedging, self.breakers,
+                    self.mirrors, self.metrics, self.tracer, self.slow_log, self.scheduler)
+        if self.__own_client is None or any(new is not old for new, old in zip(settings, self.__own_settings)):
+            self.close()
+            self.__own_client = Client(session=self.session, timeout=self.timeout, single_flight=self.single_flight,
+                                       nodes_cache=self.nodes_cache, hedging=self.hedging, breakers=self.breakers,
+                                       mirrors=self.mirrors, metrics=self.metrics, tracer=self.tracer,
+                                       slow_log=self.slow_log, scheduler=self.scheduler)
+            self.__own_settings = settings
+
+        client = self.__own_client
+        client.endpoint = self.endpoint
+        client.endpoint_zipper = self.endpoint_zipper
+        client.url_limit = self.url_limit
+        return client
+
+    def close(self) -> None:
+        """
+        Closes the client built by this query (its sessions and thread pools). A `client` set by the user is left
+        open. The query can still be used afterwards, a new client is built when needed.
+        :return: None
+        """
+        client, self.__own_client = self.__own_client, None
+        if client is not None:
+            client.close()
+
+    def __enter__(self):
+        return self
 
-                else:
-                    formatted_option = f'${option}={value}'
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-                formatted_options.append(formatted_option)
+    def __deadline(self) -> Deadline or None:
+        """
+        :return: A new `Deadline` of `deadline` seconds, or None if it is not set.
+        """
+        if self.deadline is None:
+            return None
+        return Deadline(self.deadline)
 
-        merged = f'{self.endpoint}?' + '&'.join(formatted_options)
-        return merged
+    def spec(self) -> QuerySpec:
+        """
+        Freezes the current options into an immutable `QuerySpec`, which can be executed by a shared `Client`
+        from any thread.
+        :return: QuerySpec
+        """
+        return QuerySpec.from_options(self.__options)
 
     def set_filter(self, fltr: Filter) -> None:
         """
@@ -214,6 +300,35 @@ class Query:
             else:  # both False, or False/None
                 pass
 
+    def set_select(self, fields: [str] or None = None) -> None:
+        """
+        Select option limits the returned products to the listed fields. Use it to skip the heavy `Footprint` and
+        `GeoFootprint` fields when they are not needed. Expanded `Attributes`/`Assets` are returned regardless.
+
+        Example usage:
+            query = Query()
+            query.set_select(['Id', 'Name', 'ContentDate'])
+
+        An equivalent of:
+            $select=Id,Name,ContentDate
+
+        :param fields: Any of: 'Id', 'Name', 'ContentType', 'ContentLength', 'OriginDate', 'PublicationDate',
+        'ModificationDate', 'Online', 'EvictionDate', 'S3Path', 'Checksum', 'ContentDate', 'Footprint',
+        'GeoFootprint'. None - all fields are returned.
+        :return: None
+        """
+        if fields is None:
+            self.__options['select'] = None
+            return
+
+        if isinstance(fields, str) or not fields:
+            raise ValueError(f'`fields` must be a non-empty list of field names')
+
+        for field in fields:
+            if field not in PRODUCT_FIELDS:
+                raise ValueError(f'Invalid field `{field}`. Possible fields: {PRODUCT_FIELDS}')
+        self.__options['select'] = ','.join(dict.fromkeys(fields))
+
     def clear(self) -> None:
         self.__options = self.__options_defaults.copy()
 
@@ -222,15 +337,52 @@ class Query:
         Sends the query after it has been configured.
         :return: Response as a dictionary.
         """
-        session = self.session
-        if self.session is None:
-            session = requests.Session()
+        return self.__client().execute(self.spec(), deadline=self.__deadline(), priority=self.priority)
 
-        url = self.__merge_options()
-        response = session.get(url, timeout=self.timeout)
-        if check_response_for_errors(response) is None:
-            dictionary = response.json()
-            return dictionary
+    def pages(self, max_pages: int or None = None):
+        """
+        Sends the query and follows '@odata.nextLink' of the responses.
+
+        Example usage:
+            query = Query()
+            query.set_filter(f)
+            query.set_top(1000)
+            for page in query.pages():
+                print(len(page['value']))
+
+        :param max_pages: Maximum number of pages to be requested. None - no limit.
+        :return: Generator of responses (dictionaries).
+        """
+        return self.__client().pages(self.spec(), max_pages=max_pages, deadline=self.__deadline(),
+                                     priority=self.priority)
+
+    def products(self, max_pages: int or None = None):
+        """
+        Same as `pages()`, but yields products one by one.
+        :param max_pages: Maximum number of pages to be requested. None - no limit.
+        :return: Generator of products (dictionaries).
+        """
+        for page in self.pages(max_pages=max_pages):
+            yield from page['value']
+
+    def fan_out(self, collections: [str], queue_size: int = 2):
+        """
+        Runs the query in each of the collections concurrently (the filter is joined with `Collection/Name eq ...`)
+        and merges the paginated results into a single stream, ordered by the `set_orderby()` option.
+
+        Example usage:
+            query = Query()
+            query.set_filter(f)
+            query.set_orderby('ContentDate/Start', ascending=True)
+            for product in query.fan_out(['SENTINEL-1', 'SENTINEL-2', 'SENTINEL-3']):
+                print(product['Name'])
+
+        :param collections: Collection names.
+        :param queue_size: Maximum number of pages buffered per collection.
+        :return: Generator of products.
+        """
+        return self.__client().fan_out(self.spec(), collections, queue_size=queue_size,
+                                       deadline=self.__deadline(), priority=self.priority)
 
     def by_names(self, names: [str]) -> dict:
         # This method is different from the methods specified in `filter.py`, so it is derived from the `Filter` class.
@@ -240,16 +392,7 @@ class Query:
         :param names: The list of product names to be searched by.
         :return:
         """
-        session = self.session
-        if self.session is None:
-            session = requests.Session()
-
-        url = f'{self.endpoint}/OData.CSC.FilterList'
-        search_list = [{'Name': name} for name in names]
-        response = session.post(url, timeout=self.timeout, json={"FilterProducts": search_list})
-        if check_response_for_errors(response) is None:
-            dictionary = response.json()
-            return dictionary
+        return self.__client().by_names(names, deadline=self.__deadline(), priority=self.priority)
 
     def quicklook(self):
         """
@@ -284,6 +427,8 @@ class Query:
             aux_nodes_uri = aux_data['result'][0]['Nodes']['uri']
             print(f'\naux_nodes_uri={aux_nodes_uri}')
 
+        Use `walk_nodes()` to list the whole tree at once.
+
         An equivalent of:
             https://zipper.dataspace.copernicus.eu/odata/v1/Products(db0c8ef3-8ec0-5185-a537-812dad3c58f8)/Nodes
             https://zipper.dataspace.copernicus.eu/odata/v1/Products(db0c8ef3-8ec0-5185-a537-812dad3c58f8)/Nodes(S2A_MSIL1C_20180927T051221_N0206_R033_T42FXL_20180927T073143.SAFE)/Nodes
@@ -295,23 +440,30 @@ class Query:
         :param uuid: uuid or url pointing exact product or url pointing product nodes.
         :return:
         """
+        return self.__client().product_nodes(uuid, deadline=self.__deadline(), priority=self.priority)
 
-        session = self.session
-        if self.session is None:
-            session = requests.Session()
+    def walk_nodes(self, uuid: str, max_depth: int or None = None, include: str or [str] or None = None,
+                   prune: str or [str] or None = None, max_workers: int = 8):
+        """
+        Lists the whole product content by crawling its Nodes tree breadth-first, with up to `max_workers`
+        concurrent requests. Nodes are yielded as soon as they are discovered.
 
-        if self.endpoint in uuid or self.endpoint_zipper in uuid:
-            if uuid.endswith(r'/Nodes'):
-                url = f'{uuid}'
-            else:
-                url = f'{uuid}/Nodes'
-        else:
-            url = f'{self.endpoint}({uuid})/Nodes'
+        Example usage:
+            query = Query()
+            for path, node in query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8', max_depth=4,
+                                               include='*.jp2', prune='HTML'):
+                print(path)
 
-        response = session.get(url, timeout=self.timeout)
-        if check_response_for_errors(response) is None:
-            dictionary = response.json()
-            return dictionary
+        :param uuid: uuid or url pointing exact product or url pointing product nodes.
+        :param max_depth: Maximum depth of yielded nodes (1 - only the nodes of the first listing). None - no limit.
+        :param include: Name pattern(s) (`fnmatch` style) of the nodes to be yielded. None - all nodes are yielded.
+        :param prune: Name pattern(s) (`fnmatch` style) of the nodes to be skipped together with their contents.
+        :param max_workers: Maximum number of concurrent requests.
+        :return: Generator of (path, node) tuples, where `path` is a '/' separated path of the node names.
+        """
+        return self.__client().walk_nodes(uuid, max_depth=max_depth, include=include, prune=prune,
+                                          max_workers=max_workers, deadline=self.__deadline(),
+                                          priority=self.priority)
 
     def product_download(self):
         """
@@ -0,0 +1,158 @@
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import Client
+from .errors import ProductNotFoundInCatalogue
+from .metrics import MetricsSink
+
+
+class NameResolver:
+    """
+    Maps product names to their `Id` and `S3Path`. Resolved names are kept in a persistent index (an SQLite database),
+    names missing from the catalogue are remembered for `negative_ttl` seconds. Only the names found in neither are
+    requested, in chunks of `chunk_size` names per `OData.CSC.FilterList` POST request.
+
+    Example usage:
+        resolver = NameResolver(Client(), 'names.sqlite')
+        resolved = resolver.resolve(['S1A_IW_GRDH_1SDV_20141031T161924_20141031T161949_003076_003856_634E.SAFE',
+                                     'S2A_MSIL1C_20230702T064631_N0509_R020_T42VWN_20230702T073123.SAFE'])
+
+    Returns:
+        {'S1A_IW_GRDH_1SDV_20141031T161924_20141031T161949_003076_003856_634E.SAFE':
+            {'Id': 'c23d5ffd-bc2a-54c1-a2cf-e2dc18bc945f',
+             'S3Path': '/eodata/Sentinel-1/SAR/GRD/2014/10/31/S1A_IW_GRDH_1SDV_20141031T161924_...SAFE'},
+         'S2A_MSIL1C_20230702T064631_N0509_R020_T42VWN_20230702T073123.SAFE': None}  # not found
+
+    Class attributes:
+        negative_ttl - seconds for which a missing name is not requested again
+        chunk_size - maximum number of names per request
+        max_workers - maximum number of concurrent requests (requests through a `Query` are sent one by one, a
+                      query is not shared between threads)
+        metrics - `MetricsSink` receiving the index hits and misses
+    """
+
+    def __init__(self, client: Client, path: str = ':memory:', negative_ttl: float = 24 * 60 * 60, chunk_size: int = 100,
+                 max_workers: int = 4, metrics: MetricsSink or None = None):
+        """
+        :param client: `Client` instance, used to send `by_names()` requests from several threads. A `Query` is
+        accepted too, its requests are sent one after another.
+        :param path: Path of the database file. ':memory:' - the index is not persistent.
+        :param negative_ttl: See the class attributes.
+        :param chunk_size: See the class attributes.
+        :param max_workers: See the class attributes.
+        :param metrics: See the class attributes.
+        """
+        self.client = client
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.metrics = MetricsSink() if metrics is None else metrics
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, id TEXT, s3path TEXT)')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS missing (name TEXT PRIMARY KEY, checked_at REAL)')
+
+    def __lookup(self, names: [str]) -> (dict, set):
+        """
+        :param names: Unique product names.
+        :return: ({name: {'Id': ..., 'S3Path': ...}} of the indexed names, {names cached as missing})
+        """
+        found = {}
+        missing = set()
+        expired_before = time.time() - self.negative_ttl
+        step = 500  # SQLite limits the number of query parameters
+
+        with self.__lock:
+            for i in range(0, len(names), step):
+                chunk = names[i:i + step]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.__connection.execute(f'SELECT name, id, s3path FROM names WHERE name IN ({placeholders})',
+                                                 chunk)
+                for name, product_id, s3path in rows:
+                    found[name] = {'Id': product_id, 'S3Path': s3path}
+
+                rows = self.__connection.execute(f'SELECT name FROM missing WHERE name IN ({placeholders}) '
+                                                 f'AND checked_at > ?', chunk + [expired_before])
+                missing.update(name for name, in rows)
+        return found, missing
+
+    def __request(self, names: [str]) -> dict:
+        """
+        Requests a chunk of names and stores the results.
+        :param names: Product names.
+        :return: {name: {'Id': ..., 'S3Path': ...}} of the found names.
+        """
+        try:
+            response = self.client.by_names(names)
+            products = response['value']
+        except ProductNotFoundInCatalogue:
+            products = []
+
+        requested = set(names)
+        found = {product['Name']: {'Id': product['Id'], 'S3Path': product['S3Path']}
+                 for product in products if product['Name'] in requested}
+        now = time.time()
+
+        with self.__lock:
+            self.__connection.execute('BEGIN')
+            self.__connection.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?)',
+                                          [(name, value['Id'], value['S3Path']) for name, value in found.items()])
+            self.__connection.executemany('DELETE FROM missing WHERE name = ?', [(name,) for name in found])
+            self.__connection.executemany('INSERT OR REPLACE INTO missing VALUES (?, ?)',
+                                          [(name, now) for name in names if name not in found])
+            self.__connection.execute('COMMIT')
+        return found
+
+    def resolve(self, names: [str]) -> dict:
+        """
+        Resolves product names. The names MUST end with '.SAFE' (or '.SEN3', etc.), see `Query.by_names()`.
+        :param names: Product names.
+        :return: {name: {'Id': ..., 'S3Path': ...} or None if the product is not found}
+        """
+        unique = list(dict.fromkeys(names))
+        found, missing = self.__lookup(unique)
+
+        misses = [name for name in unique if name not in found and name not in missing]
+        self.metrics.increment('copernicus_cache_hits_total', len(unique) - len(misses), cache='resolver')
+        self.metrics.increment('copernicus_cache_misses_total', len(misses), cache='resolver')
+        chunks = [misses[i:i + self.chunk_size] for i in range(0, len(misses), self.chunk_size)]
+
+        if len(chunks) == 1 or not isinstance(self.client, Client):
+            for chunk in chunks:
+                found.update(self.__request(chunk))
+        elif chunks:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for result in executor.map(self.__request, chunks):
+                    found.update(result)
+
+        return {name: found.get(name) for name in unique}
+
+    def resolve_one(self, name: str) -> dict or None:
+        """
+        :param name: Product name.
+        :return: {'Id': ..., 'S3Path': ...} or None if the product is not found.
+        """
+        return self.resolve([name])[name]
+
+    def forget(self, names: [str] or None = None) -> None:
+        """
+        Removes names from the index and the negative cache.
+        :param names: Product names. None - removes everything.
+        :return: None
+        """
+        with self.__lock:
+            if names is None:
+                self.__connection.execute('DELETE FROM names')
+                self.__connection.execute('DELETE FROM missing')
+            else:
+                self.__connection.executemany('DELETE FROM names WHERE name = ?', [(name,) for name in names])
+                self.__connection.executemany('DELETE FROM missing WHERE name = ?', [(name,) for name in names])
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
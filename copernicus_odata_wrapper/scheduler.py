@@ -0,0 +1,184 @@
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+from .errors import DeadlineExceeded
+from .metrics import MetricsSink
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+class PriorityClass:
+    """
+    Class of requests sharing a scheduler.
+
+    Class attributes:
+        name - name of the class, i.e. 'interactive'
+        weight - share of the capacity while other classes are waiting too, relative to the weights of the others
+        max_concurrency - maximum number of requests of the class sent at once. None - up to the scheduler capacity
+    """
+
+    def __init__(self, name: str, weight: float = 1.0, max_concurrency: int or None = None):
+        if weight <= 0:
+            raise ValueError('`weight` must be positive')
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self.last_tag = 0.0  # virtual finish time of the last queued request
+
+
+class RequestScheduler:
+    """
+    Central admission of the HTTP requests of any number of clients (and threads), for workloads sharing a quota. At
+    most `max_concurrency` requests are sent at once; waiting requests are admitted by weighted fair queuing: every
+    request gets a virtual finish tag advancing by 1 / weight of its class, and the waiting request with the lowest
+    tag whose class is under its own cap goes first. While both classes below are busy, interactive requests get 8
+    of every 9 slots; batch requests use all of the capacity the interactive ones leave unused.
+
+    Example usage:
+        scheduler = RequestScheduler(max_concurrency=4)
+
+        interactive = Query()
+        interactive.scheduler = scheduler
+        interactive.priority = INTERACTIVE
+
+        harvest = Query()
+        harvest.scheduler = scheduler
+        harvest.priority = BATCH
+
+    Reported metrics (see `MetricsSink`):
+        copernicus_scheduler_queue_seconds{priority} - histogram of the time spent waiting for a slot
+        copernicus_scheduler_requests_total{priority} - counter of the admitted requests
+
+    Class attributes:
+        max_concurrency - maximum number of requests sent at once
+        default - name of the class of requests without a priority
+        metrics - `MetricsSink` receiving the queue times
+    """
+
+    def __init__(self, max_concurrency: int = 8, classes: [PriorityClass] or None = None,
+                 default: str = INTERACTIVE, metrics: MetricsSink or None = None):
+        """
+        :param max_concurrency: See the class attributes.
+        :param classes: Priority classes. None - 'interactive' of weight 8 and 'batch' of weight 1.
+        :param default: See the class attributes.
+        :param metrics: See the class attributes.
+        """
+        if classes is None:
+            classes = [PriorityClass(INTERACTIVE, weight=8), PriorityClass(BATCH, weight=1)]
+        self.max_concurrency = max_concurrency
+        self.classes = {priority_class.name: priority_class for priority_class in classes}
+        if default not in self.classes:
+            raise ValueError(f'Unknown default class: {default}')
+        self.default = default
+        self.metrics = MetricsSink() if metrics is None else metrics
+
+        self.__condition = threading.Condition()
+        self.__running = 0
+        self.__virtual_time = 0.0
+        self.__sequence = itertools.count()
+        self.__waiting = {}  # ticket: class
+        self.__queue_seconds = {name: 0.0 for name in self.classes}
+        self.__admitted = {name: 0 for name in self.classes}
+
+    def __class(self, priority: str or None) -> PriorityClass:
+        priority_class = self.classes.get(self.default if priority is None else priority)
+        if priority_class is None:
+            raise ValueError(f'Unknown priority class: {priority}')
+        return priority_class
+
+    def __next(self) -> tuple or None:
+        """
+        :return: Ticket of the waiting request to be admitted next, or None if none can be admitted now.
+        """
+        if self.__running >= self.max_concurrency:
+            return None
+        eligible = [ticket for ticket, priority_class in self.__waiting.items()
+                    if priority_class.max_concurrency is None
+                    or priority_class.running < priority_class.max_concurrency]
+        return min(eligible, default=None)
+
+    def acquire(self, priority: str or None = None, timeout: float or None = None) -> float:
+        """
+        Waits for a slot.
+        :param priority: Name of the class. None - the default class.
+        :param timeout: Maximum seconds to wait. None - no limit.
+        :return: Seconds spent waiting.
+        :raise DeadlineExceeded: If no slot is free within `timeout`.
+        """
+        priority_class = self.__class(priority)
+        started = time.monotonic()
+        with self.__condition:
+            tag = max(self.__virtual_time, priority_class.last_tag) + 1 / priority_class.weight
+            priority_class.last_tag = tag
+            ticket = (tag, next(self.__sequence))
+            self.__waiting[ticket] = priority_class
+
+            while self.__next() != ticket:
+                remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                if remaining is not None and remaining <= 0:
+                    del self.__waiting[ticket]
+                    self.__condition.notify_all()
+                    raise DeadlineExceeded(f'No request slot was free within {timeout} s')
+                self.__condition.wait(remaining)
+
+            del self.__waiting[ticket]
+            self.__virtual_time = tag
+            self.__running += 1
+            priority_class.running += 1
+            waited = time.monotonic() - started
+            self.__queue_seconds[priority_class.name] += waited
+            self.__admitted[priority_class.name] += 1
+            self.__condition.notify_all()
+
+        self.metrics.observe('copernicus_scheduler_queue_seconds', waited, priority=priority_class.name)
+        self.metrics.increment('copernicus_scheduler_requests_total', priority=priority_class.name)
+        return waited
+
+    def release(self, priority: str or None = None) -> None:
+        """
+        Frees a slot taken by `acquire()`.
+        :param priority: Name of the class given to `acquire()`.
+        :return: None
+        """
+        priority_class = self.__class(priority)
+        with self.__condition:
+            self.__running -= 1
+            priority_class.running -= 1
+            self.__condition.notify_all()
+
+    @contextmanager
+    def slot(self, priority: str or None = None, deadline=None):
+        """
+        Context manager holding a slot, waiting at most until the `deadline`.
+
+        Example usage:
+            with scheduler.slot(BATCH):
+                session.get(url)
+
+        :param priority: Name of the class. None - the default class.
+        :param deadline: `Deadline` or None.
+        """
+        self.acquire(priority, timeout=None if deadline is None else deadline.remaining())
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def stats(self) -> dict:
+        """
+        :return: {class name: {'running': ..., 'waiting': ..., 'admitted': ..., 'queue_seconds': total seconds
+        waited}}
+        """
+        with self.__condition:
+            waiting = {name: 0 for name in self.classes}
+            for priority_class in self.__waiting.values():
+                waiting[priority_class.name] += 1
+            return {name: {'running': priority_class.running,
+                           'waiting': waiting[name],
+                           'admitted': self.__admitted[name],
+                           'queue_seconds': self.__queue_seconds[name]}
+                    for name, priority_class in self.classes.items()}
@@ -0,0 +1,87 @@
+import json
+import threading
+
+
+class _Call:
+    """A single in-flight call, shared by every caller with the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one. While a call with some key is in flight, every other caller
+    with the same key waits for it and receives its result (or its exception) instead of doing the work again.
+    Nothing is cached: once the call has finished, the next caller with the same key starts a new one.
+
+    Example usage:
+        single_flight = SingleFlight()
+
+        query = Query()
+        query.single_flight = single_flight  # share one instance between all `Query` objects / threads
+        response = query.send()
+
+    Results are shared between callers as they are, so treat them as read-only.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    @staticmethod
+    def key(method: str, url: str, body: dict or list or None = None) -> tuple:
+        """
+        Builds a key of an HTTP request.
+        :param method: 'GET' or 'POST'.
+        :param url: Merged request url.
+        :param body: POST body (JSON serializable).
+        :return: A hashable key.
+        """
+        if body is None:
+            return method, url, None
+        return method, url, json.dumps(body, sort_keys=True)
+
+    def in_flight(self) -> int:
+        """
+        :return: The number of calls currently in flight.
+        """
+        with self.__lock:
+            return len(self.__calls)
+
+    def do(self, key, function, *args, timeout: float or None = None, **kwargs):
+        """
+        Calls `function(*args, **kwargs)` unless a call with the same `key` is already in flight, in which case
+        waits for that call and returns its result.
+        :param key: Any hashable, i.e. `SingleFlight.key(...)`.
+        :param function: A callable to be executed.
+        :param timeout: Maximum number of seconds to wait for a call in flight. `TimeoutError` is raised after.
+        :return: Result of the call.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f'The call in flight has not finished in {timeout} s')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+        return call.result
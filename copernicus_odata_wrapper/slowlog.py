@@ -0,0 +1,136 @@
+import re
+import json
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl
+from requests.utils import requote_uri
+
+from .config import config
+
+_GEOGRAPHY = re.compile(r"geography'([^']*)'")
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?')
+
+
+def explain(fltr, endpoint: str or None = None) -> dict:
+    """
+    Reports the complexity of a filter, i.e. to find out which generated filters are slow on the server before
+    sending them.
+
+    Example usage:
+        f = Filter()
+        f.by_geographic_criteria('POLYGON((69.0 61.0, 70.0 61.0, 70.0 60.0, 69.0 60.0, 69.0 61.0))')
+        f.And()
+        f.by_attribute([Atr.CloudCover() < 10.0, Atr.ProductType() == 'S2MSI2A'])
+        print(f.explain())
+
+    Returns:
+        {'url_length': 482, 'filter_length': 364, 'any_clauses': 2, 'polygons': 1, 'polygon_vertices': 5,
+         'or_operators': 0, 'and_operators': 4}  # including the `and` of every `any(...)` clause
+
+    :param fltr: `Filter`, filter body or None.
+    :param endpoint: Products endpoint, used to measure the encoded url. None - `config['endpoint']`.
+    :return: Dictionary of the metrics:
+        url_length - length of the percent-encoded search url with the filter only
+        filter_length - length of the filter body
+        any_clauses - number of `Attributes/.../any(...)` clauses
+        polygons, polygon_vertices - number of geography literals and their total number of vertices
+        or_operators, and_operators - number of the `or` and `and` operators
+    """
+    body = getattr(fltr, 'body', fltr) or ''
+    endpoint = config['endpoint'] if endpoint is None else endpoint
+
+    geographies = _GEOGRAPHY.findall(body)
+    vertices = sum(len(_NUMBER.findall(geography.split(';')[-1])) // 2 for geography in geographies)
+    outside = _GEOGRAPHY.sub('', body)  # strings may contain anything, geographies are the longest of them
+    words = re.sub(r"'(?:[^']|'')*'", '', outside).split()
+
+    return {'url_length': len(requote_uri(f'{endpoint}?$filter={body}' if body else f'{endpoint}?')),
+            'filter_length': len(body),
+            'any_clauses': outside.count('/any('),
+            'polygons': len(geographies),
+            'polygon_vertices': vertices,
+            'or_operators': words.count('or'),
+            'and_operators': words.count('and')}
+
+
+def explain_url(url: str) -> dict:
+    """
+    Same as `explain()`, but for a request url. The `url_length` is the length of the whole encoded url.
+    :param url: Request url.
+    :return: Dictionary of the metrics.
+    """
+    parts = urlsplit(url)
+    body = ''
+    for name, value in parse_qsl(parts.query, keep_blank_values=True):
+        if name == '$filter':
+            body = value
+    metrics = explain(body)
+    metrics['url_length'] = len(requote_uri(url))
+    return metrics
+
+
+class SlowQueryLog:
+    """
+    Opt-in log of the requests slower than `threshold` seconds, with the complexity metrics of their filters (see
+    `explain()`) and the number of results. The latest `max_entries` are kept in memory; with `path` set, every entry
+    is also appended to the file as a line of JSON.
+
+    Example usage:
+        slow_log = SlowQueryLog(threshold=2.0, path='slow_queries.jsonl')
+
+        query = Query()
+        query.slow_log = slow_log
+        query.send()
+
+        for entry in slow_log.entries():
+            print(entry['latency'], entry['any_clauses'], entry['polygon_vertices'], entry['url'])
+    """
+
+    def __init__(self, threshold: float = 1.0, path: str or None = None, max_entries: int = 1000):
+        """
+        :param threshold: Latency in seconds from which a request is logged.
+        :param path: Path of the JSON lines file to append the entries to. None - the entries are kept in memory only.
+        :param max_entries: Maximum number of entries kept in memory.
+        """
+        self.threshold = threshold
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__entries = deque(maxlen=max_entries)
+
+    def record(self, method: str, url: str, latency: float, results: int or None = None,
+               body: dict or None = None) -> dict or None:
+        """
+        Logs the request if it is slower than the threshold.
+        :param method: 'GET' or 'POST'.
+        :param url: Request url.
+        :param latency: Latency of the request in seconds.
+        :param results: Number of products or nodes in the response.
+        :param body: POST body, i.e. of `by_names()`.
+        :return: The entry, or None if the request is not slow.
+        """
+        if latency < self.threshold:
+            return None
+
+        entry = {'time': time.time(), 'method': method, 'url': url, 'latency': latency, 'results': results}
+        entry.update(explain_url(url))
+        if body is not None:
+            entry['body_length'] = len(json.dumps(body))
+
+        with self.__lock:
+            self.__entries.append(entry)
+            if self.path is not None:
+                with open(self.path, 'a') as file:
+                    file.write(json.dumps(entry) + '\n')
+        return entry
+
+    def entries(self) -> [dict]:
+        """
+        :return: The logged entries, the oldest first.
+        """
+        with self.__lock:
+            return list(self.__entries)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
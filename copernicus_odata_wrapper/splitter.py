@@ -0,0 +1,287 @@
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from requests.utils import requote_uri
+
+from .fanout import _sort_key, _getter
+
+_NAME = re.compile(r"^Name eq '((?:[^']|'')*)'$")
+_DEFAULT_TOP = 20  # of the server, when `$top` is not set
+
+
+def _split_top(body: str, operator: str) -> [str]:
+    """
+    Splits a filter at the `operator` ('or' or 'and') outside of the parentheses and the string literals.
+    :return: The operands, or [body] if there is no such operator.
+    """
+    terms = []
+    depth = 0
+    quoted = False
+    start = 0
+    separator = f' {operator} '
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif depth == 0 and body.startswith(separator, i):
+                terms.append(body[start:i].strip())
+                i += len(separator)
+                start = i
+                continue
+        i += 1
+    terms.append(body[start:].strip())
+    return terms
+
+
+def _unwrap(term: str) -> str or None:
+    """
+    :return: The contents of a term enclosed in one pair of parentheses, i.e. '(a or b)' -> 'a or b', otherwise None.
+    """
+    if not (term.startswith('(') and term.endswith(')')):
+        return None
+    depth = 0
+    quoted = False
+    for i, char in enumerate(term):
+        if char == "'":
+            quoted = not quoted
+        elif not quoted:
+            depth += char == '('
+            depth -= char == ')'
+            if depth == 0 and i < len(term) - 1:
+                return None
+    return term[1:-1]
+
+
+def _pack(terms: [str], build, fits) -> [str] or None:
+    """
+    Greedily groups the terms, so every filter built from a group fits.
+    :param terms: Operands of an `or`.
+    :param build: Function building a filter from a group of terms.
+    :param fits: Function checking a filter.
+    :return: Filters, or None if a single term does not fit.
+    """
+    filters = []
+    group = []
+    for term in terms:
+        if group and fits(build(group + [term])):
+            group.append(term)
+            continue
+        if group:
+            filters.append(build(group))
+        group = [term]
+        if not fits(build(group)):
+            return None
+    filters.append(build(group))
+    return filters
+
+
+def split_filter(body: str, fits) -> [str] or None:
+    """
+    Splits a filter into the fewest filters that fit, whose results together are the results of the filter:
+        'a or b or c' -> ['a or b', 'c']
+        'x and (a or b or c)' -> ['x and (a or b)', 'x and (c)']
+
+    :param body: Filter body.
+    :param fits: Function checking a filter, i.e. the length of its url.
+    :return: Filters, or None if the filter can not be split (there is no `or` to split, or a single term of it does
+    not fit).
+    """
+    terms = _split_top(body, 'or')
+    if len(terms) > 1:
+        return _pack(terms, lambda group: ' or '.join(group), fits)
+
+    conjuncts = _split_top(body, 'and')
+    candidates = sorted(range(len(conjuncts)), key=lambda index: len(conjuncts[index]), reverse=True)
+    for index in candidates:
+        inner = _unwrap(conjuncts[index])
+        if inner is None:
+            continue
+        terms = _split_top(inner, 'or')
+        if len(terms) < 2:
+            continue
+
+        def build(group, index=index):
+            parts = list(conjuncts)
+            parts[index] = f"({' or '.join(group)})"
+            return ' and '.join(parts)
+        return _pack(terms, build, fits)
+    return None
+
+
+def names(body: str) -> [str] or None:
+    """
+    :param body: Filter body.
+    :return: Product names of a filter made of `Name eq '...'` terms joined with `or`, otherwise None.
+    """
+    result = []
+    for term in _split_top(body, 'or'):
+        match = _NAME.match(term)
+        if match is None:
+            return None
+        result.append(match.group(1).replace("''", "'"))
+    return result
+
+
+def url_length(spec, endpoint: str) -> int:
+    """
+    :return: Length of the percent-encoded search url of a `QuerySpec`.
+    """
+    return len(requote_uri(spec.url(endpoint)))
+
+
+def oversized(spec, endpoint: str, limit: int or None) -> bool:
+    """
+    :return: True - if the search has a filter and its encoded url is longer than `limit`.
+    """
+    if limit is None or spec.filter is None:
+        return False
+    url = spec.url(endpoint)
+    return len(url) * 3 > limit and len(requote_uri(url)) > limit  # encoding at most triples the length
+
+
+def _with_id(spec):
+    """
+    :return: The spec selecting `Id` too, so the results of the sub-queries can be deduplicated.
+    """
+    if spec.select is None or 'Id' in spec.select.split(','):
+        return spec
+    return spec.replace(select=f'{spec.select},Id')
+
+
+def _unique(products: [dict], seen: set) -> [dict]:
+    """
+    :return: The products whose `Id` is not in `seen`, which is updated. Products without an `Id` are kept.
+    """
+    unique = []
+    for product in products:
+        key = product.get('Id')
+        if key is None or key not in seen:
+            seen.add(key)
+            unique.append(product)
+    return unique
+
+
+def _project(spec, products: [dict]) -> [dict]:
+    """
+    :return: The products with the fields selected by the spec only.
+    """
+    if spec.select is None:
+        return products
+    fields = ['@odata.mediaContentType'] + spec.select.split(',')
+    return [{field: product[field] for field in fields if field in product} for product in products]
+
+
+def split_spec(spec, endpoint: str, limit: int) -> [object] or None:
+    """
+    :param spec: `QuerySpec` with a filter.
+    :param endpoint: Products endpoint.
+    :param limit: Maximum length of the encoded url.
+    :return: `QuerySpec`s of the sub-queries, or None if the filter can not be split. They select `Id` too, if the
+    spec selects other fields, to deduplicate their results.
+    """
+    spec = _with_id(spec)
+    filters = split_filter(spec.filter, lambda body: url_length(spec.replace(filter=body), endpoint) <= limit)
+    if filters is None:
+        return None
+    return [spec.replace(filter=body) for body in filters]
+
+
+def _merge(spec, responses: [dict], exact_count: bool = False) -> dict:
+    """
+    Merges the responses of the sub-queries: the products are deduplicated by `Id`, ordered by the orderby option and
+    limited to `$top`, as in the response of the single query.
+    :param exact_count: If True, the responses hold all the results, so they are counted instead of summing the
+    '@odata.count' of the responses.
+    """
+    seen = set()
+    products = []
+    for response in responses:
+        products += _unique(response['value'], seen)
+
+    if spec.orderby is not None:
+        path, ascending = _sort_key(spec.orderby)
+        if spec.select is None or path.split('/')[0] in spec.select.split(','):
+            products.sort(key=_getter(path), reverse=not ascending)
+    products = _project(spec, products)
+
+    merged = {'@odata.context': '$metadata#Products'}
+    if spec.count is not None:
+        merged['@odata.count'] = (len(products) if exact_count else
+                                  sum(response.get('@odata.count', 0) for response in responses))
+    merged['value'] = products[:int(spec.top) if spec.top is not None else _DEFAULT_TOP]
+    return merged
+
+
+def execute_split(client, spec, deadline=None, max_workers: int = 4, chunk_size: int = 100,
+                  priority=None) -> dict or None:
+    """
+    Sends a search whose url is longer than `client.url_limit` as several shorter requests and merges their results.
+    A filter of names only (`Name eq '...' or ...`) is sent as `OData.CSC.FilterList` POST requests; any other
+    filter is split at its `or` operators into sub-queries sent concurrently.
+
+    The merged response has no '@odata.nextLink'. Unless the names are searched, its '@odata.count' is the sum of the
+    counts of the sub-queries, which overcounts products matching several of them.
+
+    :param client: `Client` to send requests with.
+    :param spec: `QuerySpec` of the search.
+    :param deadline: `Deadline` or None.
+    :param max_workers: Maximum number of concurrent sub-queries.
+    :param chunk_size: Maximum number of names per `OData.CSC.FilterList` request.
+    :param priority: Name of the priority class of the requests or None.
+    :return: Merged response, or None if the filter can not be split.
+    """
+    if spec.skip is not None:
+        return None  # skipping the results of the union is not possible
+
+    product_names = names(spec.filter) if spec.expand is None else None
+    if product_names is not None:
+        chunks = [product_names[i:i + chunk_size] for i in range(0, len(product_names), chunk_size)]
+        calls = [(client.by_names, chunk) for chunk in chunks]
+    else:
+        specs = split_spec(spec, client.endpoint, client.url_limit)
+        if specs is None:
+            return None
+        calls = [(client.execute, sub_spec) for sub_spec in specs]
+
+    if len(calls) == 1:
+        function, argument = calls[0]
+        responses = [function(argument, deadline=deadline, priority=priority)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, function, argument, deadline=deadline,
+                                       priority=priority)
+                       for function, argument in calls]
+            responses = [future.result() for future in futures]
+    return _merge(spec, responses, exact_count=product_names is not None)
+
+
+def pages_split(client, spec, max_pages: int or None = None, deadline=None, priority=None):
+    """
+    Paginates the sub-queries of a search whose url is longer than `client.url_limit` one after another, skipping the
+    products already yielded. The products are ordered within each sub-query only.
+    :return: Generator of responses, or None if the filter can not be split.
+    """
+    specs = split_spec(spec, client.endpoint, client.url_limit) if spec.skip is None else None
+    if specs is None:
+        return None
+
+    def generate():
+        seen = set()
+        pages = 0
+        for sub_spec in specs:
+            if max_pages is not None and pages >= max_pages:
+                return
+            remaining = None if max_pages is None else max_pages - pages
+            for page in client.pages(sub_spec, max_pages=remaining, deadline=deadline, priority=priority):
+                products = _project(spec, _unique(page['value'], seen))
+                pages += 1
+                page = dict(page, value=products)
+                page.pop('@odata.nextLink', None)
+                yield page
+    return generate()
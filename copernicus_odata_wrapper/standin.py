@@ -0,0 +1,575 @@
+import re
+import gzip
+import json
+import time
+import uuid
+import random
+import threading
+import functools
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qsl, quote, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .query import PRODUCT_FIELDS
+from .filter import format_date
+from .nodes import parse_nodes_url
+
+_TOKEN = re.compile(r"""\s*(?:
+      (?P<geography>geography'[^']*')
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<datetime>\d{4}-\d{2}-\d{2}T[\d:.]+Z)
+    | (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    | (?P<punctuation>[(),=:])
+    | (?P<name>[A-Za-z_][\w./]*)
+    )""", re.VERBOSE)
+
+_OPERATORS = {'eq': lambda a, b: a == b,
+              'ne': lambda a, b: a != b,
+              'gt': lambda a, b: a > b,
+              'ge': lambda a, b: a >= b,
+              'lt': lambda a, b: a < b,
+              'le': lambda a, b: a <= b}
+
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+_NAME_DATE_FORMAT = '%Y%m%dT%H%M%S'
+_NEXT_LINK_SAFE = "$&=,/()':;"
+
+
+def _tokenize(text: str) -> [(str, str)]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Unexpected character at {position}: {text[position:position + 20]}')
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def _bbox(wkt: str) -> (float, float, float, float):
+    """
+    :param wkt: POINT or POLYGON in WKT format, optionally prefixed with 'SRID=4326;'.
+    :return: (min lon, min lat, max lon, max lat)
+    """
+    numbers = [float(number) for number in re.findall(r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?', wkt.split(';')[-1])]
+    if len(numbers) < 2 or len(numbers) % 2:
+        raise ValueError(f'Invalid geometry: {wkt}')
+    lons, lats = numbers[0::2], numbers[1::2]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def _intersects(a: tuple, b: tuple) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class _FilterParser:
+    """
+    Recursive descent parser of the `$filter` subset generated by `Filter` and `attributes.py`. The filter is compiled
+    into a predicate of a product.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.variable = None
+
+    def __peek(self) -> (str, str) or (None, None):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def __next(self) -> (str, str):
+        if self.position >= len(self.tokens):
+            raise ValueError('Unexpected end of the filter')
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def __accept(self, kind: str, value: str) -> bool:
+        if self.__peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def __expect(self, kind: str, value: str or None = None) -> str:
+        token_kind, token_value = self.__next()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise ValueError(f'Expected `{value or kind}`, got `{token_value}`')
+        return token_value
+
+    def parse(self):
+        predicate = self.__or()
+        if self.position != len(self.tokens):
+            raise ValueError(f'Unexpected `{self.tokens[self.position][1]}`')
+        return predicate
+
+    def __or(self):
+        left = self.__and()
+        while self.__accept('name', 'or'):
+            right = self.__and()
+            left = functools.partial(lambda a, b, item: a(item) or b(item), left, right)
+        return left
+
+    def __and(self):
+        left = self.__unary()
+        while self.__accept('name', 'and'):
+            right = self.__unary()
+            left = functools.partial(lambda a, b, item: a(item) and b(item), left, right)
+        return left
+
+    def __unary(self):
+        if self.__accept('name', 'not'):
+            operand = self.__unary()
+            return lambda item: not operand(item)
+        return self.__primary()
+
+    def __primary(self):
+        if self.__accept('punctuation', '('):
+            predicate = self.__or()
+            self.__expect('punctuation', ')')
+            return predicate
+
+        kind, value = self.__peek()
+        if kind == 'name' and value in ('contains', 'startswith', 'endswith'):
+            self.position += 1
+            self.__expect('punctuation', '(')
+            getter = self.__operand()
+            self.__expect('punctuation', ',')
+            substring = self.__operand()(None)
+            self.__expect('punctuation', ')')
+            method = {'contains': str.__contains__, 'startswith': str.startswith, 'endswith': str.endswith}[value]
+            return lambda item: isinstance(getter(item), str) and method(getter(item), substring)
+
+        if kind == 'name' and value == 'OData.CSC.Intersects':
+            self.position += 1
+            self.__expect('punctuation', '(')
+            self.__expect('name', 'area')
+            self.__expect('punctuation', '=')
+            area = _bbox(self.__expect('geography')[len("geography'"):-1])
+            self.__expect('punctuation', ')')
+            return lambda item: _intersects(item['_bbox'], area)
+
+        if kind == 'name' and value.endswith('/any'):
+            return self.__any()
+
+        left = self.__operand()
+        operator = self.__expect('name')
+        if operator not in _OPERATORS:
+            raise ValueError(f'Unsupported operator `{operator}`')
+        right = self.__operand()
+        compare = _OPERATORS[operator]
+
+        def predicate(item):
+            a, b = left(item), right(item)
+            if a is None or b is None:
+                return compare(a, b) if operator in ('eq', 'ne') else False
+            try:
+                return compare(a, b)
+            except TypeError:
+                return False
+        return predicate
+
+    def __any(self):
+        """
+        Attributes/OData.CSC.StringAttribute/any(att:att/Name eq 'x' and att/OData.CSC.StringAttribute/Value eq 'y')
+        """
+        path = self.__next()[1][:-len('/any')]
+        collection, _, value_type = path.partition('/')
+        if collection != 'Attributes' or not value_type:
+            raise ValueError(f'Unsupported lambda `{path}/any`')
+        self.__expect('punctuation', '(')
+        outer, self.variable = self.variable, self.__expect('name')
+        self.__expect('punctuation', ':')
+        inner = self.__or()
+        self.variable = outer
+        self.__expect('punctuation', ')')
+
+        odata_type = f'#{value_type}'
+        return lambda item: any(inner(attribute) for attribute in item.get('Attributes', ())
+                                if attribute['@odata.type'] == odata_type)
+
+    def __operand(self):
+        kind, value = self.__next()
+        if kind == 'string':
+            literal = value[1:-1].replace("''", "'")
+            return lambda item: literal
+        if kind == 'datetime':
+            return lambda item: value
+        if kind == 'number':
+            number = float(value) if any(c in value for c in '.eE') else int(value)
+            return lambda item: number
+        if kind != 'name':
+            raise ValueError(f'Unexpected `{value}`')
+        if value in _LITERALS:
+            literal = _LITERALS[value]
+            return lambda item: literal
+
+        parts = value.split('/')
+        if self.variable is not None and parts[0] == self.variable:
+            key = parts[-1]  # att/Name or att/OData.CSC.StringAttribute/Value
+            return lambda item: item.get(key)
+
+        def get(item):
+            for part in parts:
+                if not isinstance(item, dict):
+                    return None
+                item = item.get(part)
+            return item
+        return get
+
+
+@functools.lru_cache(maxsize=256)
+def compile_filter(text: str):
+    """
+    :param text: Value of the `$filter` option.
+    :return: Predicate of a product of `SyntheticCatalogue`. `ValueError` is raised if the filter is not supported.
+    """
+    return _FilterParser(text).parse()
+
+
+def _attribute(value_type: str, name: str, value) -> dict:
+    return {'@odata.type': f'#OData.CSC.{value_type}Attribute', 'Name': name, 'Value': value, 'ValueType': value_type}
+
+
+class SyntheticCatalogue:
+    """
+    Deterministic catalogue of Sentinel-1, Sentinel-2 and Sentinel-3 products, answering a subset of the OData API:
+        search - `$filter` (see below), `$orderby`, `$top`, `$skip`, `$count`, `$expand`, `$select` and
+                 '@odata.nextLink'
+        OData.CSC.FilterList - POST search by names
+        Nodes - a synthetic folder tree of every product
+
+    Supported `$filter` expressions are the ones generated by `Filter` and `attributes.py`: and/or/not,
+    parentheses, eq/ne/gt/ge/lt/le comparisons of the product fields (including `Collection/Name`),
+    contains/startswith/endswith, `Attributes/.../any(...)` and `OData.CSC.Intersects`, which compares the bounding
+    boxes of the geometries.
+
+    Use `StandInServer` to serve it over HTTP, or `transport.CatalogueSession` to query it in-process.
+
+    Class attributes:
+        products - the products, including the expanded `Attributes` and `Assets`
+    """
+    COLLECTIONS = ['SENTINEL-1', 'SENTINEL-2', 'SENTINEL-3']
+
+    def __init__(self, size: int = 1000, seed: int = 0, start: datetime = datetime(2023, 1, 1), days: int = 30):
+        """
+        :param size: Number of products.
+        :param seed: Seed of the random generator, the same seed gives the same catalogue.
+        :param start: Start of the sensing period.
+        :param days: Length of the sensing period.
+        """
+        rng = random.Random(seed)
+        self.products = [self.__product(rng, i, start, days) for i in range(size)]
+        self.products.sort(key=lambda product: product['Id'])
+        self.__by_id = {product['Id']: product for product in self.products}
+        self.__by_name = {product['Name']: product for product in self.products}
+
+    @staticmethod
+    def __product(rng: random.Random, index: int, start: datetime, days: int) -> dict:
+        collection = SyntheticCatalogue.COLLECTIONS[index % len(SyntheticCatalogue.COLLECTIONS)]
+        sensing = start + timedelta(seconds=rng.randrange(days * 24 * 60 * 60), milliseconds=rng.randrange(1000))
+        unit = rng.choice('AB')
+        orbit = rng.randrange(1, 60000)
+        relative_orbit = rng.randrange(1, 176)
+        direction = rng.choice(['ASCENDING', 'DESCENDING'])
+        t0 = sensing.strftime(_NAME_DATE_FORMAT)
+
+        if collection == 'SENTINEL-1':
+            end = sensing + timedelta(seconds=25)
+            product_type = 'IW_GRDH_1S'
+            name = (f'S1{unit}_IW_GRDH_1SDV_{t0}_{end.strftime(_NAME_DATE_FORMAT)}_{orbit:06d}_'
+                    f'{rng.randrange(16 ** 6):06X}_{rng.randrange(16 ** 4):04X}.SAFE')
+            path = f'Sentinel-1/SAR/GRD'
+            attributes = [_attribute('String', 'operationalMode', 'IW'),
+                          _attribute('String', 'processingLevel', 'LEVEL1'),
+                          _attribute('String', 'instrumentShortName', 'SAR')]
+        elif collection == 'SENTINEL-2':
+            end = sensing
+            level = rng.choice(['1C', '2A'])
+            product_type = f'S2MSI{level}'
+            tile = f'{rng.randrange(1, 61):02d}{"".join(rng.choice("CDEFGHJKLMNPQRSTUVWX") for _ in range(3))}'
+            generation = (sensing + timedelta(hours=rng.randrange(1, 12))).strftime(_NAME_DATE_FORMAT)
+            name = f'S2{unit}_MSIL{level}_{t0}_N0509_R{relative_orbit:03d}_T{tile}_{generation}.SAFE'
+            path = f'Sentinel-2/MSI/L{level}'
+            attributes = [_attribute('String', 'processingLevel', product_type),
+                          _attribute('String', 'instrumentShortName', 'MSI'),
+                          _attribute('Double', 'cloudCover', round(rng.uniform(0, 100), 2))]
+        else:
+            end = sensing + timedelta(minutes=3)
+            product_type = 'OL_1_EFR___'
+            generation = (sensing + timedelta(days=1)).strftime(_NAME_DATE_FORMAT)
+            name = (f'S3{unit}_OL_1_EFR____{t0}_{end.strftime(_NAME_DATE_FORMAT)}_{generation}_0179_'
+                    f'{rng.randrange(1, 100):03d}_{relative_orbit:03d}_{rng.randrange(10000):04d}_LN1_O_NT_002.SEN3')
+            path = f'Sentinel-3/OLCI/OL_1_EFR___'
+            attributes = [_attribute('String', 'processingLevel', '1'),
+                          _attribute('String', 'instrumentShortName', 'OLCI'),
+                          _attribute('Double', 'cloudCover', round(rng.uniform(0, 100), 2))]
+
+        attributes += [_attribute('String', 'productType', product_type),
+                       _attribute('String', 'platformShortName', collection),
+                       _attribute('String', 'platformSerialIdentifier', unit),
+                       _attribute('String', 'orbitDirection', direction),
+                       _attribute('Integer', 'orbitNumber', orbit),
+                       _attribute('Integer', 'relativeOrbitNumber', relative_orbit),
+                       _attribute('DateTimeOffset', 'beginningDateTime', format_date(sensing)),
+                       _attribute('DateTimeOffset', 'endingDateTime', format_date(end))]
+
+        lon, lat = round(rng.uniform(-179, 178), 4), round(rng.uniform(-80, 79), 4)
+        ring = [[lon, lat], [lon + 1, lat], [lon + 1, lat + 1], [lon, lat + 1], [lon, lat]]
+        wkt = ', '.join(f'{x} {y}' for x, y in ring)
+        publication = format_date(end + timedelta(hours=rng.randrange(1, 48)))
+        return {'Id': str(uuid.UUID(int=rng.getrandbits(128), version=5)),
+                'Name': name,
+                'ContentType': 'application/octet-stream',
+                'ContentLength': rng.randrange(10 ** 8, 10 ** 9),
+                'OriginDate': publication,
+                'PublicationDate': publication,
+                'ModificationDate': publication,
+                'Online': True,
+                'EvictionDate': '',
+                'S3Path': f'/eodata/{path}/{sensing:%Y/%m/%d}/{name}',
+                'Checksum': [],
+                'ContentDate': {'Start': format_date(sensing), 'End': format_date(end)},
+                'Footprint': f"geography'SRID=4326;POLYGON (({wkt}))'",
+                'GeoFootprint': {'type': 'Polygon', 'coordinates': [ring]},
+                'Collection': {'Name': collection},
+                'Attributes': attributes,
+                'Assets': [],
+                '_bbox': (lon, lat, lon + 1, lat + 1)}
+
+    @staticmethod
+    def __render(product: dict, select: [str] or None, expand: [str]) -> dict:
+        item = {'@odata.mediaContentType': 'application/octet-stream'}
+        for field in select or PRODUCT_FIELDS:
+            item[field] = product[field]
+        for field in expand:
+            if field in ('Attributes', 'Assets'):
+                item[field] = product[field]
+        return item
+
+    def handle(self, method: str, url: str, body: dict or None = None) -> (int, dict):
+        """
+        Answers a request.
+        :param method: 'GET' or 'POST'.
+        :param url: Request url, i.e. 'http://127.0.0.1:8000/odata/v1/Products?$top=10'. Only the path and the query
+        string are used.
+        :param body: POST body (decoded JSON).
+        :return: (HTTP status, response as a dictionary)
+        """
+        parts = urlsplit(url)
+        base = f'{parts.scheme}://{parts.netloc}' if parts.netloc else ''
+        path = unquote(parts.path).rstrip('/')
+        if not path.startswith('/odata/v1/Products'):
+            return 404, {'detail': 'Invalid odata path'}
+        endpoint = f'{base}/odata/v1/Products'
+
+        try:
+            if path == '/odata/v1/Products' and method == 'GET':
+                return 200, self.search(parse_qsl(parts.query, keep_blank_values=True), endpoint)
+            if path == '/odata/v1/Products/OData.CSC.FilterList' and method == 'POST':
+                return 200, self.filter_list(body or {})
+            if path.endswith('/Nodes') and method == 'GET':
+                return self.nodes(f'{endpoint}{path[len("/odata/v1/Products"):]}')
+        except ValueError as error:
+            return 400, {'detail': str(error)}
+        return 404, {'detail': 'Invalid odata path'}
+
+    def search(self, options: [(str, str)], endpoint: str) -> dict:
+        """
+        :param options: Query string as (name, value) pairs, i.e. [('$top', '10'), ('$expand', 'Attributes')].
+        :param endpoint: Products endpoint, used to build '@odata.nextLink'.
+        :return: Response as a dictionary.
+        """
+        values = {}
+        expand = []
+        for name, value in options:
+            if name == '$expand':
+                expand.append(value)
+            else:
+                values[name] = value
+
+        products = self.products
+        if values.get('$filter'):
+            predicate = compile_filter(values['$filter'])
+            products = [product for product in products if predicate(product)]
+
+        if values.get('$orderby'):
+            field, _, direction = values['$orderby'].strip().partition(' ')
+            parts = field.split('/')
+
+            def key(product):
+                for part in parts:
+                    product = product[part]
+                return product
+            products = sorted(products, key=key, reverse=direction.strip() == 'desc')
+
+        top = int(values.get('$top', 20))
+        skip = int(values.get('$skip', 0))
+        if not 0 <= top <= 1000 or not 0 <= skip <= 10000:
+            raise ValueError('`$top` must be within 0 - 1000 and `$skip` within 0 - 10000')
+        select = values['$select'].split(',') if values.get('$select') else None
+
+        response = {'@odata.context': '$metadata#Products'}
+        if values.get('$count', '').lower() == 'true':
+            response['@odata.count'] = len(products)
+        response['value'] = [self.__render(product, select, expand) for product in products[skip:skip + top]]
+
+        if top and skip + top < len(products):
+            values['$skip'] = str(skip + top)
+            values['$top'] = str(top)
+            query = '&'.join([f'{name}={value}' for name, value in values.items()] +
+                             [f'$expand={value}' for value in expand])
+            response['@odata.nextLink'] = f'{endpoint}?{quote(query, safe=_NEXT_LINK_SAFE)}'
+        return response
+
+    def filter_list(self, body: dict) -> dict:
+        """
+        :param body: {'FilterProducts': [{'Name': ...}, ...]}
+        :return: Response as a dictionary.
+        """
+        products = (self.__by_name.get(item.get('Name')) for item in body.get('FilterProducts', []))
+        return {'@odata.context': '$metadata#Products',
+                'value': [self.__render(product, None, []) for product in products if product is not None]}
+
+    def tree(self, product: dict) -> dict:
+        """
+        :param product: A product of the catalogue.
+        :return: Synthetic content of the product: {name: nested dictionary (folder) or size in bytes (file)}.
+        """
+        stem = product['Name'].rsplit('.', 1)[0]
+        return {product['Name']: {'manifest.safe': 65536,
+                                  'MTD.xml': 8192,
+                                  'GRANULE': {stem: {'IMG_DATA': {f'{stem}_B{band:02d}.jp2': 1048576 * band
+                                                                  for band in range(1, 13)},
+                                                     'QI_DATA': {'MSK_CLOUDS.gml': 4096}}},
+                                  'HTML': {'index.html': 1024},
+                                  'rep_info': {'schema.xsd': 2048}}}
+
+    def nodes(self, url: str) -> (int, dict):
+        """
+        :param url: Url of a Nodes listing.
+        :return: (HTTP status, response as a dictionary)
+        """
+        product_id, path = parse_nodes_url(url)
+        product = self.__by_id.get(product_id)
+        if product is None:
+            return 404, {'detail': 'Not Found'}
+
+        folder = self.tree(product)
+        for name in path.split('/') if path else []:
+            folder = folder.get(name) if isinstance(folder, dict) else None
+            if folder is None:
+                return 404, {'detail': 'Not Found'}
+        if not isinstance(folder, dict):
+            return 200, {'result': []}
+
+        prefix = url[:-len('/Nodes')]
+        result = []
+        for name, child in folder.items():
+            is_folder = isinstance(child, dict)
+            result.append({'Id': name,
+                           'Name': name,
+                           'ContentLength': 0 if is_folder else child,
+                           'ChildrenNumber': len(child) if is_folder else 0,
+                           'Nodes': {'uri': f'{prefix}/Nodes({name})/Nodes'}})
+        return 200, {'result': result}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately
+
+    def log_message(self, format, *args):
+        pass
+
+    def __respond(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        stand_in = self.server.stand_in
+        if stand_in.latency:
+            time.sleep(stand_in.latency)
+        try:
+            status, payload = stand_in.catalogue.handle(method, f'http://{self.headers["Host"]}{self.path}', body)
+        except Exception as error:
+            status, payload = 500, {'detail': f'{type(error).__name__}: {error}'}
+
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if stand_in.compression and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            content = gzip.compress(content, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.__respond('GET')
+
+    def do_POST(self):
+        self.__respond('POST')
+
+
+class StandInServer:
+    """
+    Local HTTP server of a `SyntheticCatalogue`, running in a background thread. Point a `Query` or a `Client` at its
+    `endpoint` to test and benchmark without network access.
+
+    Example usage:
+        with StandInServer(SyntheticCatalogue(size=10000)) as server:
+            query = Query()
+            query.endpoint = server.endpoint
+            query.endpoint_zipper = server.endpoint
+            query.set_top(100)
+            for page in query.pages():
+                ...
+
+    Class attributes:
+        compression - if True, responses are gzip compressed for the clients accepting it
+        latency - seconds every response is delayed by, to simulate a remote server
+    """
+
+    def __init__(self, catalogue: SyntheticCatalogue or None = None, host: str = '127.0.0.1', port: int = 0,
+                 compression: bool = True, latency: float = 0.0):
+        """
+        :param catalogue: Catalogue to be served. None - `SyntheticCatalogue()`.
+        :param host: Host to listen on.
+        :param port: Port to listen on. 0 - any free port.
+        :param compression: See the class attributes.
+        :param latency: See the class attributes.
+        """
+        self.catalogue = SyntheticCatalogue() if catalogue is None else catalogue
+        self.compression = compression
+        self.latency = latency
+        self.__server = ThreadingHTTPServer((host, port), _Handler)
+        self.__server.daemon_threads = True
+        self.__server.stand_in = self
+        self.__thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f'http://{host}:{port}/odata/v1/Products'
+
+    def start(self) -> 'StandInServer':
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread.join()
+            self.__thread = None
+        self.__server.server_close()
+
+    def __enter__(self) -> 'StandInServer':
+        return self.start()
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        self.stop()
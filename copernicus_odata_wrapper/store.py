@@ -0,0 +1,481 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from .footprints import Footprints
+
+MAGIC = b'CDSESTR1'
+_ALIGNMENT = 8
+_NULL = -2 ** 63  # of the integer and date columns
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+STRING_FIELDS = ['Id', 'Name', 'ContentType', 'S3Path']
+INTEGER_FIELDS = ['ContentLength']
+DATE_FIELDS = ['OriginDate', 'PublicationDate', 'ModificationDate', 'EvictionDate', 'ContentDate/Start',
+               'ContentDate/End']
+_COLUMN_FIELDS = set(STRING_FIELDS + INTEGER_FIELDS) | {'OriginDate', 'PublicationDate', 'ModificationDate',
+                                                       'EvictionDate', 'ContentDate', 'Online', 'GeoFootprint',
+                                                       'Footprint'}
+_FOOTPRINT_COLUMNS = {'xs': 'd', 'ys': 'd', 'ring_offsets': 'q', 'geometry_offsets': 'q', 'holes': 'b'}
+
+
+def _parse_date(value) -> int or None:
+    """
+    :return: Microseconds since the epoch of a date string, if `_format_date()` restores exactly the same string.
+    """
+    if not isinstance(value, str) or not value.endswith('Z'):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return None
+    microseconds = (parsed - _EPOCH) // _MICROSECOND
+    return microseconds if _format_date(microseconds) == value else None
+
+
+def _format_date(microseconds: int) -> str:
+    text = (_EPOCH + microseconds * _MICROSECOND).strftime('%Y-%m-%dT%H:%M:%S.%f')
+    return (text[:-3] if microseconds % 1000 == 0 else text) + 'Z'
+
+
+class _Column:
+    """
+    Typed column written by `ResultStoreWriter`, spilled to a temporary file whenever its buffer grows past
+    `buffer_size` bytes, so a column of any length takes constant memory.
+    """
+
+    def __init__(self, typecode: str, directory: str, buffer_size: int, values=()):
+        self.typecode = typecode
+        self.buffer = array(typecode, values)
+        self.buffer_size = buffer_size
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.spilled = 0
+
+    def append(self, value) -> None:
+        self.buffer.append(value)
+        if len(self.buffer) * self.buffer.itemsize >= self.buffer_size:
+            self.flush()
+
+    def extend(self, values) -> None:
+        self.buffer.extend(values)
+        if len(self.buffer) * self.buffer.itemsize >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.buffer.tofile(self.file)
+        self.spilled += len(self.buffer)
+        self.buffer = array(self.typecode)
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.buffer)
+
+
+class _Strings(_Column):
+    """
+    String column: offsets of the values into a heap of their UTF-8 bytes. None values are marked in `nulls`.
+    """
+
+    def __init__(self, directory: str, buffer_size: int):
+        super().__init__('q', directory, buffer_size, [0])
+        self.heap = tempfile.TemporaryFile(dir=directory)
+        self.heap_size = 0
+        self.nulls = _Column('b', directory, buffer_size)
+
+    def add(self, value: str or None) -> None:
+        if value is not None:
+            data = value.encode()
+            self.heap.write(data)
+            self.heap_size += len(data)
+        self.nulls.append(value is None)
+        self.append(self.heap_size)
+
+
+class ResultStoreWriter:
+    """
+    Writes products into a binary file of columns for `ResultStore`, streaming: the columns are spilled to temporary
+    files in the directory of the store and assembled on `close()`, so the memory does not grow with the number of
+    products.
+
+    Layout of the file: MAGIC, the length of the header (uint64, little endian), the header (JSON) and the sections,
+    each aligned to 8 bytes. The header describes every section: {'name': ..., 'type': array typecode or 'heap',
+    'offset': ..., 'size': ...}.
+
+    Columns:
+        Id, Name, ContentType, S3Path - offsets into a string heap (int64) and null flags (int8)
+        ContentLength - int64
+        Online - int8 (-1 - missing)
+        OriginDate, PublicationDate, ModificationDate, EvictionDate, ContentDate/Start, ContentDate/End - int64
+            microseconds since the epoch
+        GeoFootprint - the buffers of `Footprints`: xs, ys (float64), ring_offsets, geometry_offsets (int64),
+            holes (int8)
+        extras - the other fields of every product (i.e. Attributes, Checksum) and the values not fitting their
+            column, as JSON in a string heap
+    The WKT `Footprint` is not stored, it duplicates the `GeoFootprint`.
+
+    Example usage:
+        with ResultStoreWriter('products.cdse') as writer:
+            writer.write_all(query.products())
+
+    If the `with` block raises, the writer is aborted and a previous store at the path is kept.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20):
+        """
+        :param path: Path of the store file. It is replaced on `close()`.
+        :param buffer_size: Bytes buffered per column before spilling it to its temporary file.
+        """
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        self.count = 0
+        self.__strings = {field: _Strings(directory, buffer_size) for field in STRING_FIELDS + ['extras']}
+        self.__integers = {field: _Column('q', directory, buffer_size) for field in INTEGER_FIELDS + DATE_FIELDS}
+        self.__online = _Column('b', directory, buffer_size)
+        self.__footprints = Footprints()
+        for name, typecode in _FOOTPRINT_COLUMNS.items():
+            values = [0] if name.endswith('offsets') else ()
+            setattr(self.__footprints, name, _Column(typecode, directory, buffer_size, values))
+        self.__footprints.ids = _Counter()
+        self.__closed = False
+
+    def write(self, product: dict) -> None:
+        """
+        Appends a product.
+        """
+        extras = {name: value for name, value in product.items() if name not in _COLUMN_FIELDS}
+        content_date = product.get('ContentDate')
+        if 'ContentDate' in product and not (isinstance(content_date, dict) and
+                                             set(content_date) <= {'Start', 'End'}):
+            extras['ContentDate'] = content_date
+            content_date = None
+
+        for field in STRING_FIELDS:
+            value = product.get(field)
+            if field in product and not isinstance(value, str):
+                extras[field] = value
+                value = None
+            self.__strings[field].add(value)
+
+        for field in INTEGER_FIELDS + DATE_FIELDS:
+            if field.startswith('ContentDate/'):
+                container, name = content_date or {}, field.split('/')[1]
+            else:
+                container, name = product, field
+            if name not in container:
+                self.__integers[field].append(_NULL)
+                continue
+            value = container[name]
+            if field in INTEGER_FIELDS:
+                stored = value if type(value) is int and value != _NULL else None
+            else:
+                stored = _parse_date(value)
+            if stored is None:
+                if container is product:
+                    extras[name] = value
+                else:
+                    extras.setdefault('ContentDate', {})[name] = value
+                stored = _NULL
+            self.__integers[field].append(stored)
+        if content_date == {}:
+            extras['ContentDate'] = {}
+
+        online = product.get('Online')
+        if 'Online' in product and not isinstance(online, bool):
+            extras['Online'] = online
+        self.__online.append(int(online) if isinstance(online, bool) else -1)
+
+        geometry = product.get('GeoFootprint')
+        if 'GeoFootprint' in product and (geometry is None or not self.__footprint(geometry)):
+            extras['GeoFootprint'] = geometry
+            geometry = None
+        self.__footprints.append(geometry)
+
+        self.__strings['extras'].add(json.dumps(extras) if extras else None)
+        self.count += 1
+
+    @staticmethod
+    def __footprint(geometry) -> bool:
+        """
+        :return: True if the footprint columns restore the geometry exactly.
+        """
+        footprints = Footprints()
+        try:
+            footprints.append(geometry)
+        except (KeyError, ValueError, TypeError, IndexError):
+            return False
+        return footprints.geometry(0) == geometry
+
+    def write_all(self, products) -> int:
+        """
+        Appends products of an iterable, i.e. `Query.products()`.
+        :return: Number of products written by the writer so far.
+        """
+        for product in products:
+            self.write(product)
+        return self.count
+
+    def __sections(self) -> [(str, str, object)]:
+        """
+        :return: [(name, type, column or heap file)]
+        """
+        sections = []
+        for field, column in self.__strings.items():
+            sections += [(f'{field}.offsets', 'q', column), (f'{field}.nulls', 'b', column.nulls),
+                         (f'{field}.heap', 'heap', column.heap)]
+        for field, column in self.__integers.items():
+            sections.append((field, 'q', column))
+        sections.append(('Online', 'b', self.__online))
+        for name, typecode in _FOOTPRINT_COLUMNS.items():
+            sections.append((f'GeoFootprint.{name}', typecode, getattr(self.__footprints, name)))
+        return sections
+
+    def close(self) -> None:
+        """
+        Assembles the store file.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        sections = self.__sections()
+        headers = []
+        for name, kind, source in sections:
+            if kind == 'heap':
+                size = source.tell()
+            else:
+                source.flush()
+                size = len(source) * array(kind).itemsize
+            headers.append({'name': name, 'type': kind, 'size': size})
+
+        # the header length depends on the offsets, which depend on the header length
+        header_size = 0
+        while True:
+            offset = len(MAGIC) + 8 + header_size
+            for header in headers:
+                offset += -offset % _ALIGNMENT
+                header['offset'] = offset
+                offset += header['size']
+            header = json.dumps({'rows': self.count, 'sections': headers}).encode()
+            if len(header) + -(len(MAGIC) + 8 + len(header)) % _ALIGNMENT == header_size:
+                break
+            header_size = len(header) + -(len(MAGIC) + 8 + len(header)) % _ALIGNMENT
+
+        temporary = f'{self.path}.tmp'
+        try:
+            with open(temporary, 'wb') as file:
+                file.write(MAGIC + struct.pack('<Q', header_size) + header.ljust(header_size))
+                for (name, kind, source), description in zip(sections, headers):
+                    file.write(b'\0' * (description['offset'] - file.tell()))
+                    source = source if kind == 'heap' else source.file
+                    source.seek(0)
+                    shutil.copyfileobj(source, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        finally:
+            self.__discard(sections)
+
+    def abort(self) -> None:
+        """
+        Discards the written products. An existing store at `path` is left untouched.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__discard(self.__sections())
+
+    @staticmethod
+    def __discard(sections: [(str, str, object)]) -> None:
+        for _, kind, source in sections:
+            (source if kind == 'heap' else source.file).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class _Counter:
+    """
+    Stands for the `ids` of the footprints being written, which are kept in the Id column.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, _) -> None:
+        self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class StringColumn:
+    """
+    Lazy sequence of the values of a string column of a `ResultStore`.
+    """
+
+    def __init__(self, offsets: memoryview, nulls: memoryview, heap: memoryview):
+        self.offsets = offsets
+        self.nulls = nulls
+        self.heap = heap
+
+    def __len__(self) -> int:
+        return len(self.nulls)
+
+    def __getitem__(self, index: int) -> str or None:
+        if index < 0:
+            index += len(self)
+        if self.nulls[index]:
+            return None
+        return str(self.heap[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class ResultStore:
+    """
+    Read-only, memory-mapped view of a file written by `ResultStoreWriter`. Opening it only reads the header; the
+    columns are views of the mapped file, so processes opening the same store share its pages in the page cache, and
+    a product is decoded only when its row is accessed.
+
+    Example usage:
+        store = ResultStore('products.cdse')
+        print(len(store), store[0]['Name'])
+
+        sizes = store.column('ContentLength')  # memoryview of int64, without copying
+        names = store.strings('Name')  # lazy sequence
+        footprints = store.footprints()  # over the mapped buffers
+        for index in footprints.rank(aoi)[:10]:
+            print(store[index]['Name'])
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the store file.
+        """
+        self.path = path
+        with open(path, 'rb') as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__buffer = memoryview(self.__map)
+        if self.__buffer[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'Not a result store: {path}')
+        header_size, = struct.unpack_from('<Q', self.__buffer, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self.__buffer[start:start + header_size]))
+        self.rows = header['rows']
+        self.__sections = {}
+        for section in header['sections']:
+            view = self.__buffer[section['offset']:section['offset'] + section['size']]
+            self.__sections[section['name']] = view if section['type'] == 'heap' else view.cast(section['type'])
+        self.__strings = {field: self.strings(field) for field in STRING_FIELDS + ['extras']}
+        self.__footprints = self.footprints()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def column(self, field: str) -> memoryview:
+        """
+        :param field: 'ContentLength', 'Online' or one of the dates, i.e. 'ContentDate/Start'.
+        :return: Values of a fixed-width column, without copying. Missing integers and dates are -2 ** 63, missing
+        `Online` is -1. Dates are microseconds since the epoch.
+        """
+        if field in STRING_FIELDS:
+            raise ValueError(f'{field} is a string column, see `strings()`')
+        return self.__sections[field]
+
+    def strings(self, field: str) -> StringColumn:
+        """
+        :param field: 'Id', 'Name', 'ContentType' or 'S3Path'.
+        :return: Lazy sequence of the values.
+        """
+        return StringColumn(self.__sections[f'{field}.offsets'], self.__sections[f'{field}.nulls'],
+                            self.__sections[f'{field}.heap'])
+
+    def footprints(self) -> Footprints:
+        """
+        :return: `Footprints` over the mapped buffers, without copying. Its `ids` are the lazy `Id` column.
+        """
+        footprints = Footprints()
+        for name in _FOOTPRINT_COLUMNS:
+            setattr(footprints, name, self.__sections[f'GeoFootprint.{name}'])
+        footprints.ids = self.__strings['Id']
+        return footprints
+
+    def __getitem__(self, index: int) -> dict:
+        """
+        Decodes a row.
+        :return: The product, as written, except for its WKT `Footprint`.
+        """
+        if index < 0:
+            index += self.rows
+        if not 0 <= index < self.rows:
+            raise IndexError('Row index out of range')
+
+        product = {}
+        for field in STRING_FIELDS:
+            value = self.__strings[field][index]
+            if value is not None:
+                product[field] = value
+        for field in INTEGER_FIELDS + DATE_FIELDS:
+            value = self.__sections[field][index]
+            if value == _NULL:
+                continue
+            value = value if field in INTEGER_FIELDS else _format_date(value)
+            if field.startswith('ContentDate/'):
+                product.setdefault('ContentDate', {})[field.split('/')[1]] = value
+            else:
+                product[field] = value
+        online = self.__sections['Online'][index]
+        if online >= 0:
+            product['Online'] = bool(online)
+
+        geometry_offsets = self.__sections['GeoFootprint.geometry_offsets']
+        if geometry_offsets[index + 1] > geometry_offsets[index]:
+            product['GeoFootprint'] = self.__footprints.geometry(index)
+
+        extras = self.__strings['extras'][index]
+        if extras is not None:
+            for name, value in json.loads(extras).items():
+                if name == 'ContentDate' and isinstance(value, dict) and isinstance(product.get(name), dict):
+                    product[name].update(value)
+                else:
+                    product[name] = value
+        return product
+
+    def __iter__(self):
+        for index in range(self.rows):
+            yield self[index]
+
+    def close(self) -> None:
+        """
+        Unmaps the file. Columns obtained from the store must not be used afterwards.
+        """
+        for section in getattr(self, '_ResultStore__sections', {}).values():
+            section.release()
+        self.__buffer.release()
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
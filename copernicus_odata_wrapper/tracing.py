@@ -0,0 +1,242 @@
+import json
+import time
+import random
+import hashlib
+import threading
+import contextvars
+
+_current = contextvars.ContextVar('copernicus_span', default=None)
+
+
+def filter_hash(fltr: str or None) -> str:
+    """
+    :param fltr: Filter body (`spec.filter`).
+    :return: Short hash identifying the filter in the span attributes, without exporting the filter itself.
+    """
+    return hashlib.sha1((fltr or '').encode()).hexdigest()[:16]
+
+
+class Span:
+    """
+    A timed operation. Spans are created by `Tracer.span()` and used as context managers: while the span is entered,
+    spans created in the same context (thread) become its children. An exception leaving the span sets its status
+    to 'error'.
+    """
+
+    def __init__(self, tracer: 'Tracer', name: str, parent: 'Span' or None, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f'{random.getrandbits(128):032x}'
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.status = 'ok'
+        self.start = time.time()
+        self.end = None
+        self.__started = time.monotonic()
+        self.__token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def __enter__(self) -> 'Span':
+        self.__token = _current.set(self)
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        if error is not None and not isinstance(error, GeneratorExit):
+            self.status = 'error'
+            self.attributes['error.type'] = error_type.__name__
+            self.attributes['error.message'] = str(error)
+        self.end = self.start + (time.monotonic() - self.__started)
+        _current.reset(self.__token)
+        self.tracer.exporter.export(self)
+
+    def to_dict(self) -> dict:
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'end': self.end,
+                'duration': None if self.end is None else self.end - self.start,
+                'status': self.status,
+                'attributes': self.attributes}
+
+
+class SpanExporter:
+    """
+    Receiver of the finished spans. This base class discards them; subclass it to forward the spans to another
+    system, or use `JsonLinesExporter`.
+    """
+
+    def export(self, span: Span) -> None:
+        """
+        :param span: Finished span. Called from the thread that finished it.
+        :return: None
+        """
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Writes every finished span as a line of JSON (see `Span.to_dict()`).
+    """
+
+    def __init__(self, file):
+        """
+        :param file: Path of the file to append to, or a file-like object opened for writing text.
+        """
+        self.__lock = threading.Lock()
+        self.__owned = isinstance(file, str)
+        self.__file = open(file, 'a') if self.__owned else file
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self.__lock:
+            self.__file.write(line + '\n')
+            self.__file.flush()
+
+    def close(self) -> None:
+        with self.__lock:
+            if self.__owned:
+                self.__file.close()
+
+
+class MemoryExporter(SpanExporter):
+    """
+    Keeps the finished spans in the `spans` list, i.e. for tests or to inspect a single call.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.__lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self.__lock:
+            self.spans.append(span)
+
+
+class Tracer:
+    """
+    Creates spans for the operations of `Client`: a parent span for every call (`send`, `pages`, `by_names`,
+    `product_nodes`, `walk_nodes`, `fan_out`) and a child `http` span for every HTTP request it makes, including the
+    hedged and failed-over ones. Spans follow the call into the worker threads.
+
+    A tracer is any object with a `span(name, **attributes)` method returning a context manager, which yields an
+    object with a `set_attribute(key, value)` method. Use `OpenTelemetryTracer` to report to OpenTelemetry instead.
+
+    Example usage:
+        query = Query()
+        query.tracer = Tracer(JsonLinesExporter('spans.jsonl'))
+        query.send()
+
+    Attributes of the spans:
+        copernicus.filter_hash - `filter_hash()` of the search filter
+        copernicus.page - index of the page (0 - the first one) of a `pages` span
+        copernicus.collections, copernicus.names - collections of `fan_out`, number of names of `by_names`
+        http.method, http.url, http.status_code, http.response_bytes - of `http` spans
+        error.type, error.message - of the spans left with an exception (status 'error')
+    """
+
+    def __init__(self, exporter: SpanExporter or None = None):
+        """
+        :param exporter: `SpanExporter` receiving the finished spans. None - spans are discarded.
+        """
+        self.exporter = SpanExporter() if exporter is None else exporter
+
+    def span(self, name: str, **attributes) -> Span:
+        """
+        :param name: Name of the operation.
+        :param attributes: Attributes of the span.
+        :return: Span, a child of the current span (if any). Enter it to start measuring its children.
+        """
+        return Span(self, name, _current.get(), attributes)
+
+
+class OpenTelemetryTracer:
+    """
+    Reports the spans to OpenTelemetry.
+
+    Example usage:
+        from opentelemetry import trace
+
+        query = Query()
+        query.tracer = OpenTelemetryTracer(trace.get_tracer('copernicus_odata_wrapper'))
+    """
+
+    def __init__(self, tracer):
+        """
+        :param tracer: `opentelemetry.trace.Tracer`.
+        """
+        self.tracer = tracer
+
+    def span(self, name: str, **attributes):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+
+class _NoopSpan:
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, error_type, error, traceback) -> None:
+        pass
+
+    def run(self, function, *args, **kwargs):
+        return function(*args, **kwargs)
+
+    def close(self, error: BaseException or None = None) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class _Scope:
+    """
+    A span entered in a private context instead of the caller's one. Generators and thread pools use it: functions
+    passed to `run()` see the span as current, while the code between the yields does not.
+    """
+
+    def __init__(self, manager):
+        self.__manager = manager
+        self.__context = contextvars.copy_context()
+        self.span = self.__context.run(manager.__enter__)
+
+    def set_attribute(self, key: str, value) -> None:
+        self.span.set_attribute(key, value)
+
+    def run(self, function, *args, **kwargs):
+        return self.__context.copy().run(function, *args, **kwargs)
+
+    def close(self, error: BaseException or None = None) -> None:
+        self.__context.run(self.__manager.__exit__, None if error is None else type(error), error, None)
+
+
+def span(tracer, name: str, fltr: str or None = None, **attributes):
+    """
+    :param tracer: `Tracer`, `OpenTelemetryTracer` or None (tracing disabled).
+    :param name: Name of the operation.
+    :param fltr: Filter body, added to the attributes as `copernicus.filter_hash`.
+    :param attributes: Attributes of the span.
+    :return: A span to be used in a `with` statement.
+    """
+    if tracer is None:
+        return _NOOP
+    if fltr is not None:
+        attributes['copernicus.filter_hash'] = filter_hash(fltr)
+    return tracer.span(name, **attributes)
+
+
+def scope(tracer, name: str, fltr: str or None = None, **attributes):
+    """
+    Same as `span()`, but the span is not entered in the caller's context. Functions passed to its `run()` method are
+    its children, and it ends with `close()`.
+    """
+    if tracer is None:
+        return _NOOP
+    return _Scope(span(tracer, name, fltr, **attributes))
@@ -0,0 +1,135 @@
+import json
+import threading
+import requests
+from requests.models import Response
+
+from .errors import RequestNotRecorded
+from .singleflight import SingleFlight
+
+
+def _response(url: str, status: int, content: bytes, reason: str = '') -> Response:
+    response = Response()
+    response.url = url
+    response.status_code = status
+    response.reason = reason
+    response.headers['Content-Type'] = 'application/json'
+    response._content = content
+    return response
+
+
+class RecordingSession:
+    """
+    Transport recording every request and its response into a cassette file (JSON lines), for `ReplaySession`. The
+    requests are sent with `session`.
+
+    Any object with the `get()` and `post()` methods of `requests.Session` can be used as a transport: set it as
+    `Query.session` or pass it to `Client(session=...)`.
+
+    Example usage:
+        query = Query()
+        query.session = RecordingSession('cassette.jsonl')
+        query.send()
+
+        query = Query()
+        query.session = ReplaySession('cassette.jsonl')
+        query.send()  # the same response, without network access
+    """
+
+    def __init__(self, path: str, session: requests.Session or None = None):
+        """
+        :param path: Path of the cassette file. Records are appended to it.
+        :param session: Session sending the requests. None - a new `requests.Session`.
+        """
+        self.path = path
+        self.session = requests.Session() if session is None else session
+        self.__lock = threading.Lock()
+
+    def __record(self, method: str, url: str, body, response: Response) -> Response:
+        record = {'method': method,
+                  'url': url,
+                  'body': body,
+                  'status': response.status_code,
+                  'reason': response.reason,
+                  'content': response.content.decode('utf-8', errors='replace')}
+        line = json.dumps(record)
+        with self.__lock:
+            with open(self.path, 'a') as file:
+                file.write(line + '\n')
+        return response
+
+    def get(self, url: str, timeout=None, **kwargs) -> Response:
+        return self.__record('GET', url, None, self.session.get(url, timeout=timeout, **kwargs))
+
+    def post(self, url: str, timeout=None, json=None, **kwargs) -> Response:
+        return self.__record('POST', url, json, self.session.post(url, timeout=timeout, json=json, **kwargs))
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class ReplaySession:
+    """
+    Transport answering requests from a cassette file written by `RecordingSession`. A request is matched by its
+    method, url and body; if it was recorded several times, the last response is served. `RequestNotRecorded` is
+    raised for any other request.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the cassette file.
+        """
+        self.path = path
+        self.__records = {}
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    key = SingleFlight.key(record['method'], record['url'], record['body'])
+                    self.__records[key] = record
+
+    def __replay(self, method: str, url: str, body) -> Response:
+        record = self.__records.get(SingleFlight.key(method, url, body))
+        if record is None:
+            raise RequestNotRecorded(f'{method} {url} is not recorded in {self.path}')
+        return _response(url, record['status'], record['content'].encode('utf-8'), record['reason'])
+
+    def get(self, url: str, timeout=None, **kwargs) -> Response:
+        return self.__replay('GET', url, None)
+
+    def post(self, url: str, timeout=None, json=None, **kwargs) -> Response:
+        return self.__replay('POST', url, json)
+
+    def close(self) -> None:
+        pass
+
+
+class CatalogueSession:
+    """
+    Transport answering requests in-process from a `standin.SyntheticCatalogue`, without a server. Requests to any
+    host are answered.
+
+    Example usage:
+        query = Query()
+        query.session = CatalogueSession(SyntheticCatalogue(size=100))
+        query.set_top(10)
+        query.send()
+    """
+
+    def __init__(self, catalogue):
+        """
+        :param catalogue: `standin.SyntheticCatalogue` instance.
+        """
+        self.catalogue = catalogue
+
+    def __answer(self, method: str, url: str, body) -> Response:
+        status, payload = self.catalogue.handle(method, url, body)
+        return _response(url, status, json.dumps(payload).encode())
+
+    def get(self, url: str, timeout=None, **kwargs) -> Response:
+        return self.__answer('GET', url, None)
+
+    def post(self, url: str, timeout=None, json=None, **kwargs) -> Response:
+        return self.__answer('POST', url, json)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,142 @@
+import gzip
+import json
+
+_SKIPPED_PROPERTIES = ('GeoFootprint', 'Footprint', 'Attributes')  # the geometry, its WKT, flattened attributes
+
+
+def feature(product: dict) -> dict:
+    """
+    Converts a product into a GeoJSON Feature. The geometry is the `GeoFootprint` of the product, the properties are
+    its fields (without the footprints and the '@odata...' annotations) and its expanded `Attributes` as
+    {attribute name: value}. Product fields take precedence over attributes of the same name.
+    :param product: Product dictionary.
+    :return: Feature dictionary.
+    """
+    properties = {name: value for name, value in product.items()
+                  if name not in _SKIPPED_PROPERTIES and not name.startswith('@')}
+    for attribute in product.get('Attributes') or ():
+        properties.setdefault(attribute['Name'], attribute.get('Value'))
+    return {'type': 'Feature', 'id': product.get('Id'), 'geometry': product.get('GeoFootprint'),
+            'properties': properties}
+
+
+class _Writer:
+    """
+    Base of the streaming writers: every item is encoded and written as soon as it is received, so the memory does not
+    grow with the number of items.
+    """
+    header = b''
+    separator = b''  # between the items
+    terminator = b''  # after every item
+    footer = b''
+
+    def __init__(self, file, compress: bool or None = None):
+        """
+        :param file: Path or binary file object. A file object is not closed by the writer.
+        :param compress: If True, the output is gzip compressed. None - compressed if the path ends with '.gz'.
+        """
+        if isinstance(file, str):
+            compress = file.endswith('.gz') if compress is None else compress
+            self.__file = gzip.open(file, 'wb') if compress else open(file, 'wb')
+            self.__closing = [self.__file]
+        else:
+            self.__file = gzip.GzipFile(fileobj=file, mode='wb') if compress else file
+            self.__closing = [self.__file] if compress else []
+        self.count = 0
+        self.__file.write(self.header)
+
+    def encode(self, item: dict) -> bytes:
+        return json.dumps(item, separators=(',', ':')).encode()
+
+    def write(self, product: dict) -> None:
+        """
+        Writes a product.
+        """
+        data = self.encode(product)
+        self.__file.write((self.separator + data if self.count else data) + self.terminator)
+        self.count += 1
+
+    def write_all(self, products) -> int:
+        """
+        Writes products of an iterable, i.e. `Query.products()`.
+        :return: Number of products written by the writer so far.
+        """
+        for product in products:
+            self.write(product)
+        return self.count
+
+    def close(self) -> None:
+        """
+        Completes the output.
+        """
+        if self.__file is None:
+            return
+        self.__file.write(self.footer)
+        for file in self.__closing:
+            file.close()
+        if not self.__closing:
+            self.__file.flush()
+        self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class JsonLinesWriter(_Writer):
+    """
+    Streaming writer of products as JSON lines, a product per line.
+
+    Example usage:
+        query = Query()
+        query.set_filter(f)
+        query.set_top(1000)
+        query.set_expand(attributes=True)
+
+        with JsonLinesWriter('products.jsonl.gz') as writer:
+            writer.write_all(query.products())
+    """
+    terminator = b'\n'
+
+
+class GeoJsonWriter(_Writer):
+    """
+    Streaming writer of products as a GeoJSON FeatureCollection, see `feature()`. Expand the `Attributes` of the query
+    to have them in the properties.
+
+    Example usage:
+        with GeoJsonWriter('products.geojson') as writer:
+            writer.write_all(query.products())
+    """
+    header = b'{"type":"FeatureCollection","features":[\n'
+    separator = b',\n'
+    footer = b'\n]}\n'
+
+    def encode(self, item: dict) -> bytes:
+        return super().encode(feature(item))
+
+
+def write_jsonl(products, file, compress: bool or None = None) -> int:
+    """
+    Writes products as JSON lines, see `JsonLinesWriter`.
+    :param products: Iterable of products, i.e. `Query.products()`.
+    :param file: Path or binary file object.
+    :param compress: If True, the output is gzip compressed. None - compressed if the path ends with '.gz'.
+    :return: Number of written products.
+    """
+    with JsonLinesWriter(file, compress) as writer:
+        return writer.write_all(products)
+
+
+def write_geojson(products, file, compress: bool or None = None) -> int:
+    """
+    Writes products as a GeoJSON FeatureCollection, see `GeoJsonWriter`.
+    :param products: Iterable of products, i.e. `Query.products()`.
+    :param file: Path or binary file object.
+    :param compress: If True, the output is gzip compressed. None - compressed if the path ends with '.gz'.
+    :return: Number of written products.
+    """
+    with GeoJsonWriter(file, compress) as writer:
+        return writer.write_all(products)
@@ -1,6 +1,13 @@
+import os
+import re
+import json
+import sqlite3
+import time
 import unittest
+import threading
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta
+from requests.models import Response
 
 import copernicus_odata_wrapper.errors as errors
 import copernicus_odata_wrapper.attributes as Atr
@@ -8,6 +15,31 @@ import copernicus_odata_wrapper.attributes as Atr
 from copernicus_odata_wrapper.query import Query
 from copernicus_odata_wrapper.filter import Filter
 from copernicus_odata_wrapper.errors import check_response_for_errors
+from copernicus_odata_wrapper.singleflight import SingleFlight
+from copernicus_odata_wrapper.client import Client, QuerySpec
+from copernicus_odata_wrapper.nodes import NodesCache, parse_nodes_url
+from copernicus_odata_wrapper.resolver import NameResolver
+from copernicus_odata_wrapper.fanout import fan_out
+from copernicus_odata_wrapper.deadline import Deadline
+from copernicus_odata_wrapper.hedging import Hedging
+from copernicus_odata_wrapper.breaker import CircuitBreaker, CircuitBreakers
+from copernicus_odata_wrapper.mirrors import Mirrors, EndpointPool
+from copernicus_odata_wrapper.metrics import MetricsRegistry
+from copernicus_odata_wrapper.tracing import Tracer, MemoryExporter, JsonLinesExporter, filter_hash
+from copernicus_odata_wrapper.transport import RecordingSession, ReplaySession, CatalogueSession
+from copernicus_odata_wrapper.standin import SyntheticCatalogue, StandInServer, compile_filter
+from copernicus_odata_wrapper.slowlog import SlowQueryLog, explain
+from copernicus_odata_wrapper.splitter import split_filter
+from copernicus_odata_wrapper.harvester import Harvester
+from copernicus_odata_wrapper.naming import parse_name, parse_names, group_by, latest_baseline
+from copernicus_odata_wrapper.diff import diff, diff_sorted, sort_products, read_snapshot
+from copernicus_odata_wrapper.planner import CountHistogram
+from copernicus_odata_wrapper.scheduler import RequestScheduler, PriorityClass, INTERACTIVE, BATCH
+from copernicus_odata_wrapper.pipeline import Pipeline, page_products
+from copernicus_odata_wrapper.footprints import Footprints
+from copernicus_odata_wrapper.store import ResultStore, ResultStoreWriter
+from copernicus_odata_wrapper.writers import GeoJsonWriter, write_jsonl, write_geojson
+from benchmarks.run import run as run_benchmarks, compare as compare_benchmarks
 
 my_country_is_banned = False
 proxy_ip_port = '103.66.10.101:8080'
@@ -21,6 +53,39 @@ if my_country_is_banned:
                        # 'https': f'https://{proxy_ip_port}'
                        }
 
+# Requests to the live catalogue are replayed from the cassette. Set `record_cassette` to True to record them again
+# (network access is required).
+record_cassette = False
+cassette = os.path.join(os.path.dirname(__file__), 'cassettes', 'catalogue.jsonl')
+transport = RecordingSession(cassette, session) if record_cassette else ReplaySession(cassette)
+
+
+class FakeSession:
+    """Offline stand-in for `requests.Session`: answers every request with `payload` and counts the calls."""
+
+    def __init__(self, payload=None, delay=0.0):
+        self.payload = {'value': []} if payload is None else payload
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __respond(self, method, url, json_body=None):
+        with self.lock:
+            self.calls.append((method, url, json_body))
+        time.sleep(self.delay)
+        response = Response()
+        response.status_code = 200
+        response.url = url
+        payload = self.payload(method, url, json_body) if callable(self.payload) else self.payload
+        response._content = json.dumps(payload).encode()
+        return response
+
+    def get(self, url, timeout=None, **kwargs):
+        return self.__respond('GET', url)
+
+    def post(self, url, timeout=None, json=None, **kwargs):
+        return self.__respond('POST', url, json)
+
 
 class TestErrors(unittest.TestCase):
     maxDiff = None
@@ -59,6 +124,7 @@ class TestQuery(unittest.TestCase):
         #                 'skip': None,
         #                 'count': None,
         #                 'expand': None,
+        #                 'select': None,
         #                 }
 
         query = Query()
@@ -159,6 +225,49 @@ class TestQuery(unittest.TestCase):
         query.set_expand(True, True)
         self.assertEqual(query._Query__merge_options(), rf'{endpoint}?$expand=Assets&$expand=Attributes')
 
+    def test_set_select(self):
+        query = Query()
+        query.set_select(['Id', 'Name', 'ContentDate', 'Name'])
+        self.assertEqual(query._Query__merge_options(), rf'{endpoint}?$select=Id,Name,ContentDate')
+
+        query.set_top(3)
+        query.set_expand(attributes=True)
+        self.assertEqual(query._Query__merge_options(), rf'{endpoint}?$top=3&$expand=Attributes&$select=Id,Name,ContentDate')
+
+        query.set_select(None)
+        self.assertEqual(query._Query__merge_options(), rf'{endpoint}?$top=3&$expand=Attributes')
+
+        with self.assertRaises(ValueError):
+            query.set_select(['Id', 'Footprints'])
+        with self.assertRaises(ValueError):
+            query.set_select('Id')
+        with self.assertRaises(ValueError):
+            query.set_select([])
+
+    def test_pages(self):
+        def payload(method, url, body):
+            skip = int(re.search(r'\$skip=(\d+)', url).group(1)) if '$skip=' in url else 0
+            page = {'value': [{'Id': str(i)} for i in range(skip, min(skip + 2, 5))]}
+            if skip + 2 < 5:
+                page['@odata.nextLink'] = f'{endpoint}?$top=2&$skip={skip + 2}'  # drops $select
+            if skip == 2:
+                page['@odata.nextLink'] = f'{endpoint}?$top=2&$skip=4&%24select=Id'  # keeps it, percent-encoded
+            return page
+
+        fake_session = FakeSession(payload=payload)
+        query = Query()
+        query.session = fake_session
+        query.set_top(2)
+        query.set_select(['Id'])
+
+        self.assertEqual([product['Id'] for product in query.products()], ['0', '1', '2', '3', '4'])
+        self.assertEqual([url for method, url, body in fake_session.calls], [
+            rf'{endpoint}?$top=2&$select=Id',
+            rf'{endpoint}?$top=2&$skip=2&$select=Id',
+            rf'{endpoint}?$top=2&$skip=4&%24select=Id',
+        ])
+        self.assertEqual(len(list(query.pages(max_pages=2))), 2)
+
     def test_clear(self):
         not_clear_query = Query()
         not_clear_query.set_top(3)
@@ -183,6 +292,7 @@ class TestQuery(unittest.TestCase):
         warnings.filterwarnings(action="ignore", message="unclosed", category=ResourceWarning)
 
         query = Query()
+        query.session = transport
         names = ["S1A_IW_GRDH_1SDV_20141031T161924_20141031T161949_003076_003856_634E.SAFE",
                  "S3B_SL_1_RBT____20190116T050535_20190116T050835_20190117T125958_0179_021_048_0000_LN2_O_NT_003.SEN3",
                  ]
@@ -227,6 +337,7 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(query.by_names(names), response)
 
         query = Query()
+        query.session = transport
         names = []
         result = query.by_names(names)
         response = {'@odata.context': '$metadata#Products', 'value': []}
@@ -235,7 +346,7 @@ class TestQuery(unittest.TestCase):
 
     def test_product_nodes(self):
         query = Query()
-        query.session = session
+        query.session = transport
 
         result = {"result":
             [
@@ -256,6 +367,1680 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(query.product_nodes(url), result)
 
 
+class TestSingleFlight(unittest.TestCase):
+
+    def test_do(self):
+        single_flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'value': 1}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(single_flight.do('key', work)))
+        leader.start()
+        started.wait(5)
+
+        followers = [threading.Thread(target=lambda: results.append(single_flight.do('key', work))) for _ in range(5)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'value': 1}] * 6)
+        self.assertEqual(single_flight.in_flight(), 0)
+
+        # not a cache: a finished call is repeated
+        single_flight.do('key', work)
+        self.assertEqual(len(calls), 2)
+
+    def test_do_error(self):
+        single_flight = SingleFlight()
+
+        def fail():
+            raise errors.NotFound
+
+        with self.assertRaises(errors.NotFound):
+            single_flight.do('key', fail)
+        self.assertEqual(single_flight.in_flight(), 0)
+
+    def test_key(self):
+        self.assertEqual(SingleFlight.key('POST', 'url', {'b': 1, 'a': 2}),
+                         SingleFlight.key('POST', 'url', {'a': 2, 'b': 1}))
+        self.assertNotEqual(SingleFlight.key('GET', 'url'), SingleFlight.key('POST', 'url'))
+
+    def test_query(self):
+        fake_session = FakeSession(delay=0.2)
+        single_flight = SingleFlight()
+
+        def search():
+            query = Query()
+            query.session = fake_session
+            query.single_flight = single_flight
+            query.set_top(5)
+            query.send()
+
+        threads = [threading.Thread(target=search) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(fake_session.calls), 1)
+
+
+class TestClient(unittest.TestCase):
+    maxDiff = None
+
+    def test_spec(self):
+        query = Query()
+        f = Filter()
+        f.by_name('1')
+        query.set_filter(f)
+        query.set_top(3)
+        spec = query.spec()
+
+        self.assertEqual(spec, QuerySpec(filter="Name eq '1'", top='3'))
+        self.assertEqual(spec.url(endpoint), query._Query__merge_options())
+
+        # the spec does not follow later changes of the query or the filter
+        f.Or()
+        query.set_top(4)
+        self.assertEqual(spec.top, '3')
+        self.assertEqual(spec.filter, "Name eq '1'")
+
+        with self.assertRaises(AttributeError):
+            spec.top = '5'
+
+        self.assertEqual(spec.replace(skip='3').url(endpoint), rf"{endpoint}?$filter=Name eq '1'&$top=3&$skip=3")
+        self.assertEqual(QuerySpec().url(endpoint), rf'{endpoint}?')
+
+    def test_sessions(self):
+        client = Client()
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(client.session())) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(set(map(id, sessions))), 3)
+        self.assertIs(client.session(), client.session())
+        client.close()
+
+    def test_execute(self):
+        fake_session = FakeSession(payload=lambda method, url, body: {'url': url})
+        client = Client(session=fake_session)
+        specs = [QuerySpec(top='10', skip=str(skip)) for skip in range(0, 200, 10)]
+
+        results = {}
+        threads = [threading.Thread(target=lambda spec=spec: results.update({spec: client.execute(spec)}))
+                   for spec in specs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        for spec in specs:
+            self.assertEqual(results[spec], {'url': spec.url(endpoint)})
+
+    def test_query_facade(self):
+        fake_session = FakeSession()
+        client = Client(session=fake_session)
+
+        query = Query(client)
+        query.set_top(1)
+        query.send()
+        query.by_names(['name.SAFE'])
+        query.product_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8')
+
+        self.assertEqual(fake_session.calls, [
+            ('GET', rf'{endpoint}?$top=1', None),
+            ('POST', rf'{endpoint}/OData.CSC.FilterList', {'FilterProducts': [{'Name': 'name.SAFE'}]}),
+            ('GET', rf'{endpoint}(db0c8ef3-8ec0-5185-a537-812dad3c58f8)/Nodes', None),
+        ])
+
+    def test_query_client(self):
+        with Query() as query:
+            query.session = FakeSession()
+            query.hedging = Hedging(initial_delay=5.0)
+            query.send()
+            client = query._Query__client()
+            query.set_top(5)
+            query.url_limit = None
+            query.send()
+            self.assertIs(query._Query__client(), client)
+            self.assertIsNotNone(client._Client__hedging_executor)
+
+            query.timeout = 10
+            self.assertIsNot(query._Query__client(), client)
+            self.assertIsNone(client._Client__hedging_executor)  # the replaced client is closed
+            client = query._Query__client()
+            query.send()
+        self.assertIsNone(client._Client__hedging_executor)
+
+
+def nodes_tree_payload(tree, product='db0c8ef3-8ec0-5185-a537-812dad3c58f8'):
+    """Serves Nodes listings of a nested dict `tree` ({name: subtree or None for files}) from a `FakeSession`."""
+    zipper = 'https://zipper.dataspace.copernicus.eu/odata/v1/Products'
+
+    def payload(method, url, body):
+        names = re.findall(r'/Nodes\(([^)]*)\)', url)
+        subtree = tree
+        for name in names:
+            subtree = subtree[name]
+
+        uri = f'{zipper}({product})' + ''.join(f'/Nodes({name})' for name in names)
+        return {'result': [{'Id': name, 'Name': name, 'ContentLength': 0,
+                            'ChildrenNumber': len(children) if children else 0,
+                            'Nodes': {'uri': f'{uri}/Nodes({name})/Nodes'}}
+                           for name, children in subtree.items()]}
+
+    return payload
+
+
+class TestNodes(unittest.TestCase):
+    maxDiff = None
+
+    tree = {'S2A.SAFE': {'AUX_DATA': {},
+                         'GRANULE': {'L1C_T42FXL': {'IMG_DATA': {'B01.jp2': None, 'B02.jp2': None},
+                                                    'QI_DATA': {'MSK_CLOUDS.gml': None}}},
+                         'HTML': {'banner.png': None},
+                         'MTD_MSIL1C.xml': None}}
+
+    def test_walk_nodes(self):
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        query = Query()
+        query.session = fake_session
+
+        paths = [path for path, node in query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8')]
+        self.assertEqual(sorted(paths), sorted([
+            'S2A.SAFE', 'S2A.SAFE/AUX_DATA', 'S2A.SAFE/GRANULE', 'S2A.SAFE/HTML', 'S2A.SAFE/MTD_MSIL1C.xml',
+            'S2A.SAFE/GRANULE/L1C_T42FXL', 'S2A.SAFE/HTML/banner.png',
+            'S2A.SAFE/GRANULE/L1C_T42FXL/IMG_DATA', 'S2A.SAFE/GRANULE/L1C_T42FXL/QI_DATA',
+            'S2A.SAFE/GRANULE/L1C_T42FXL/IMG_DATA/B01.jp2', 'S2A.SAFE/GRANULE/L1C_T42FXL/IMG_DATA/B02.jp2',
+            'S2A.SAFE/GRANULE/L1C_T42FXL/QI_DATA/MSK_CLOUDS.gml',
+        ]))
+        # breadth-first: a node is never yielded before a shallower one
+        depths = [path.count('/') for path in paths]
+        self.assertEqual(depths, sorted(depths))
+        # folders with children only
+        self.assertEqual(len(fake_session.calls), 7)
+
+    def test_walk_nodes_include_prune(self):
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        query = Query()
+        query.session = fake_session
+
+        paths = [path for path, node in query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8',
+                                                         include='*.jp2', prune=['HTML', 'QI_DATA'])]
+        self.assertEqual(sorted(paths), ['S2A.SAFE/GRANULE/L1C_T42FXL/IMG_DATA/B01.jp2',
+                                         'S2A.SAFE/GRANULE/L1C_T42FXL/IMG_DATA/B02.jp2'])
+        self.assertEqual(len(fake_session.calls), 5)
+
+    def test_walk_nodes_max_depth(self):
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        query = Query()
+        query.session = fake_session
+
+        paths = [path for path, node in query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8', max_depth=2)]
+        self.assertEqual(sorted(paths), ['S2A.SAFE', 'S2A.SAFE/AUX_DATA', 'S2A.SAFE/GRANULE', 'S2A.SAFE/HTML',
+                                         'S2A.SAFE/MTD_MSIL1C.xml'])
+
+        with self.assertRaises(ValueError):
+            list(query.walk_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8', max_depth=0))
+
+
+    def test_parse_nodes_url(self):
+        zipper = 'https://zipper.dataspace.copernicus.eu/odata/v1/Products'
+        self.assertEqual(parse_nodes_url(rf'{endpoint}(db0c8ef3-8ec0-5185-a537-812dad3c58f8)/Nodes'),
+                         ('db0c8ef3-8ec0-5185-a537-812dad3c58f8', ''))
+        self.assertEqual(parse_nodes_url(rf'{zipper}(db0c8ef3-8ec0-5185-a537-812dad3c58f8)/Nodes(S2A.SAFE)/Nodes(AUX_DATA)/Nodes'),
+                         ('db0c8ef3-8ec0-5185-a537-812dad3c58f8', 'S2A.SAFE/AUX_DATA'))
+        with self.assertRaises(ValueError):
+            parse_nodes_url(rf'{endpoint}?$top=1')
+
+    def test_nodes_cache(self):
+        uuid = 'db0c8ef3-8ec0-5185-a537-812dad3c58f8'
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        cache = NodesCache(prefetch=False)
+        query = Query()
+        query.session = fake_session
+        query.nodes_cache = cache
+
+        listing = query.product_nodes(uuid)
+        self.assertEqual(query.product_nodes(uuid), listing)
+        self.assertEqual(len(fake_session.calls), 1)
+
+        paths = [path for path, node in query.walk_nodes(uuid)]
+        self.assertEqual(len(fake_session.calls), 7)
+        self.assertEqual(sorted(path for path, node in query.walk_nodes(uuid)), sorted(paths))
+        self.assertEqual(len(fake_session.calls), 7)
+
+        self.assertEqual(len(cache.load(uuid)), 7)
+        self.assertEqual(query.product_nodes(uuid), listing)
+
+        # listings cached before the first validation are of an unknown modification date
+        self.assertFalse(cache.validate(uuid, '2019-01-17T14:21:35.996Z'))
+        self.assertEqual(cache.load(uuid), {})
+        query.product_nodes(uuid)
+        self.assertEqual(len(fake_session.calls), 8)
+
+        # then listings are dropped only when the modification date changes
+        self.assertTrue(cache.validate(uuid, '2019-01-17T14:21:35.996Z'))
+        self.assertEqual(query.product_nodes(uuid), listing)
+        self.assertEqual(len(fake_session.calls), 8)
+        self.assertEqual(cache.validate_products([{'Id': uuid, 'ModificationDate': '2020-01-01T00:00:00.000Z'}]), 1)
+        self.assertEqual(cache.load(uuid), {})
+        query.product_nodes(uuid)
+        self.assertEqual(len(fake_session.calls), 9)
+        self.assertTrue(cache.validate(uuid, '2020-01-01T00:00:00.000Z'))
+
+        # a product validated before its listings are cached keeps them
+        other = '0c43a0b7-4c3f-5c9a-8e2b-6c9e5e0a1f2d'
+        self.assertTrue(cache.validate(other, '2019-01-17T14:21:35.996Z'))
+        cache.put(Client().nodes_url(other), listing)
+        self.assertTrue(cache.validate(other, '2019-01-17T14:21:35.996Z'))
+        self.assertEqual(len(cache.load(other)), 1)
+
+    def test_nodes_cache_max_age(self):
+        uuid = 'db0c8ef3-8ec0-5185-a537-812dad3c58f8'
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        cache = NodesCache(prefetch=False, max_age=0.2)
+        client = Client(session=fake_session, nodes_cache=cache)
+
+        listing = client.product_nodes(uuid)
+        self.assertEqual(client.product_nodes(uuid), listing)
+        self.assertEqual(len(cache.load(uuid)), 1)
+        self.assertEqual(len(fake_session.calls), 1)
+
+        time.sleep(0.3)
+        self.assertEqual(cache.load(uuid), {})
+        self.assertEqual(client.product_nodes(uuid), listing)
+        self.assertEqual(len(fake_session.calls), 2)
+        self.assertEqual(client.product_nodes(uuid), listing)
+        self.assertEqual(len(fake_session.calls), 2)
+
+    def test_nodes_cache_prefetch(self):
+        uuid = 'db0c8ef3-8ec0-5185-a537-812dad3c58f8'
+        fake_session = FakeSession(payload=nodes_tree_payload(self.tree))
+        client = Client(session=fake_session, nodes_cache=NodesCache())
+
+        safe = client.product_nodes(uuid)['result'][0]
+        client.close()  # waits for the prefetching
+        self.assertEqual(len(fake_session.calls), 2)  # root and the prefetched S2A.SAFE
+
+        listing = client.product_nodes(safe['Nodes']['uri'])
+        self.assertEqual(len(fake_session.calls), 2)
+
+        for node in listing['result']:
+            if node['ChildrenNumber']:
+                client.product_nodes(node['Nodes']['uri'])
+        client.close()
+        self.assertEqual(len(fake_session.calls), 5)  # GRANULE, HTML and the prefetched GRANULE/L1C_T42FXL
+        client.product_nodes(f"{listing['result'][1]['Nodes']['uri'][:-len('/Nodes')]}/Nodes(L1C_T42FXL)/Nodes")
+        self.assertEqual(len(fake_session.calls), 5)
+
+
+def filter_list_payload(method, url, body):
+    """`FakeSession` payload of a FilterList request: only the names starting with 'S1' are found."""
+    return {'@odata.context': '$metadata#Products',
+            'value': [{'Id': f"id-{item['Name']}", 'Name': item['Name'], 'S3Path': f"/eodata/{item['Name']}"}
+                      for item in body['FilterProducts'] if item['Name'].startswith('S1')]}
+
+
+class TestResolver(unittest.TestCase):
+
+    def test_resolve(self):
+        fake_session = FakeSession(payload=filter_list_payload)
+        resolver = NameResolver(Client(session=fake_session), chunk_size=2)
+
+        names = ['S1_a.SAFE', 'S2_b.SAFE', 'S1_c.SAFE', 'S1_a.SAFE', 'S3_d.SEN3']
+        expected = {'S1_a.SAFE': {'Id': 'id-S1_a.SAFE', 'S3Path': '/eodata/S1_a.SAFE'},
+                    'S2_b.SAFE': None,
+                    'S1_c.SAFE': {'Id': 'id-S1_c.SAFE', 'S3Path': '/eodata/S1_c.SAFE'},
+                    'S3_d.SEN3': None}
+        self.assertEqual(resolver.resolve(names), expected)
+        self.assertEqual(len(fake_session.calls), 2)  # 4 unique names in chunks of 2
+
+        # found and missing names are not requested again
+        self.assertEqual(resolver.resolve(names), expected)
+        self.assertEqual(len(fake_session.calls), 2)
+
+        self.assertEqual(resolver.resolve_one('S1_e.SAFE'), {'Id': 'id-S1_e.SAFE', 'S3Path': '/eodata/S1_e.SAFE'})
+        self.assertEqual(fake_session.calls[-1][2], {'FilterProducts': [{'Name': 'S1_e.SAFE'}]})
+
+        resolver.forget(['S1_a.SAFE'])
+        resolver.resolve(names)
+        self.assertEqual(fake_session.calls[-1][2], {'FilterProducts': [{'Name': 'S1_a.SAFE'}]})
+
+    def test_query(self):
+        fake_session = FakeSession(payload=filter_list_payload)
+        query = Query()
+        query.session = fake_session
+        resolver = NameResolver(query, chunk_size=1, max_workers=4)
+
+        threads = set()
+        by_names = query.by_names
+
+        def record(names):
+            threads.add(threading.get_ident())
+            return by_names(names)
+
+        query.by_names = record
+        self.assertEqual(resolver.resolve(['S1_a.SAFE', 'S1_b.SAFE', 'S2_c.SAFE'])['S1_b.SAFE'],
+                         {'Id': 'id-S1_b.SAFE', 'S3Path': '/eodata/S1_b.SAFE'})
+        self.assertEqual(threads, {threading.get_ident()})  # a query is not shared between threads
+        self.assertEqual(len(fake_session.calls), 3)
+        query.close()
+
+    def test_negative_ttl(self):
+        fake_session = FakeSession(payload=filter_list_payload)
+        resolver = NameResolver(Client(session=fake_session), negative_ttl=0)
+
+        self.assertEqual(resolver.resolve(['S2_b.SAFE']), {'S2_b.SAFE': None})
+        self.assertEqual(resolver.resolve(['S2_b.SAFE']), {'S2_b.SAFE': None})
+        self.assertEqual(len(fake_session.calls), 2)
+
+    def test_product_not_found(self):
+        fake_session = FakeSession(payload={'detail': 'Product not found in catalogue'})
+        resolver = NameResolver(Client(session=fake_session))
+
+        self.assertEqual(resolver.resolve(['S1_a.SAFE']), {'S1_a.SAFE': None})
+        self.assertEqual(resolver.resolve(['S1_a.SAFE']), {'S1_a.SAFE': None})
+        self.assertEqual(len(fake_session.calls), 1)
+
+
+class TestFanOut(unittest.TestCase):
+    maxDiff = None
+
+    dates = {'SENTINEL-1': ['2023-07-01T01:00:00.000Z', '2023-07-01T04:00:00.000Z', '2023-07-01T05:00:00.000Z'],
+             'SENTINEL-2': ['2023-07-01T02:00:00.000Z', '2023-07-01T03:00:00.000Z'],
+             'SENTINEL-3': []}
+
+    def payload(self, method, url, body):
+        collection = re.search(r"Collection/Name eq '([^']+)'", url).group(1)
+        skip = int(re.search(r'\$skip=(\d+)', url).group(1)) if '$skip=' in url else 0
+        dates = self.dates[collection]
+        if 'desc' in url:
+            dates = dates[::-1]
+        page = {'value': [{'Name': f'{collection}_{date}', 'ContentDate': {'Start': date}}
+                          for date in dates[skip:skip + 2]]}
+        if skip + 2 < len(dates):
+            page['@odata.nextLink'] = f"{url.split('&$skip=')[0]}&$skip={skip + 2}"
+        return page
+
+    def test_fan_out(self):
+        fake_session = FakeSession(payload=self.payload)
+        query = Query()
+        query.session = fake_session
+        f = Filter()
+        f.contains('MSI')
+        query.set_filter(f)
+        query.set_top(2)
+        query.set_orderby('ContentDate/Start', ascending=True)
+
+        names = [product['Name'] for product in query.fan_out(['SENTINEL-1', 'SENTINEL-2', 'SENTINEL-3'])]
+        self.assertEqual(names, ['SENTINEL-1_2023-07-01T01:00:00.000Z', 'SENTINEL-2_2023-07-01T02:00:00.000Z',
+                                 'SENTINEL-2_2023-07-01T03:00:00.000Z', 'SENTINEL-1_2023-07-01T04:00:00.000Z',
+                                 'SENTINEL-1_2023-07-01T05:00:00.000Z'])
+        self.assertIn((rf"{endpoint}?$filter=(contains(Name,'MSI')) and Collection/Name eq 'SENTINEL-3'"
+                       rf"&$orderby=ContentDate/Start asc&$top=2"),
+                      [url for method, url, body in fake_session.calls])
+
+        query.set_orderby('ContentDate/Start', ascending=False)
+        dates = [product['ContentDate']['Start'] for product in query.fan_out(['SENTINEL-1', 'SENTINEL-2'])]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(dates), 5)
+
+    def test_fan_out_errors(self):
+        client = Client(session=FakeSession(payload={'detail': 'Not Found'}))
+        # invalid arguments are reported by the call, before the generator is iterated
+        with self.assertRaises(ValueError):
+            fan_out(client, QuerySpec(), ['SENTINEL-1'])
+        with self.assertRaises(ValueError):
+            client.fan_out(QuerySpec(orderby='ContentDate/Start asc', select='Id'), ['SENTINEL-1'])
+        with self.assertRaises(ValueError):
+            Query().fan_out(['SENTINEL-1'])
+        with self.assertRaises(errors.NotFound):
+            list(fan_out(client, QuerySpec(orderby='ContentDate/Start asc'), ['SENTINEL-1', 'SENTINEL-2']))
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_deadline(self):
+        deadline = Deadline(5)
+        self.assertFalse(deadline.expired())
+        self.assertTrue(4 < deadline.remaining() <= 5)
+        connect, read = deadline.clip((30, 1))
+        self.assertTrue(4 < connect <= 5)
+        self.assertEqual(read, 1)
+        self.assertLessEqual(deadline.clip(30), 5)
+        deadline.check()
+
+        with self.assertRaises(ValueError):
+            Deadline(0)
+
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+        self.assertEqual(deadline.remaining(), 0)
+        with self.assertRaises(errors.DeadlineExceeded):
+            deadline.check()
+
+    def test_query_deadline(self):
+        def payload(method, url, body):
+            return {'value': [{}], '@odata.nextLink': f'{endpoint}?$skip=1'}
+
+        query = Query()
+        query.session = FakeSession(payload=payload, delay=0.05)
+        query.deadline = 0.2
+
+        pages = 0
+        with self.assertRaises(errors.DeadlineExceeded):
+            for _ in query.pages():
+                pages += 1
+        self.assertTrue(2 <= pages <= 4)
+
+        # each call gets its own budget
+        query.send()
+
+    def test_single_flight_deadline(self):
+        single_flight = SingleFlight()
+        client = Client(session=FakeSession(delay=0.5), single_flight=single_flight)
+        leader = threading.Thread(target=client.execute, args=(QuerySpec(),))
+        leader.start()
+        time.sleep(0.05)
+
+        with self.assertRaises(errors.DeadlineExceeded):
+            client.execute(QuerySpec(), deadline=Deadline(0.1))
+        leader.join(5)
+
+    def test_single_flight_leader_deadline(self):
+        # the leader runs out of its deadline, the followers retry within their own
+        session = FakeSession(delay=0.3)
+        client = Client(session=session, single_flight=SingleFlight(), hedging=Hedging(initial_delay=5.0))
+        errors_raised = []
+
+        def lead():
+            try:
+                client.execute(QuerySpec(), deadline=Deadline(0.1))
+            except errors.DeadlineExceeded as error:
+                errors_raised.append(error)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        time.sleep(0.05)
+        self.assertEqual(client.execute(QuerySpec()), {'value': []})
+        self.assertEqual(client.execute(QuerySpec(), deadline=Deadline(5)), {'value': []})
+        leader.join(5)
+        self.assertEqual(len(errors_raised), 1)
+        client.close()
+
+        def payload(method, url, body):
+            raise TimeoutError('read timed out')
+
+        client = Client(session=FakeSession(payload=payload), single_flight=SingleFlight())
+        with self.assertRaises(TimeoutError) as raised:
+            client.execute(QuerySpec())
+        self.assertNotIsInstance(raised.exception, errors.DeadlineExceeded)
+        with self.assertRaises(TimeoutError) as raised:
+            client.execute(QuerySpec(), deadline=Deadline(5))
+        self.assertNotIsInstance(raised.exception, errors.DeadlineExceeded)
+
+
+class TestHedging(unittest.TestCase):
+
+    def test_delay(self):
+        hedging = Hedging(percentile=90, min_samples=10, initial_delay=3.0)
+        self.assertEqual(hedging.delay(), 3.0)
+        for latency in range(1, 101):
+            hedging.record(latency / 100)
+        self.assertEqual(hedging.delay(), 0.91)
+
+        with self.assertRaises(ValueError):
+            Hedging(percentile=0)
+
+    def test_hedged_request(self):
+        calls = []
+
+        def payload(method, url, body):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(1.0)  # the first attempt stalls
+                return {'value': ['slow']}
+            return {'value': ['fast']}
+
+        hedging = Hedging(initial_delay=0.05)
+        client = Client(session=FakeSession(payload=payload), hedging=hedging)
+
+        started = time.monotonic()
+        self.assertEqual(client.execute(QuerySpec()), {'value': ['fast']})
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(hedging.hedged, 1)
+        self.assertEqual(len(calls), 2)
+
+        # fast requests are not duplicated
+        client.execute(QuerySpec())
+        self.assertEqual(hedging.hedged, 1)
+        client.close()
+
+
+class TestBreaker(unittest.TestCase):
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(min_calls=4, error_rate=0.5, open_for=0.1)
+        for failed in [False, True, False]:
+            breaker.acquire()
+            breaker.record(failed, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        breaker.acquire()
+        breaker.record(True, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(errors.CircuitOpen):
+            breaker.acquire()
+
+        time.sleep(0.15)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.acquire()
+        with self.assertRaises(errors.CircuitOpen):
+            breaker.acquire()  # a single trial request at a time
+        breaker.record(True, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.15)
+        breaker.acquire()
+        breaker.record(False, 0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.snapshot(), {'state': 'closed', 'calls': 0, 'error_rate': 0.0, 'mean_latency': 0.0})
+
+    def test_slow_call(self):
+        breaker = CircuitBreaker(min_calls=1, slow_call=1.0)
+        breaker.acquire()
+        breaker.record(False, 2.0)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_client(self):
+        def payload(method, url, body):
+            if 'zipper' not in url:
+                raise requests.ConnectionError('Connection refused')
+            return {'result': []}
+
+        fake_session = FakeSession(payload=payload)
+        breakers = CircuitBreakers(min_calls=2)
+        query = Query()
+        query.session = fake_session
+        query.breakers = breakers
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                query.send()
+        with self.assertRaises(errors.CircuitOpen):
+            query.send()
+        self.assertEqual(len(fake_session.calls), 2)
+
+        # other hosts are not affected
+        query.product_nodes('https://zipper.dataspace.copernicus.eu/odata/v1/Products(id)/Nodes(name)/Nodes')
+        self.assertEqual(breakers.state(endpoint), 'open')
+        self.assertEqual(breakers.state('zipper.dataspace.copernicus.eu'), 'closed')
+        self.assertEqual(breakers.snapshot()['catalogue.dataspace.copernicus.eu']['error_rate'], 1.0)
+
+        # API errors do not open the circuit
+        breakers = CircuitBreakers(min_calls=1)
+        query.breakers = breakers
+        query.session = FakeSession(payload={'detail': 'Not Found'})
+        for _ in range(3):
+            with self.assertRaises(errors.NotFound):
+                query.send()
+        self.assertEqual(breakers.state(endpoint), 'closed')
+
+
+class TestMirrors(unittest.TestCase):
+    mirror = 'https://mirror.example.com/odata/v1/Products'
+
+    def test_endpoint_pool(self):
+        pool = EndpointPool([endpoint, self.mirror])
+        self.assertEqual(pool.match(rf'{self.mirror}?$top=1'), '?$top=1')
+        self.assertIsNone(pool.match('https://zipper.dataspace.copernicus.eu/odata/v1/Products(id)/Nodes'))
+
+        pool.record(endpoint, False, 0.5)
+        self.assertEqual(pool.candidates(), [self.mirror, endpoint])  # not measured yet
+        pool.record(self.mirror, False, 0.1)
+        self.assertEqual(pool.candidates(), [self.mirror, endpoint])
+        for _ in range(3):
+            pool.record(self.mirror, True, 0.1)
+        self.assertEqual(pool.candidates(), [endpoint, self.mirror])
+        self.assertEqual(list(pool.snapshot()), [endpoint, self.mirror])
+
+        with self.assertRaises(ValueError):
+            EndpointPool([])
+
+    def test_failover(self):
+        def payload(method, url, body):
+            if url.startswith(endpoint):
+                raise requests.ConnectionError('Connection refused')
+            return {'value': [url]}
+
+        fake_session = FakeSession(payload=payload)
+        mirrors = Mirrors(catalogue=[endpoint, self.mirror])
+        query = Query()
+        query.session = fake_session
+        query.mirrors = mirrors
+        query.set_top(1)
+
+        self.assertEqual(query.send(), {'value': [rf'{self.mirror}?$top=1']})
+        self.assertEqual(query.send(), {'value': [rf'{self.mirror}?$top=1']})
+        # the failed endpoint is not tried again while the mirror is healthy
+        self.assertEqual([url for method, url, body in fake_session.calls],
+                         [rf'{endpoint}?$top=1', rf'{self.mirror}?$top=1', rf'{self.mirror}?$top=1'])
+
+        query.by_names(['name.SAFE'])
+        self.assertEqual(fake_session.calls[-1][1], rf'{self.mirror}/OData.CSC.FilterList')
+
+        # urls of other endpoints are sent as they are
+        with self.assertRaises(requests.ConnectionError):
+            Query(Client(session=fake_session, mirrors=Mirrors(catalogue=[endpoint]))).send()
+
+    def test_server_error(self):
+        def respond(method, url, body):
+            response = Response()
+            response.status_code = 503 if url.startswith(endpoint) else 200
+            response._content = b'<html>Service Unavailable</html>' if url.startswith(endpoint) else b'{"value": []}'
+            return response
+
+        class Session(FakeSession):
+            def get(self, url, timeout=None, **kwargs):
+                return respond('GET', url, None)
+
+        client = Client(session=Session(), mirrors=Mirrors(catalogue=[endpoint, self.mirror]))
+        self.assertEqual(client.execute(QuerySpec()), {'value': []})
+
+        with self.assertRaises(errors.ServerError):
+            Client(session=Session()).execute(QuerySpec())
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_registry(self):
+        metrics = MetricsRegistry(buckets={'latency_seconds': [1.0, 0.1]})
+        metrics.increment('requests_total', status=200)
+        metrics.increment('requests_total', 2, status='200')
+        self.assertEqual(metrics.counter('requests_total', status=200), 3)
+        self.assertEqual(metrics.counter('requests_total', status=500), 0)
+
+        for value in (0.05, 0.5, 5.0):
+            metrics.observe('latency_seconds', value)
+        histogram = metrics.histogram('latency_seconds')
+        self.assertEqual(histogram['count'], 3)
+        self.assertAlmostEqual(histogram['sum'], 5.55)
+        self.assertEqual(histogram['buckets'], {0.1: 1, 1.0: 2, float('inf'): 3})
+
+        self.assertEqual(metrics.to_prometheus(),
+                         '# TYPE requests_total counter\n'
+                         'requests_total{status="200"} 3\n'
+                         '# TYPE latency_seconds histogram\n'
+                         'latency_seconds_bucket{le="0.1"} 1\n'
+                         'latency_seconds_bucket{le="1.0"} 2\n'
+                         'latency_seconds_bucket{le="+Inf"} 3\n'
+                         'latency_seconds_sum 5.55\n'
+                         'latency_seconds_count 3\n')
+
+        metrics.clear()
+        self.assertEqual(metrics.histogram('latency_seconds')['count'], 0)
+
+    def test_query_metrics(self):
+        metrics = MetricsRegistry()
+        query = Query()
+        query.session = FakeSession(payload={'value': [{'Name': 'a'}, {'Name': 'b'}]})
+        query.metrics = metrics
+        query.send()
+        query.send()
+
+        host = 'catalogue.dataspace.copernicus.eu'
+        self.assertEqual(metrics.counter('copernicus_requests_total', host=host, method='GET', status=200), 2)
+        self.assertEqual(metrics.counter('copernicus_products_total'), 4)
+        for phase in ('build', 'server', 'download', 'decode', 'check'):
+            self.assertEqual(metrics.histogram('copernicus_request_phase_seconds', phase=phase)['count'], 2)
+        self.assertEqual(metrics.histogram('copernicus_response_bytes', host=host)['count'], 2)
+
+        query.nodes_cache = NodesCache(prefetch=False)
+        query.session = FakeSession(payload={'result': []})
+        query.product_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8')
+        query.product_nodes('db0c8ef3-8ec0-5185-a537-812dad3c58f8')
+        self.assertEqual(metrics.counter('copernicus_cache_misses_total', cache='nodes'), 1)
+        self.assertEqual(metrics.counter('copernicus_cache_hits_total', cache='nodes'), 1)
+
+    def test_failed_requests(self):
+        def payload(method, url, body):
+            raise requests.ConnectionError('Connection refused')
+
+        metrics = MetricsRegistry()
+        client = Client(session=FakeSession(payload=payload), metrics=metrics)
+        with self.assertRaises(requests.ConnectionError):
+            client.execute(QuerySpec())
+        self.assertEqual(metrics.counter('copernicus_requests_total', host='catalogue.dataspace.copernicus.eu',
+                                         method='GET', status='error'), 1)
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_send(self):
+        exporter = MemoryExporter()
+        f = Filter()
+        f.by_name('S1A_IW_GRDH')
+
+        query = Query()
+        query.session = FakeSession()
+        query.tracer = Tracer(exporter)
+        query.set_filter(f)
+        query.send()
+
+        http, send = exporter.spans
+        self.assertEqual((send.name, send.parent_id, send.status), ('send', None, 'ok'))
+        self.assertEqual(send.attributes, {'copernicus.filter_hash': filter_hash(f.body)})
+        self.assertEqual((http.name, http.parent_id, http.trace_id), ('http', send.span_id, send.trace_id))
+        self.assertEqual(http.attributes['http.status_code'], 200)
+        self.assertGreaterEqual(send.end, http.end)
+
+    def test_pages(self):
+        def payload(method, url, body):
+            skip = int(re.search(r'\$skip=(\d+)', url).group(1)) if '$skip=' in url else 0
+            page = {'value': [{'Name': str(skip)}]}
+            if skip < 2:
+                page['@odata.nextLink'] = f'{endpoint}?$top=1&$skip={skip + 1}'
+            return page
+
+        exporter = MemoryExporter()
+        client = Client(session=FakeSession(payload=payload), tracer=Tracer(exporter))
+        self.assertEqual(len(list(client.pages(QuerySpec(top='1')))), 3)
+
+        spans = {span.span_id: span for span in exporter.spans}
+        pages = [span for span in exporter.spans if span.name == 'pages']
+        self.assertEqual(len(pages), 1)
+        page_spans = [span for span in exporter.spans if span.name == 'page']
+        self.assertEqual([span.attributes['copernicus.page'] for span in page_spans], [0, 1, 2])
+        self.assertTrue(all(span.parent_id == pages[0].span_id for span in page_spans))
+        for span in exporter.spans:
+            if span.name == 'http':
+                self.assertEqual(spans[span.parent_id].name, 'page')
+
+    def test_fan_out_and_errors(self):
+        def payload(method, url, body):
+            if 'SENTINEL-2' in url:
+                raise requests.ConnectionError('Connection refused')
+            return {'value': []}
+
+        exporter = MemoryExporter()
+        client = Client(session=FakeSession(payload=payload), tracer=Tracer(exporter))
+        spec = QuerySpec(orderby='ContentDate/Start asc')
+        with self.assertRaises(requests.ConnectionError):
+            list(client.fan_out(spec, ['SENTINEL-1', 'SENTINEL-2']))
+
+        fan_out_span = [span for span in exporter.spans if span.name == 'fan_out'][0]
+        self.assertEqual(fan_out_span.status, 'error')
+        self.assertEqual(fan_out_span.attributes['copernicus.collections'], ['SENTINEL-1', 'SENTINEL-2'])
+        pages = [span for span in exporter.spans if span.name == 'pages']
+        self.assertEqual(len(pages), 2)
+        self.assertTrue(all(span.parent_id == fan_out_span.span_id for span in pages))
+        self.assertEqual(sorted(span.status for span in pages), ['error', 'ok'])
+        failed = [span for span in exporter.spans if span.name == 'http' and span.status == 'error']
+        self.assertEqual(failed[0].attributes['error.type'], 'ConnectionError')
+
+    def test_json_lines(self):
+        import io
+        buffer = io.StringIO()
+        tracer = Tracer(JsonLinesExporter(buffer))
+        with tracer.span('outer', key='value'):
+            with tracer.span('inner'):
+                pass
+
+        inner, outer = [json.loads(line) for line in buffer.getvalue().splitlines()]
+        self.assertEqual(inner['parent_id'], outer['span_id'])
+        self.assertEqual(outer['attributes'], {'key': 'value'})
+        self.assertEqual(outer['status'], 'ok')
+
+
+class TestTransport(unittest.TestCase):
+
+    def test_record_and_replay(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.jsonl')
+            recorder = RecordingSession(path, FakeSession(payload=lambda method, url, body: {'value': [url, body]}))
+            client = Client(session=recorder)
+            client.execute(QuerySpec(top='1'))
+            client.by_names(['name.SAFE'])
+
+            client = Client(session=ReplaySession(path))
+            self.assertEqual(client.execute(QuerySpec(top='1')), {'value': [rf'{endpoint}?$top=1', None]})
+            self.assertEqual(client.by_names(['name.SAFE']),
+                             {'value': [rf'{endpoint}/OData.CSC.FilterList', {'FilterProducts': [{'Name': 'name.SAFE'}]}]})
+            with self.assertRaises(errors.RequestNotRecorded):
+                client.execute(QuerySpec(top='2'))
+
+
+class TestStandIn(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=300)
+
+    def query(self):
+        query = Query()
+        query.session = CatalogueSession(self.catalogue)
+        return query
+
+    def test_filter(self):
+        products = self.catalogue.products
+        f = Filter()
+        f.collection('SENTINEL-2')
+        f.And()
+        f.by_attribute([Atr.CloudCover() < 30.0, Atr.ProductType() == 'S2MSI2A'])
+        f.And()
+        f.by_sensing_date(datetime(2023, 1, 5), datetime(2023, 1, 20))
+        predicate = compile_filter(f.body)
+
+        def cloud_cover(product):
+            return [a['Value'] for a in product['Attributes'] if a['Name'] == 'cloudCover'][0]
+
+        expected = [p for p in products if p['Name'].startswith('S2') and 'MSIL2A' in p['Name']
+                    and cloud_cover(p) < 30.0 and '2023-01-05' <= p['ContentDate']['Start'] <= '2023-01-20']
+        self.assertTrue(expected)
+        self.assertEqual([p for p in products if predicate(p)], expected)
+
+        name = products[0]['Name']
+        f = Filter()
+        f.by_name(name), f.Or(), f.Not(), f.startswith('S')
+        self.assertEqual([p['Name'] for p in products if compile_filter(f.body)(p)], [name])
+
+        lon, lat = products[0]['GeoFootprint']['coordinates'][0][0]
+        f = Filter()
+        f.by_geographic_criteria(f'POINT({lon + 0.5} {lat + 0.5})')
+        self.assertIn(products[0], [p for p in products if compile_filter(f.body)(p)])
+
+        with self.assertRaises(ValueError):
+            compile_filter("Name eq 'x' and")
+        with self.assertRaises(errors.Unknown):
+            query = self.query()
+            f = Filter()
+            f.body = 'Name like 1'
+            query.set_filter(f)
+            query.send()
+
+    def test_pagination(self):
+        query = self.query()
+        query.set_top(70)
+        query.set_count(True)
+        query.set_orderby('ContentDate/Start', ascending=False)
+        query.set_select(['Id', 'ContentDate'])
+        pages = list(query.pages())
+
+        self.assertEqual([len(page['value']) for page in pages], [70, 70, 70, 70, 20])
+        self.assertEqual(pages[0]['@odata.count'], 300)
+        starts = [product['ContentDate']['Start'] for page in pages for product in page['value']]
+        self.assertEqual(starts, sorted(starts, reverse=True))
+        self.assertEqual(set(pages[0]['value'][0]), {'@odata.mediaContentType', 'Id', 'ContentDate'})
+
+    def test_server(self):
+        with StandInServer(self.catalogue) as server:
+            query = Query()
+            query.endpoint = server.endpoint
+            query.endpoint_zipper = server.endpoint
+            query.set_top(2)
+            query.set_expand(attributes=True)
+            products = query.send()['value']
+            self.assertEqual([p['Id'] for p in products], [p['Id'] for p in self.catalogue.products[:2]])
+            self.assertIn('Attributes', products[0])
+
+            names = [products[0]['Name'], 'missing.SAFE']
+            self.assertEqual([p['Name'] for p in query.by_names(names)['value']], names[:1])
+
+            nodes = dict(query.walk_nodes(products[0]['Id'], include='*.jp2'))
+            self.assertEqual(len(nodes), 12)
+            with self.assertRaises(errors.NotFound):
+                query.product_nodes('00000000-0000-0000-0000-000000000000')
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_compare(self):
+        baseline = {'results': {'latency_ms': {'value': 10.0, 'unit': 'ms', 'better': 'lower'},
+                                'products_per_s': {'value': 100.0, 'unit': 'products/s', 'better': 'higher'}}}
+        results = {'results': {'latency_ms': {'value': 11.5, 'unit': 'ms', 'better': 'lower'},
+                               'products_per_s': {'value': 70.0, 'unit': 'products/s', 'better': 'higher'},
+                               'new_ms': {'value': 1.0, 'unit': 'ms', 'better': 'lower'}}}
+
+        regressions = compare_benchmarks(results, baseline)
+        self.assertEqual([regression['name'] for regression in regressions], ['products_per_s'])
+        self.assertAlmostEqual(regressions[0]['change'], 0.3)
+
+        regressions = compare_benchmarks(results, baseline, {'products_per_s': 0.5}, default_threshold=0.1)
+        self.assertEqual([regression['name'] for regression in regressions], ['latency_ms'])
+
+    def test_run(self):
+        results = run_benchmarks(size=120, repeat=2)
+        self.assertEqual(results['meta']['size'], 120)
+        self.assertIn('send.top100.p50_ms', results['results'])
+        self.assertGreater(results['results']['pages.top10.products_per_s']['value'], 0)
+        self.assertEqual(compare_benchmarks(results, results), [])
+
+
+class TestSlowLog(unittest.TestCase):
+
+    def test_explain(self):
+        f = Filter()
+        f.by_geographic_criteria('POLYGON((69.0 61.0, 70.0 61.0, 70.0 60.0, 69.0 60.0, 69.0 61.0))')
+        f.Or()
+        f.by_geographic_criteria('POINT(69.0 61.0)')
+        f.And()
+        f.by_attribute([Atr.CloudCover() < 10.0, Atr.ProductType() == 'S2MSI2A'])
+        f.And()
+        f.contains("and or")
+
+        metrics = f.explain()
+        self.assertEqual(metrics['url_length'], len(requests.utils.requote_uri(f'{endpoint}?$filter={f.body}')))
+        self.assertEqual(metrics['filter_length'], len(f.body))
+        self.assertEqual(metrics['any_clauses'], 2)
+        self.assertEqual((metrics['polygons'], metrics['polygon_vertices']), (2, 6))
+        self.assertEqual((metrics['or_operators'], metrics['and_operators']), (1, 5))
+        self.assertEqual(explain(None)['url_length'], len(endpoint) + 1)
+
+    def test_slow_log(self):
+        slow_log = SlowQueryLog(threshold=0.05, max_entries=2)
+        f = Filter()
+        f.by_attribute([Atr.CloudCover() < 10.0])
+
+        query = Query()
+        query.session = FakeSession(payload={'value': [{}, {}, {}]}, delay=0.06)
+        query.slow_log = slow_log
+        query.set_filter(f)
+        query.send()
+        query.by_names(['name.SAFE'])
+        query.send()
+
+        entries = slow_log.entries()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['method'], 'POST')
+        self.assertIn('body_length', entries[0])
+        self.assertEqual((entries[1]['results'], entries[1]['any_clauses']), (3, 1))
+        self.assertGreaterEqual(entries[1]['latency'], 0.05)
+
+        slow_log.clear()
+        query.session = FakeSession()
+        query.send()
+        self.assertEqual(slow_log.entries(), [])
+
+
+class TestSplitter(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=200)
+
+    def test_split_filter(self):
+        def fits(body):
+            return len(body) <= 24
+
+        self.assertEqual(split_filter("a eq 1 or b eq 2 or c eq 3", fits), ['a eq 1 or b eq 2', 'c eq 3'])
+        self.assertEqual(split_filter("x eq 0 and (a eq 1 or b eq 2) and (c eq 3)", lambda body: len(body) <= 33),
+                         ['x eq 0 and (a eq 1) and (c eq 3)', 'x eq 0 and (b eq 2) and (c eq 3)'])
+        self.assertEqual(split_filter("contains(Name,' or x or ') or d eq 4", lambda body: len(body) <= 30),
+                         ["contains(Name,' or x or ')", 'd eq 4'])
+        self.assertIsNone(split_filter("a eq 1 and b eq 2 and c eq 3", fits))
+        self.assertIsNone(split_filter("a eq 1 or bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb eq 2", fits))
+
+    def query(self, session):
+        query = Query()
+        query.session = session
+        query.url_limit = 600
+        return query
+
+    def test_names(self):
+        session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        products = self.catalogue.products[:30]
+        f = Filter()
+        for i, product in enumerate(products):
+            if i:
+                f.Or()
+            f.by_name(product['Name'])
+
+        query = self.query(session)
+        query.set_filter(f)
+        query.set_top(25)
+        query.set_count(True)
+        query.set_orderby('ContentDate/Start', ascending=True)
+        response = query.send()
+
+        expected = sorted(products, key=lambda product: product['ContentDate']['Start'])[:25]
+        self.assertEqual([p['Id'] for p in response['value']], [p['Id'] for p in expected])
+        self.assertEqual(response['@odata.count'], 30)
+        self.assertTrue(all(method == 'POST' for method, url, body in session.calls))
+
+    def test_disjunction(self):
+        session = CatalogueSession(self.catalogue)
+        f = Filter()
+        f.collection('SENTINEL-2')
+        f.And()
+        f.body += ' (' + ' or '.join(f"contains(Name,'_R{orbit:03d}_')" for orbit in range(1, 60)) + ')'
+
+        query = self.query(None)
+        query.set_filter(f)
+        query.set_top(1000)
+        query.url_limit = None
+        query.session = session
+        expected = query.send()['value']
+        self.assertTrue(expected)
+
+        fake_session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        query.session = fake_session
+        query.url_limit = 600
+        response = query.send()
+        self.assertGreater(len(fake_session.calls), 1)
+        self.assertTrue(all(len(requests.utils.requote_uri(url)) <= 600 for method, url, body in fake_session.calls))
+        self.assertEqual(sorted(p['Id'] for p in response['value']), sorted(p['Id'] for p in expected))
+
+        query.set_top(5)
+        products = list(query.products())
+        self.assertEqual(sorted(p['Id'] for p in products), sorted(p['Id'] for p in expected))
+
+    def test_select(self):
+        f = Filter()
+        f.collection('SENTINEL-2')
+        f.And()
+        terms = [f"contains(Name,'_R{orbit:03d}_')" for orbit in range(1, 60)]
+        f.body += ' (' + ' or '.join(terms + terms[:10]) + ')'  # overlapping terms, results of sub-queries repeat
+
+        query = self.query(CatalogueSession(self.catalogue))
+        query.set_filter(f)
+        query.set_top(1000)
+        query.set_select(['ContentDate'])
+        query.url_limit = None
+        expected = query.send()['value']
+        self.assertGreater(len(expected), 1)
+
+        fake_session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        query.session = fake_session
+        query.url_limit = 600
+        response = query.send()
+        self.assertGreater(len(fake_session.calls), 1)
+        self.assertTrue(all('Id' in url for method, url, body in fake_session.calls))
+        key = lambda product: product['ContentDate']['Start']
+        self.assertEqual(sorted(response['value'], key=key), sorted(expected, key=key))
+        self.assertTrue(all(set(product) <= {'@odata.mediaContentType', 'ContentDate'}
+                            for product in response['value']))
+
+        query.set_top(7)
+        products = list(query.products())
+        self.assertEqual(sorted(products, key=key), sorted(expected, key=key))
+
+
+class TestHarvester(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=300)
+
+    def expected(self, collections):
+        return {product['Id'] for product in self.catalogue.products
+                if product['Collection']['Name'] in collections
+                and '2023-01-03' <= product['ContentDate']['Start'] < '2023-01-21'}
+
+    def test_run_and_resume(self):
+        import tempfile
+        collections = ['SENTINEL-1', 'SENTINEL-2']
+        with tempfile.TemporaryDirectory() as directory, StandInServer(self.catalogue) as server:
+            harvester = Harvester(directory, collections, datetime(2023, 1, 3), datetime(2023, 1, 21),
+                                  window=timedelta(days=5), top=7, endpoint=server.endpoint)
+            self.assertEqual(len(harvester.windows()), 8)
+            self.assertEqual(harvester.windows()[-1], ('SENTINEL-2', datetime(2023, 1, 18), datetime(2023, 1, 21)))
+
+            summary = harvester.run(processes=2)
+            self.assertEqual((summary['windows'], summary['skipped'], summary['failed']), (8, 0, []))
+            ids = [product['Id'] for product in harvester.products()]
+            self.assertEqual(len(ids), len(set(ids)))
+            self.assertEqual(set(ids), self.expected(collections))
+            self.assertEqual(summary['products'], len(ids))
+
+            # a crash in the middle of the last window: its products are not checkpointed
+            connection = sqlite3.connect(harvester.checkpoint)
+            shard, = connection.execute("SELECT shard FROM windows WHERE collection = 'SENTINEL-2' AND "
+                                        "start = ?", (datetime(2023, 1, 18).isoformat(),)).fetchone()
+            connection.execute("DELETE FROM windows WHERE collection = 'SENTINEL-2' AND start = ?",
+                               (datetime(2023, 1, 18).isoformat(),))
+            connection.commit()
+            connection.close()
+            with open(os.path.join(directory, shard), 'ab') as file:
+                file.write(b'{"Id": "partial"')
+
+            summary = harvester.run(processes=2)
+            self.assertEqual((summary['windows'], summary['skipped'], summary['failed']), (1, 7, []))
+            self.assertEqual(sorted(product['Id'] for product in harvester.products()), sorted(ids))
+
+            summary = harvester.run(processes=2)
+            self.assertEqual((summary['windows'], summary['skipped']), (0, 8))
+
+    def test_failed_window(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory, StandInServer(self.catalogue) as server:
+            harvester = Harvester(directory, ['SENTINEL-3'], datetime(2023, 1, 3), datetime(2023, 1, 21),
+                                  window=timedelta(days=9), fltr='Name eq', endpoint=server.endpoint)
+            summary = harvester.run(processes=1)
+            self.assertEqual(summary['windows'], 0)
+            self.assertEqual(len(summary['failed']), 2)
+            self.assertEqual(list(harvester.products()), [])
+
+
+    def test_plan(self):
+        import tempfile
+        from datetime import date
+        collections = ['SENTINEL-1', 'SENTINEL-2']
+        with tempfile.TemporaryDirectory() as directory, StandInServer(self.catalogue) as server:
+            client = Client()
+            client.endpoint = server.endpoint
+            histogram = CountHistogram(client)
+            histogram.refresh(collections, date(2023, 1, 3), date(2023, 1, 21))
+            plan = histogram.plan(collections, date(2023, 1, 3), date(2023, 1, 21), max_count=10)
+            client.close()
+
+            harvester = Harvester(directory, collections, datetime(2023, 1, 3), datetime(2023, 1, 21), top=7,
+                                  endpoint=server.endpoint, plan=plan)
+            self.assertEqual(harvester.windows(), plan)
+            summary = harvester.run(processes=1)
+            self.assertEqual((summary['windows'], summary['failed']), (len(plan), []))
+            self.assertEqual({product['Id'] for product in harvester.products()}, self.expected(collections))
+
+            with self.assertRaises(ValueError):
+                Harvester(directory, ['SENTINEL-1'], datetime(2023, 1, 3), datetime(2023, 1, 21), plan=plan)
+
+
+class TestWriters(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=50)
+
+    def query(self):
+        query = Query()
+        query.session = CatalogueSession(self.catalogue)
+        query.set_top(7)
+        query.set_expand(attributes=True)
+        return query
+
+    def test_jsonl(self):
+        import io
+        import gzip
+        output = io.BytesIO()
+        self.assertEqual(write_jsonl(self.query().products(), output, compress=True), 50)
+        lines = gzip.decompress(output.getvalue()).decode().splitlines()
+        self.assertEqual([json.loads(line)['Id'] for line in lines],
+                         [product['Id'] for product in self.catalogue.products])
+
+    def test_geojson(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.geojson')
+            self.assertEqual(write_geojson(self.query().products(max_pages=2), path), 14)
+            with open(path) as file:
+                collection = json.load(file)
+
+        self.assertEqual(collection['type'], 'FeatureCollection')
+        self.assertEqual(len(collection['features']), 14)
+        product = self.catalogue.products[0]
+        feature = collection['features'][0]
+        self.assertEqual(feature['id'], product['Id'])
+        self.assertEqual(feature['geometry'], product['GeoFootprint'])
+        self.assertEqual(feature['properties']['Name'], product['Name'])
+        self.assertNotIn('Footprint', feature['properties'])
+        self.assertNotIn('@odata.mediaContentType', feature['properties'])
+        for attribute in product['Attributes']:
+            self.assertEqual(feature['properties'][attribute['Name']], attribute['Value'])
+
+    def test_empty_geojson(self):
+        import io
+        output = io.BytesIO()
+        with GeoJsonWriter(output):
+            pass
+        self.assertEqual(json.loads(output.getvalue()), {'type': 'FeatureCollection', 'features': []})
+
+
+class TestNaming(unittest.TestCase):
+    S1 = 'S1A_IW_GRDH_1SDV_20230702T064631_20230702T064656_049229_05EB8E_1A2B.SAFE'
+    S2 = 'S2A_MSIL1C_20230702T064631_N0509_R020_T42VWN_20230702T083443.SAFE'
+    S3 = 'S3A_OL_1_EFR____20230702T064631_20230702T064931_20230703T110224_0179_100_334_1980_PS1_O_NT_003.SEN3'
+    S5P = 'S5P_OFFL_L2__NO2____20230702T031529_20230702T045659_29629_03_020500_20230703T204221.nc'
+
+    def test_parse_name(self):
+        s1 = parse_name(self.S1)
+        self.assertEqual((s1.mission, s1.product_type, s1.level, s1.mode), ('S1A', 'IW_GRDH_1S', 'L1', 'IW'))
+        self.assertEqual((s1.absolute_orbit, s1.relative_orbit), (49229, 157))
+        self.assertEqual(s1.stop, datetime(2023, 7, 2, 6, 46, 56))
+
+        s2 = parse_name(self.S2)
+        self.assertEqual((s2.mission, s2.product_type, s2.level, s2.tile, s2.baseline, s2.relative_orbit),
+                         ('S2A', 'S2MSI1C', 'L1C', '42VWN', 509, 20))
+        self.assertEqual((s2.start, s2.generated), (datetime(2023, 7, 2, 6, 46, 31), datetime(2023, 7, 2, 8, 34, 43)))
+
+        s3 = parse_name(self.S3)
+        self.assertEqual((s3.product_type, s3.level, s3.mode, s3.relative_orbit, s3.baseline),
+                         ('OL_1_EFR___', 'L1', 'OL', 334, 3))
+
+        s5p = parse_name(self.S5P)
+        self.assertEqual((s5p.product_type, s5p.level, s5p.absolute_orbit, s5p.baseline),
+                         ('L2__NO2___', 'L2', 29629, 20500))
+
+        self.assertIsNone(parse_name('S2A_something.SAFE').mission)
+        self.assertIsNone(parse_name('LC08_L1TP_042034_20230702_20230710_02_T1').mission)
+
+    def test_parse_names(self):
+        catalogue = SyntheticCatalogue(size=30)
+        page = {'value': catalogue.products[10:]}
+        columns = parse_names([catalogue.products[0]['Name'], catalogue.products[1], page])
+        self.assertEqual(len(columns['name']), 22)
+        product_types = {attribute['Value'] for product in catalogue.products[10:]
+                         for attribute in product['Attributes'] if attribute['Name'] == 'productType'}
+        self.assertEqual(set(columns['product_type'][2:]), product_types)
+        self.assertEqual(parse_names([]), {'name': [], **{field: [] for field in parse_name(self.S2)._fields}})
+
+    def test_group_and_deduplicate(self):
+        reprocessed = self.S2.replace('N0509', 'N0510').replace('20230702T083443', '20240101T000000')
+        other_tile = self.S2.replace('T42VWN', 'T42VWP')
+        other_day = self.S2.replace('20230702T064631', '20230712T064631')
+        names = [self.S2, other_tile, reprocessed, other_day, self.S1, 'unknown', 'unknown']
+
+        groups = group_by(names, 'tile')
+        self.assertEqual(groups[('42VWN',)], [self.S2, reprocessed, other_day])
+        self.assertEqual(groups[(None,)], [self.S1, 'unknown', 'unknown'])
+        self.assertEqual(latest_baseline(names), [reprocessed, other_tile, other_day, self.S1, 'unknown', 'unknown'])
+
+
+class TestDiff(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=100)
+
+    def snapshots(self):
+        old = [dict(product) for product in self.catalogue.products[:80]]
+        new = [dict(product) for product in self.catalogue.products[10:]]
+        for product in new[:5]:
+            product['ModificationDate'] = '2024-01-01T00:00:00.000Z'
+        return old, new
+
+    def test_diff(self):
+        old, new = self.snapshots()
+        changes = diff(old, reversed(new))
+        self.assertEqual({p['Id'] for p in changes.added}, {p['Id'] for p in self.catalogue.products[80:]})
+        self.assertEqual({p['Id'] for p in changes.removed}, {p['Id'] for p in self.catalogue.products[:10]})
+        self.assertEqual({p['Id'] for p in changes.modified}, {p['Id'] for p in new[:5]})
+
+        changes = diff(old, new, key='Name')
+        self.assertEqual((len(changes.added), len(changes.removed), len(changes.modified)), (20, 10, 5))
+
+    def test_diff_sorted(self):
+        import random
+        import tempfile
+        old, new = self.snapshots()
+        random.Random(1).shuffle(new)
+        expected = diff(old, new)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'old.jsonl.gz')
+            write_jsonl(old, path)  # the catalogue products are sorted by Id
+            changes = list(diff_sorted(read_snapshot(path), sort_products(new, chunk_size=7, directory=directory)))
+            self.assertEqual(os.listdir(directory), ['old.jsonl.gz'])
+
+            products = sort_products(new, chunk_size=7, directory=directory)
+            next(products)
+            products.close()  # the runs are closed before they are removed
+            self.assertEqual(os.listdir(directory), ['old.jsonl.gz'])
+
+        for change in expected._fields:
+            self.assertEqual(sorted(p['Id'] for c, p in changes if c == change),
+                             sorted(p['Id'] for p in getattr(expected, change)))
+        with self.assertRaises(ValueError):
+            list(diff_sorted(old, new))
+
+
+class TestPlanner(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=600, days=10)
+
+    def client(self):
+        session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        return Client(session=session), session
+
+    def expected(self, collection, day):
+        day = day.isoformat()
+        return sum(1 for product in self.catalogue.products
+                   if product['Collection']['Name'] == collection and product['ContentDate']['Start'][:10] == day)
+
+    def test_refresh(self):
+        from datetime import date
+        client, session = self.client()
+        metrics = MetricsRegistry()
+        histogram = CountHistogram(client, metrics=metrics)
+        self.assertEqual(histogram.refresh(['SENTINEL-1', 'SENTINEL-2'], date(2023, 1, 1), date(2023, 1, 11)), 20)
+        self.assertTrue(all('$count=True' in url and '$top=0' in url for method, url, body in session.calls))
+
+        counts = histogram.histogram('SENTINEL-2', date(2023, 1, 1), date(2023, 1, 11))
+        self.assertEqual(counts, {day: self.expected('SENTINEL-2', day) for day in counts})
+        self.assertEqual(len(counts), 10)
+        self.assertEqual(histogram.count('SENTINEL-1', date(2023, 1, 1), date(2023, 1, 11)), 200)
+
+        # settled days are not requested again, the new ones are
+        self.assertEqual(histogram.refresh(['SENTINEL-2'], date(2023, 1, 5), date(2023, 1, 13)), 2)
+        self.assertEqual(len(session.calls), 22)
+        self.assertEqual(metrics.counter('copernicus_cache_hits_total', cache='histogram'), 6)
+
+        # a filter has its own counts
+        self.assertEqual(CountHistogram(client, fltr="contains(Name,'MSIL2A')").histogram(
+            'SENTINEL-2', date(2023, 1, 1), date(2023, 1, 11)), {})
+
+    def test_unsettled_days(self):
+        from datetime import date
+        client, session = self.client()
+        histogram = CountHistogram(client, settle=10 ** 10, ttl=0)
+        histogram.refresh(['SENTINEL-3'], date(2023, 1, 1), date(2023, 1, 3))
+        histogram.refresh(['SENTINEL-3'], date(2023, 1, 1), date(2023, 1, 3))
+        self.assertEqual(len(session.calls), 4)
+
+    def test_grid(self):
+        from datetime import date
+        client, session = self.client()
+        histogram = CountHistogram(client, cell_size=90)
+        self.assertEqual(histogram.refresh(['SENTINEL-1'], date(2023, 1, 1), date(2023, 1, 2)), 9)
+        grid = histogram.grid('SENTINEL-1', date(2023, 1, 1))
+        self.assertGreaterEqual(sum(grid.values()), self.expected('SENTINEL-1', date(2023, 1, 1)))
+        self.assertTrue(set(grid) <= set(histogram.cells()))
+
+        calls = len(session.calls)
+        with self.assertRaises(ValueError):
+            CountHistogram(client, cell_size=1).refresh(['SENTINEL-1'], date(2023, 1, 1), date(2023, 1, 2))
+        self.assertEqual(len(session.calls), calls)
+
+    def test_plan(self):
+        from datetime import date
+        client, session = self.client()
+        histogram = CountHistogram(client)
+        histogram.refresh(['SENTINEL-1'], date(2023, 1, 1), date(2023, 1, 11))
+        counts = histogram.histogram('SENTINEL-1', date(2023, 1, 1), date(2023, 1, 11))
+        max_count = max(counts.values()) - 1
+        windows = histogram.plan(['SENTINEL-1'], date(2023, 1, 1), date(2023, 1, 11), max_count=max_count)
+        self.assertEqual(windows[0][1], datetime(2023, 1, 1))
+        self.assertEqual(windows[-1][2], datetime(2023, 1, 11))
+        for (_, _, end), (_, start, _) in zip(windows, windows[1:]):
+            self.assertEqual(end, start)
+
+        query = Query()
+        query.session = session
+        for collection, start, end in windows:
+            f = Filter()
+            f.collection(collection)
+            f.And()
+            f.by_sensing_date(start, end - timedelta(milliseconds=1))
+            query.set_filter(f)
+            query.set_count(True)
+            query.set_top(0)
+            self.assertLessEqual(query.send()['@odata.count'], max_count)
+
+        self.assertEqual(len(histogram.plan(['SENTINEL-1'], date(2023, 1, 1), date(2023, 1, 11), max_count=10 ** 6)),
+                         1)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def queue(self, scheduler, priority, order):
+        def run():
+            with scheduler.slot(priority):
+                order.append(priority)
+
+        waiting = sum(stats['waiting'] for stats in scheduler.stats().values())
+        thread = threading.Thread(target=run)
+        thread.start()
+        while sum(stats['waiting'] for stats in scheduler.stats().values()) == waiting:
+            time.sleep(0.001)
+        return thread
+
+    def test_weighted_fair_queuing(self):
+        scheduler = RequestScheduler(max_concurrency=1)
+        order = []
+        scheduler.acquire(INTERACTIVE)
+        threads = [self.queue(scheduler, BATCH, order) for _ in range(4)]
+        threads += [self.queue(scheduler, INTERACTIVE, order) for _ in range(4)]
+        self.assertEqual(scheduler.stats()[BATCH]['waiting'], 4)
+        scheduler.release(INTERACTIVE)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [INTERACTIVE] * 4 + [BATCH] * 4)
+
+    def test_shares(self):
+        scheduler = RequestScheduler(max_concurrency=1, classes=[PriorityClass('a', weight=2), PriorityClass('b')],
+                                     default='a')
+        order = []
+        scheduler.acquire()
+        threads = [self.queue(scheduler, 'b', order) for _ in range(3)]
+        threads += [self.queue(scheduler, 'a', order) for _ in range(6)]
+        scheduler.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['a', 'b', 'a', 'a', 'b', 'a', 'a', 'b', 'a'])
+
+    def test_class_cap_and_timeout(self):
+        scheduler = RequestScheduler(max_concurrency=4, classes=[PriorityClass(INTERACTIVE),
+                                                                 PriorityClass(BATCH, max_concurrency=1)])
+        scheduler.acquire(BATCH)
+        with self.assertRaises(errors.DeadlineExceeded):
+            scheduler.acquire(BATCH, timeout=0.01)
+        self.assertGreaterEqual(scheduler.acquire(INTERACTIVE, timeout=0.01), 0)
+        self.assertEqual(scheduler.stats()[BATCH], {'running': 1, 'waiting': 0, 'admitted': 1,
+                                                    'queue_seconds': scheduler.stats()[BATCH]['queue_seconds']})
+        with self.assertRaises(ValueError):
+            scheduler.acquire('unknown')
+
+    def test_query(self):
+        metrics = MetricsRegistry()
+        scheduler = RequestScheduler(max_concurrency=2, metrics=metrics)
+        query = Query()
+        query.session = FakeSession(payload={'value': []})
+        query.scheduler = scheduler
+        query.priority = BATCH
+        query.send()
+        query.by_names(['a.SAFE'])
+        self.assertEqual(metrics.counter('copernicus_scheduler_requests_total', priority=BATCH), 2)
+        self.assertEqual(scheduler.stats()[BATCH]['running'], 0)
+
+    def test_shared_client(self):
+        scheduler = RequestScheduler(max_concurrency=2)
+        client = Client(session=FakeSession(payload={'value': []}), scheduler=scheduler)
+        interactive, batch = Query(), Query()
+        for query, priority in ((interactive, INTERACTIVE), (batch, BATCH)):
+            query.client = client
+            query.priority = priority
+        interactive.send()
+        batch.send()
+        batch.by_names(['a.SAFE'])
+        self.assertEqual(scheduler.stats()[INTERACTIVE]['admitted'], 1)
+        self.assertEqual(scheduler.stats()[BATCH]['admitted'], 2)
+
+
+def _product_name(product):
+    return product['Name']
+
+
+class TestPipeline(unittest.TestCase):
+    catalogue = SyntheticCatalogue(size=100)
+
+    def query(self, session):
+        query = Query()
+        query.session = session
+        query.set_top(5)
+        return query
+
+    def test_run(self):
+        session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        pipeline = Pipeline(self.query(session).pages())
+        pipeline.flat_map(page_products)
+        pipeline.map(_product_name, workers=2, processes=True)
+        pipeline.map(lambda name: name if name.startswith('S2') else None, workers=3, name='s2')
+        names = []
+        self.assertEqual(pipeline.run(names.append), len(names))
+        self.assertEqual(sorted(names), sorted(p['Name'] for p in self.catalogue.products if p['Name'][:2] == 'S2'))
+        self.assertEqual(len(session.calls), 20)
+        self.assertEqual(pipeline.stats()['_product_name']['items'], 100)
+
+    def test_backpressure(self):
+        session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        release = threading.Event()
+
+        def slow(product):
+            release.wait()
+            return product
+
+        pipeline = Pipeline(self.query(session).pages(), queue_size=1)
+        pipeline.flat_map(page_products, queue_size=1)
+        pipeline.map(slow)
+        iterator = iter(pipeline)
+        thread = threading.Thread(target=lambda: next(iterator))
+        thread.start()
+        time.sleep(0.3)
+        # one page being flattened, one in the queue, one held by the source
+        self.assertLessEqual(len(session.calls), 3)
+        release.set()
+        thread.join()
+        iterator.close()
+        self.assertLess(len(session.calls), 20)
+
+    def test_error(self):
+        def fail(page):
+            raise ValueError('broken page')
+
+        session = FakeSession(payload=lambda method, url, body: self.catalogue.handle(method, url, body)[1])
+        pipeline = Pipeline(self.query(session).pages())
+        pipeline.map(fail, workers=2)
+        with self.assertRaises(ValueError):
+            pipeline.run()
+        with self.assertRaises(RuntimeError):
+            pipeline.run()
+
+
+def _square(x: float, y: float, size: float) -> [[float]]:
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+class TestFootprints(unittest.TestCase):
+
+    def footprints(self):
+        footprints = Footprints()
+        footprints.append({'type': 'Polygon', 'coordinates': [_square(0, 0, 2), _square(0.5, 0.5, 1)]}, 'hole')
+        footprints.append({'type': 'MultiPolygon', 'coordinates': [[_square(0, 0, 1)], [_square(2, 0, 1)]]}, 'multi')
+        footprints.append(None, 'none')
+        footprints.append({'type': 'Polygon', 'coordinates': [list(reversed(_square(10, 10, 1)))]}, 'clockwise')
+        return footprints
+
+    def assertArray(self, values, expected):
+        self.assertEqual(len(values), len(expected))
+        for value, expected_value in zip(values, expected):
+            if expected_value != expected_value:  # NaN
+                self.assertNotEqual(value, value)
+            else:
+                self.assertAlmostEqual(value, expected_value)
+
+    def test_computations(self):
+        footprints = self.footprints()
+        self.assertEqual(len(footprints), 4)
+        self.assertArray(footprints.areas(), [3.0, 2.0, 0.0, 1.0])
+        xs, ys = footprints.centroids()
+        self.assertArray(xs, [1.0, 1.5, float('nan'), 10.5])
+        self.assertArray(ys, [1.0, 0.5, float('nan'), 10.5])
+        min_xs, min_ys, max_xs, max_ys = footprints.bboxes()
+        self.assertArray(min_xs, [0.0, 0.0, float('nan'), 10.0])
+        self.assertArray(max_xs, [2.0, 3.0, float('nan'), 11.0])
+
+        aoi = 'POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))'
+        self.assertArray(footprints.coverage(aoi), [0.75, 1.0, 0.0, 0.0])
+        self.assertArray(footprints.coverage([(0.5, 0), (1.5, 0), (0.5, 1)]), [0.75, 0.75, 0.0, 0.0])
+        self.assertEqual(footprints.rank({'type': 'Polygon', 'coordinates': [_square(0, 0, 1)]})[:2], [1, 0])
+        with self.assertRaises(ValueError):
+            footprints.coverage([(0, 0), (2, 0), (1, 0.5), (2, 2), (0, 2)])
+
+    def test_from_products(self):
+        catalogue = SyntheticCatalogue(size=30)
+        products = [dict(product) for product in catalogue.products]
+        geometries = [product['GeoFootprint'] for product in products]
+        footprints = Footprints.from_products([{'value': products[:10]}] + products[10:])
+        self.assertEqual(footprints.ids, [product['Id'] for product in products])
+        self.assertFalse(any('GeoFootprint' in product or 'Footprint' in product for product in products))
+        self.assertEqual([footprints.geometry(i) for i in range(30)], geometries)
+        self.assertEqual(footprints.nbytes, 30 * 5 * 2 * 8 + 31 * 8 * 2 + 30)
+        self.assertArray(footprints.areas(), [1.0] * 30)
+
+
+class TestResultStore(unittest.TestCase):
+
+    def test_round_trip(self):
+        import tempfile
+        catalogue = SyntheticCatalogue(size=200)
+        products = [{name: value for name, value in product.items() if name != '_bbox'}
+                    for product in catalogue.products]
+        odd = [{'Id': 'odd', 'S3Path': None, 'Online': None, 'GeoFootprint': {'type': 'Point', 'coordinates': [1, 2]},
+                'ContentLength': 1.5, 'ContentDate': {'Start': '2023-01-01T00:00:00.000000Z'}, 'EvictionDate': ''},
+               {'Name': 'é', 'ContentDate': {}}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.cdse')
+            with ResultStoreWriter(path, buffer_size=64) as writer:
+                self.assertEqual(writer.write_all(products + odd), 202)
+            self.assertEqual(os.listdir(directory), ['products.cdse'])
+
+            with ResultStore(path) as store:
+                self.assertEqual(len(store), 202)
+                expected = [{name: value for name, value in product.items() if name != 'Footprint'}
+                            for product in products] + odd
+                self.assertEqual(store[5], expected[5])
+                self.assertEqual(store[-1], expected[-1])
+                self.assertEqual(list(store), expected)
+                with self.assertRaises(IndexError):
+                    store[202]
+
+                self.assertEqual(store.strings('Name')[3], products[3]['Name'])
+                self.assertEqual(list(store.strings('Id'))[:200], [product['Id'] for product in products])
+                self.assertEqual(store.column('ContentLength')[7], products[7]['ContentLength'])
+                self.assertEqual(list(store.column('Online')[-2:]), [-1, -1])
+                self.assertEqual(store.column('ContentDate/Start')[0] // 1000000,
+                                 int(datetime.fromisoformat(products[0]['ContentDate']['Start']).timestamp()))
+
+                footprints = store.footprints()
+                self.assertIsInstance(footprints.xs, memoryview)
+                self.assertEqual(len(footprints), 202)
+                self.assertEqual(footprints.ids[1], products[1]['Id'])
+                self.assertAlmostEqual(footprints.areas()[0], 1.0)
+                self.assertEqual(footprints.geometry(201), None)
+                self.assertAlmostEqual(footprints.coverage(products[9]['GeoFootprint'])[9], 1.0)
+
+    def test_abort(self):
+        import tempfile
+        products = [{'Id': str(i), 'ContentLength': i} for i in range(50)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.cdse')
+            with ResultStoreWriter(path) as writer:
+                writer.write_all(products)
+
+            with self.assertRaises(RuntimeError):
+                with ResultStoreWriter(path) as writer:
+                    writer.write(products[0])
+                    raise RuntimeError('harvest failed')
+            self.assertEqual(os.listdir(directory), ['products.cdse'])
+            with ResultStore(path) as store:
+                self.assertEqual(len(store), 50)
+                self.assertEqual(store[49], products[49])
+
+    def test_not_a_store(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.jsonl')
+            with open(path, 'wb') as file:
+                file.write(b'{"Id": "a"}\n')
+            with self.assertRaises(ValueError):
+                ResultStore(path)
+
+            path = os.path.join(directory, 'empty.cdse')
+            ResultStoreWriter(path).close()
+            with ResultStore(path) as store:
+                self.assertEqual(len(store), 0)
+                self.assertEqual(list(store), [])
+
+
 class TestFilter(unittest.TestCase):
     maxDiff = None
 